@@ -1,11 +1,16 @@
 from aiogram import types
 from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove,KeyboardButton
 from aiogram import executor
-from logging import basicConfig, INFO
+from logging import basicConfig, INFO, info
 
 from handlers import admin_menu, user_menu
-from loader import dp, bot, db
+from loader import dp, bot, db, storage, catalog_cache, sender, metrics, roles, \
+    cart_presses
+from data import config
 from data.config import ADMINS
+from utils.roles import ADMIN, USER
+from utils.webhook import start_webhook
+from utils.workers import start_workers
 import handlers
 
 user_message = 'Пользователь'
@@ -32,9 +37,7 @@ async def cmd_start(message: types.Message):
 
 @dp.message_handler(text=admin_message)
 async def admin_mode(message: types.Message):
-    cid = message.chat.id
-    if cid not in ADMINS:
-        ADMINS.append(cid)
+    await roles.set(message.from_user.id, ADMIN)
 
     await message.answer('Включен админский режим.', reply_markup=ReplyKeyboardRemove())
 
@@ -43,9 +46,7 @@ async def admin_mode(message: types.Message):
 
 @dp.message_handler(text=user_message)
 async def user_mode(message: types.Message):
-    cid = message.chat.id
-    if cid in ADMINS:
-        ADMINS.remove(cid)
+    await roles.set(message.from_user.id, USER)
 
     await message.answer('Включен пользовательский режим.', reply_markup=ReplyKeyboardRemove())
 
@@ -54,8 +55,49 @@ async def user_mode(message: types.Message):
 
 async def on_startup(dp):
     basicConfig(level=INFO)
-    db.create_tables()
+    await db.create_tables()
+    await roles.load(ADMINS)
+    if config.METRICS_PORT is not None:
+        await metrics.serve(config.METRICS_HOST, config.METRICS_PORT)
+
+
+async def on_shutdown(dp):
+    info('Catalog cache: %s', catalog_cache.stats())
+    info('Sender: %s', sender.stats())
+    await metrics.close()
+    # Отложенные нажатия в корзине меняют базу и состояния FSM
+    await cart_presses.close()
+    await sender.close()
+    # aiogram закрывает storage уже после on_shutdown, а состояния FSM
+    # нужно успеть записать, пока база открыта
+    await storage.close()
+    await db.close()
+
+
+# Основной процесс режима WORKER_PROCESSES: миграции выполняются один раз,
+# до запуска воркеров, а сам он в базу больше не обращается
+async def on_front_startup():
+    basicConfig(level=INFO)
+    await db.create_tables()
+    await db.close()
 
 
 if __name__ == '__main__':
-    executor.start_polling(dp, on_startup=on_startup, skip_updates=False)
+    if config.WORKER_PROCESSES:
+        webhook = config.UPDATES_MODE == 'webhook'
+        start_workers(dp, config.WORKER_PROCESSES, app='app',
+                      webhook_path=config.WEBHOOK_PATH if webhook else None,
+                      webhook_url=config.WEBHOOK_HOST + config.WEBHOOK_PATH,
+                      host=config.WEBAPP_HOST, port=config.WEBAPP_PORT,
+                      drain_timeout=config.WEBHOOK_DRAIN_TIMEOUT,
+                      on_startup=on_front_startup)
+    elif config.UPDATES_MODE == 'webhook':
+        start_webhook(dp, config.WEBHOOK_PATH, config.WEBHOOK_HOST + config.WEBHOOK_PATH,
+                      config.WEBAPP_HOST, config.WEBAPP_PORT,
+                      workers=config.WEBHOOK_WORKERS,
+                      queue_size=config.WEBHOOK_QUEUE_SIZE,
+                      drain_timeout=config.WEBHOOK_DRAIN_TIMEOUT,
+                      on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown,
+                               skip_updates=False)
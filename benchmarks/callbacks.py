@@ -0,0 +1,84 @@
+# Выбор обработчика нажатия кнопки: aiogram CallbackData.filter
+# (обработчики проверяются по очереди) против CallbackRouter из
+# utils/callbacks.py (поиск по словарю). Время апдейта для первого
+# и последнего зарегистрированного обработчика.
+#
+#     python -m benchmarks.callbacks --kinds 10 --actions 6 --repeat 5000
+
+import argparse
+import asyncio
+import string
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.utils.callback_data import CallbackData
+
+from utils.callbacks import Callback, CallbackRouter
+
+PREFIXES = string.ascii_uppercase + string.digits
+
+
+async def handler(query, callback_data):
+    pass
+
+
+def aiogram_dispatcher(kinds, actions):
+    dp = Dispatcher(Bot('123456:BENCH'))
+    data = []
+    for k in range(kinds):
+        cb = CallbackData(f'kind{k}', 'id', 'action')
+        for action in actions:
+            dp.register_callback_query_handler(handler, cb.filter(action=action))
+            data.append(cb.new(id='0123456789abcdef0123456789abcdef', action=action))
+    return dp, data
+
+
+def router_dispatcher(kinds, actions):
+    dp = Dispatcher(Bot('123456:BENCH'))
+    router = CallbackRouter()
+    router.setup(dp)
+    data = []
+    for k in range(kinds):
+        cb = Callback(f'kind{k}', PREFIXES[k], actions, 'id')
+        for action in actions:
+            router.register(handler, cb, action)
+            data.append(cb.new(id=1234, action=action))
+    return dp, data
+
+
+def update(data):
+    return types.Update(**{'update_id': 1, 'callback_query': {
+        'id': '1', 'chat_instance': '1', 'data': data,
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'user'},
+        'message': {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}}}})
+
+
+async def measure(dp, data, repeat):
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        # Каждый апдейт - в своей задаче, как при polling и webhook
+        await asyncio.ensure_future(dp.process_update(update(data)))
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kinds', type=int, default=10)
+    parser.add_argument('--actions', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=5000)
+    args = parser.parse_args()
+    actions = [f'action{a}' for a in range(args.actions)]
+
+    print(f'{args.kinds * args.actions} button handlers\n')
+    print(f'{"":<16}{"first, us":>12}{"last, us":>12}{"data bytes":>12}')
+    for name, make in ('CallbackData', aiogram_dispatcher), ('CallbackRouter', router_dispatcher):
+        dp, data = make(args.kinds, actions)
+        results = [await measure(dp, data[i], args.repeat) for i in (0, -1)]
+        print(f'{name:<16}' + ''.join(f'{us:>12.1f}' for us in results) + f'{len(data[-1]):>12}')
+        await dp.bot.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
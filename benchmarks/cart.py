@@ -0,0 +1,131 @@
+# Гонки при изменении количества товара в корзине: несколько процессов
+# (как воркеры WORKER_PROCESSES или два устройства пользователя) и по
+# нескольку задач в каждом одновременно жмут "+" у одного товара.
+#
+#   read-write - прежний способ: прочитать количество, записать новое
+#                значение отдельным запросом (UPDATE cart SET quantity = ?)
+#   atomic     - utils/cart.py: один запрос с RETURNING
+#
+# После прогона количество в базе сравнивается с числом нажатий.
+#
+#     python -m benchmarks.cart --processes 4 --tasks 8 --presses 200
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from utils.cart import add_to_cart, change_quantity
+from utils.db import AsyncDatabaseManager, DatabaseManager
+
+CID = 1
+# id единственного товара в пустой базе
+PRODUCT = 1
+
+
+async def read_write(db):
+    row = await db.fetchone('''SELECT quantity FROM cart
+    WHERE cid = ? AND idx = (SELECT idx FROM products WHERE id = ?)''', (CID, PRODUCT))
+    if row is None:
+        await db.query('INSERT OR IGNORE INTO cart SELECT ?, idx, 1 FROM products WHERE id = ?',
+                       (CID, PRODUCT))
+    else:
+        await db.query('''UPDATE cart SET quantity = ?
+        WHERE cid = ? AND idx = (SELECT idx FROM products WHERE id = ?)''',
+                       (row[0] + 1, CID, PRODUCT))
+
+
+async def atomic(db):
+    await add_to_cart(db, CID, PRODUCT)
+
+
+MODES = {'read-write': read_write, 'atomic': atomic}
+
+
+async def press(path, mode, tasks, presses):
+    db = AsyncDatabaseManager(path)
+    operation = MODES[mode]
+
+    async def user():
+        for _ in range(presses):
+            await operation(db)
+            # Нажатие уступает цикл, как хендлер между апдейтами
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(user() for _ in range(tasks)))
+    await db.close()
+
+
+def worker(path, mode, tasks, presses, start):
+    start.wait()
+    asyncio.run(press(path, mode, tasks, presses))
+
+
+def prepare(path):
+    db = DatabaseManager(path)
+    db.create_tables()
+    db.query('INSERT INTO products (id, idx, title, body, price, tag) VALUES (?, ?, ?, ?, ?, ?)',
+             (PRODUCT, 'product', 'Товар', '', 100, 'tag'))
+    db.conn.close()
+
+
+async def check_decrease(path):
+    # Уменьшение до нуля удаляет позицию, дальше уменьшать нечего
+    db = AsyncDatabaseManager(path)
+    await db.query('DELETE FROM cart')
+    await add_to_cart(db, CID, PRODUCT, 5)
+    results = await asyncio.gather(*(change_quantity(db, CID, PRODUCT, -1) for _ in range(8)))
+    rows = await db.fetchone('SELECT COUNT(*) FROM cart')
+    await db.close()
+    return sorted(results, key=lambda r: (r is None, -(r or 0))), rows[0]
+
+
+def run(tmp, mode, args):
+    path = os.path.join(tmp, f'{mode}.db')
+    prepare(path)
+
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    processes = [context.Process(target=worker,
+                                 args=(path, mode, args.tasks, args.presses, start))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    began = time.perf_counter()
+    start.set()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - began
+
+    db = DatabaseManager(path)
+    quantity, = db.fetchone('SELECT quantity FROM cart')
+    rows, = db.fetchone('SELECT COUNT(*) FROM cart')
+    db.conn.close()
+    return quantity, rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--tasks', type=int, default=8, help='одновременных нажатий в процессе')
+    parser.add_argument('--presses', type=int, default=200, help='нажатий на задачу')
+    args = parser.parse_args()
+
+    expected = args.processes * args.tasks * args.presses
+    print(f'{args.processes} processes x {args.tasks} tasks x {args.presses} presses'
+          f' = {expected} increments\n')
+    print(f'{"":<12}{"quantity":>10}{"lost":>8}{"rows":>6}{"us/op":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in MODES:
+            quantity, rows, elapsed = run(tmp, mode, args)
+            print(f'{mode:<12}{quantity:>10}{expected - quantity:>8}{rows:>6}'
+                  f'{elapsed / expected * 10 ** 6:>8.0f}')
+
+        results, rows = asyncio.run(check_decrease(os.path.join(tmp, 'atomic.db')))
+        print(f'\n5 in cart, 8 concurrent decreases: {results}, rows left: {rows}')
+
+
+if __name__ == '__main__':
+    main()
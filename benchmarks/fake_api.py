@@ -0,0 +1,194 @@
+# Локальная замена Telegram Bot API для нагрузочных тестов.
+# Понимает методы, которыми пользуется бот (getUpdates, sendMessage, sendPhoto,
+# sendMediaGroup, editMessage*, deleteMessage, answerCallbackQuery, ...),
+# запоминает последние сообщения каждого чата вместе с клавиатурами,
+# чтобы симулятор пользователя мог нажимать кнопки, и при превышении
+# flood_rate сообщений в секунду в чат отвечает 429, как Telegram.
+#
+# Бот направляется сюда подменой aiogram.bot.api.API_URL (см. FakeBotAPI.api_url).
+
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+from utils.sender import TokenBucket
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Shop', 'username': 'shop_bot'}
+
+# Сколько последних сообщений чата хранится для поиска кнопок
+HISTORY = 20
+
+FLOOD_LIMITED = ('send', 'edit', 'forward', 'copy')
+
+
+class FakeBotAPI:
+
+    def __init__(self, flood_rate=None, flood_burst=5, latency=0.0):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_burst = flood_burst
+        self.calls = Counter()
+        self.flooded = 0
+        self.chats = defaultdict(lambda: deque(maxlen=HISTORY))
+        self._buckets = {}
+        self._updates = deque()
+        self._new_updates = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._runner = None
+        self.url = None
+
+        self.app = web.Application(client_max_size=20 * 1024 ** 2)
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def api_url(self):
+        # Значение для aiogram.bot.api.API_URL
+        return self.url + '/bot{token}/{method}'
+
+    # Апдейты для getUpdates
+    def push_update(self, update):
+        self._updates.append(update)
+        self._new_updates.set()
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        params = dict(await request.post())
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.flood_rate and method.startswith(FLOOD_LIMITED) and 'chat_id' in params:
+            retry_after = self._flood_wait(params['chat_id'])
+            if retry_after:
+                self.flooded += 1
+                return web.json_response({
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {retry_after}',
+                    'parameters': {'retry_after': retry_after}}, status=429)
+
+        handler = getattr(self, 'on_' + method, None)
+        result = await handler(params) if handler is not None else True
+        return web.json_response({'ok': True, 'result': result})
+
+    def _flood_wait(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.flood_rate, self.flood_burst)
+        now = time.monotonic()
+        wait = bucket.reserve(now)
+        if wait > 0:
+            # Отклоненный запрос не занимает место в лимите
+            bucket.tat -= bucket.interval
+            return max(1, round(wait))
+        return 0
+
+    async def on_getMe(self, params):
+        return BOT_USER
+
+    async def on_getUpdates(self, params):
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+
+        # timeout 0 - короткий опрос: ответ сразу, даже пустой
+        timeout = float(params.get('timeout', 0))
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return list(itertools.islice(self._updates, limit))
+
+    def _message(self, params, **content):
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            **content,
+        }
+        if 'reply_markup' in params:
+            message['reply_markup'] = json.loads(params['reply_markup'])
+        self.chats[chat_id].append(message)
+        return message
+
+    def _photo(self, photo):
+        # Загруженный файл получает новый file_id, переданный file_id сохраняется
+        file_id = photo if isinstance(photo, str) else f'photo{next(self._file_ids)}'
+        return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 800, 'height': 800}]
+
+    async def on_sendMessage(self, params):
+        return self._message(params, text=params['text'])
+
+    async def on_sendPhoto(self, params):
+        return self._message(params, photo=self._photo(params['photo']),
+                             caption=params.get('caption', ''))
+
+    async def on_sendMediaGroup(self, params):
+        media = json.loads(params['media'])
+        return [self._message(params, photo=self._photo(
+            params[item['media'][len('attach://'):]]
+            if item['media'].startswith('attach://') else item['media']),
+            media_group_id='1') for item in media]
+
+    def _find(self, params):
+        chat_id = int(params['chat_id'])
+        message_id = int(params['message_id'])
+        for message in self.chats[chat_id]:
+            if message['message_id'] == message_id:
+                return message
+        # Сообщение старше HISTORY: отвечаем заглушкой
+        return self._message({'chat_id': chat_id}, text='')
+
+    def _edit(self, params, **content):
+        message = self._find(params)
+        message.update(content, edit_date=int(time.time()))
+        if 'reply_markup' in params:
+            message['reply_markup'] = json.loads(params['reply_markup'])
+        else:
+            message.pop('reply_markup', None)
+        return message
+
+    async def on_editMessageText(self, params):
+        return self._edit(params, text=params['text'])
+
+    async def on_editMessageCaption(self, params):
+        return self._edit(params, caption=params.get('caption', ''))
+
+    async def on_editMessageReplyMarkup(self, params):
+        return self._edit(params)
+
+    async def on_editMessageMedia(self, params):
+        media = json.loads(params['media'])
+        photo = media['media']
+        if photo.startswith('attach://'):
+            photo = params[photo[len('attach://'):]]
+        return self._edit(params, photo=self._photo(photo), caption=media.get('caption', ''))
+
+    async def on_deleteMessage(self, params):
+        chat = self.chats[int(params['chat_id'])]
+        message_id = int(params['message_id'])
+        for message in list(chat):
+            if message['message_id'] == message_id:
+                chat.remove(message)
+        return True
@@ -0,0 +1,67 @@
+# Накладные расходы хранилища FSM на один апдейт: MemoryStorage против
+# SQLiteStorage с горячими сессиями в памяти и с сессиями, которые
+# каждый раз читаются из базы (ttl=0).
+#
+#     python -m benchmarks.fsm_storage --users 1000 --updates 20000
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher import FSMContext
+
+from utils.db import AsyncDatabaseManager
+from utils.fsm_storage import SQLiteStorage
+
+
+async def update(storage, user):
+    # То, что делает типичный шаг диалога (например, добавление товара админом)
+    state = FSMContext(storage, chat=user, user=user)
+    await state.get_state()
+    async with state.proxy() as data:
+        data['step'] = data.get('step', 0) + 1
+        data['title'] = 'product title'
+    await state.set_state('AddProductState:body')
+
+
+async def run(storage, users, updates):
+    r = random.Random(1)
+    start = time.perf_counter()
+    for _ in range(updates):
+        await update(storage, r.randrange(users))
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await storage.close()
+    return elapsed / updates * 1e6, time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--updates', type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {'MemoryStorage': await run(MemoryStorage(), args.users, args.updates)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabaseManager(os.path.join(tmp, 'bench.db'))
+        await db.create_tables()
+        for name, ttl in ('SQLiteStorage hot', 3600), ('SQLiteStorage cold', 0):
+            storage = SQLiteStorage(db, flush_interval=0.05, ttl=ttl)
+            results[name] = await run(storage, args.users, args.updates)
+        rows = (await db.fetchone('SELECT COUNT(*) FROM fsm'))[0]
+        await db.close()
+
+    print(f'{args.updates} updates over {args.users} users, {rows} rows in fsm\n')
+    print(f'{"storage":<22}{"per update, us":>16}{"final flush, ms":>17}')
+    for name, (per_update, flush) in results.items():
+        print(f'{name:<22}{per_update:>16.1f}{flush * 1000:>17.1f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,273 @@
+# Нагрузочный тест бота целиком: настоящие хендлеры, база и планировщик
+# отправки, а вместо Telegram - локальный сервер benchmarks.fake_api.
+# Тысячи симулированных пользователей проходят сценарии (каталог,
+# корзина, изменение количества, оформление заказа, /sos), нажимая кнопки
+# из сообщений бота. Выводятся перцентили времени обработки апдейта
+# и пропускная способность.
+#
+#     python -m benchmarks.load --users 1000
+#     python -m benchmarks.load --users 1000 --mode webhook
+#     python -m benchmarks.load --users 200 --telegram-limits
+#
+# База создается во временном каталоге, data/database.db не трогается.
+# Бот, сервер и пользователи работают в одном процессе и делят одно ядро,
+# так что цифры годятся для сравнения версий, а не как абсолютный предел.
+
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import ClientSession
+
+import aiogram.bot.api
+from benchmarks.fake_api import FakeBotAPI
+from utils import callbacks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CATEGORIES = 5
+PRODUCTS_PER_CATEGORY = 20
+
+
+def text(value):
+    return 'text', value
+
+
+def press(prefixes, action):
+    return 'press', (prefixes, action)
+
+
+# Сценарии: сообщения пользователя и нажатия кнопок по виду и действию callback_data
+JOURNEYS = {
+    'browse': [text('/menu'), text('🛍️ Каталог'),
+               press(('category',), 'view'),
+               press(('page',), 'next'), press(('page',), 'next'),
+               press(('page',), 'add'),
+               press(('page',), 'next'), press(('page',), 'add')],
+    'cart': [text('🛒 Корзина'),
+             press(('product', 'summary'), 'increase'),
+             press(('product', 'summary'), 'increase'),
+             press(('product', 'summary'), 'decrease')],
+    'checkout': [text('📦 Оформить заказ'), text('✅ Все верно'),
+                 text('Иван'), text('ул. Ленина, 1'), text('✅ Подтвердить заказ')],
+    'sos': [text('/sos'), text('Когда привезут заказ?'), text('✅ Все верно')],
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+
+class Timing(BaseMiddleware):
+
+    # Время обработки апдейта ботом: от начала до конца всех хендлеров
+    def __init__(self):
+        super().__init__()
+        self.latencies = []
+        self.waiters = {}
+
+    async def on_pre_process_update(self, update, data):
+        data['load_started'] = time.perf_counter()
+
+    async def on_post_process_update(self, update, results, data):
+        self.latencies.append(time.perf_counter() - data['load_started'])
+        waiter = self.waiters.pop(update.update_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+class Load:
+
+    def __init__(self, api, timing, deliver, think):
+        self.api = api
+        self.timing = timing
+        self.deliver = deliver
+        self.think = think
+        self.update_ids = iter(range(1, 10 ** 9))
+        self.roundtrips = []
+        self.steps = Counter()
+
+    async def _send(self, update):
+        waiter = self.timing.waiters[update['update_id']] = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await self.deliver(update)
+        await asyncio.wait_for(waiter, 60)
+        self.roundtrips.append(time.perf_counter() - start)
+
+    def _user(self, uid):
+        return {'id': uid, 'is_bot': False, 'first_name': f'user{uid}'}
+
+    async def text(self, uid, value):
+        update_id = next(self.update_ids)
+        await self._send({'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()),
+            'chat': {'id': uid, 'type': 'private'}, 'from': self._user(uid),
+            'text': value,
+            **({'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(value)}]}
+               if value.startswith('/') else {})}})
+        return True
+
+    async def press(self, uid, prefixes, action):
+        # Последняя по времени кнопка с нужным действием в сообщениях чата
+        for message in reversed(self.api.chats[uid]):
+            for row in message.get('reply_markup', {}).get('inline_keyboard', []):
+                for button in row:
+                    try:
+                        data = callbacks.parse(button.get('callback_data', ''))
+                    except ValueError:
+                        continue
+                    if data['@'] in prefixes and data['action'] == action:
+                        update_id = next(self.update_ids)
+                        await self._send({'update_id': update_id, 'callback_query': {
+                            'id': str(update_id), 'from': self._user(uid),
+                            'message': message, 'chat_instance': str(uid),
+                            'data': button['callback_data']}})
+                        return True
+        return False
+
+    async def journey(self, uid, names):
+        for name in names:
+            for kind, arg in JOURNEYS[name]:
+                if self.think:
+                    await asyncio.sleep(random.uniform(0, 2 * self.think))
+                if kind == 'text':
+                    done = await self.text(uid, arg)
+                else:
+                    done = await self.press(uid, *arg)
+                self.steps['done' if done else 'no button'] += 1
+
+
+def prepare(tmp, args):
+    # Бот импортируется в пустом каталоге: loader открывает data/database.db
+    # относительно текущего каталога
+    sys.path.insert(0, ROOT)
+    os.makedirs(os.path.join(tmp, 'data'))
+    os.chdir(tmp)
+
+    config = importlib.import_module('data.config')
+    config.BOT_TOKEN = '123456:LOADTEST'
+    config.CATALOG_MODE = args.catalog_mode
+    config.METRICS_PORT = None
+    if not args.telegram_limits:
+        config.SEND_GLOBAL_RATE = config.SEND_CHAT_RATE = 10 ** 6
+        config.SEND_CHAT_BURST = 10 ** 6
+
+    return importlib.import_module('app')
+
+
+async def seed(db):
+    r = random.Random(1)
+    for c in range(CATEGORIES):
+        await db.query('INSERT INTO categories (idx, title) VALUES (?, ?)',
+                       (f'c{c}', f'Категория {c}'))
+        for p in range(PRODUCTS_PER_CATEGORY):
+            photo_hash = await db.put_blob(r.randbytes(20000))
+            await db.query('''INSERT INTO products (idx, title, body, price, tag, photo_hash)
+            VALUES (?, ?, ?, ?, ?, ?)''',
+                           (f'c{c}p{p}', f'Товар {p}', 'Описание товара', 100 + p,
+                            f'Категория {c}', photo_hash))
+
+
+async def run(app, args):
+    from loader import dp, storage
+
+    api = FakeBotAPI(flood_rate=1 if args.telegram_limits else None,
+                     latency=args.api_latency / 1000)
+    await api.start()
+    aiogram.bot.api.API_URL = api.api_url()
+
+    timing = Timing()
+    dp.middleware.setup(timing)
+    await app.on_startup(dp)
+    # Логи каждого заказа заглушили бы отчет
+    logging.getLogger().setLevel(logging.WARNING)
+    await seed(app.db)
+
+    if args.mode == 'webhook':
+        from aiohttp import web
+        from utils.webhook import make_app
+
+        runner = web.AppRunner(make_app(dp, '/webhook', on_shutdown=app.on_shutdown),
+                               access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        url = 'http://{}:{}/webhook'.format(*runner.addresses[0][:2])
+        session = ClientSession()
+
+        async def deliver(update):
+            # Как Telegram: отказ - повторная доставка через Retry-After
+            while True:
+                async with session.post(url, json=update) as response:
+                    await response.read()
+                if response.status == 200:
+                    return
+                load.steps['redelivered'] += 1
+                await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+    else:
+        polling = asyncio.ensure_future(dp.start_polling(timeout=1))
+
+        async def deliver(update):
+            api.push_update(update)
+
+    load = Load(api, timing, deliver, args.think_ms / 1000)
+    journeys = args.journeys.split(',')
+    start = time.perf_counter()
+    await asyncio.gather(*(load.journey(100000 + uid, journeys) for uid in range(args.users)))
+    elapsed = time.perf_counter() - start
+
+    if args.mode == 'webhook':
+        await session.close()
+        await runner.cleanup()
+    else:
+        dp.stop_polling()
+        await polling
+        await app.on_shutdown(dp)
+        await storage.close()
+        await dp.bot.close()
+    await api.stop()
+
+    updates = len(timing.latencies)
+    print(f'{args.users} users, journeys {args.journeys}, mode {args.mode}, '
+          f'catalog {args.catalog_mode}, '
+          f'{"Telegram limits" if args.telegram_limits else "no rate limits"}\n')
+    print(f'updates: {updates} in {elapsed:.1f}s, {updates / elapsed:.0f} updates/s')
+    print(f'steps: {dict(load.steps)}')
+    print(f'{"":<22}{"p50, ms":>10}{"p95, ms":>10}{"p99, ms":>10}')
+    for name, values in ('handler', timing.latencies), ('update -> handled', load.roundtrips):
+        print(f'{name:<22}' + ''.join(f'{percentile(values, p):>10.1f}' for p in (0.5, 0.95, 0.99)))
+    print(f'\nBot API calls: {dict(api.calls.most_common())}')
+    print(f'429 responses: {api.flooded}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--journeys', default='browse,cart,checkout,sos')
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--catalog-mode', choices=['carousel', 'list', 'album'], default='carousel')
+    parser.add_argument('--think-ms', type=float, default=0,
+                        help='средняя пауза пользователя между действиями')
+    parser.add_argument('--api-latency', type=float, default=0,
+                        help='задержка ответа Bot API, мс')
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='лимиты отправки из data/config.py и 429 от сервера')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = prepare(tmp, args)
+        app.dp.loop.run_until_complete(run(app, args))
+        os.chdir(ROOT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Шквал нажатий ➕ в корзине (utils/cart.py, CartPresses): пользователи
+# добавляют товары, открывают корзину и жмут ➕ у товара каждые --interval мс.
+# Для каждого окна CART_PRESS_WINDOW считаются записи количества в базу,
+# изменения сообщений и время от последнего нажатия до итогового числа
+# на кнопке. Каждое нажатие раньше стоило одну запись и одно изменение.
+#
+#     python -m benchmarks.presses --users 50 --presses 20 --windows 0,0.5
+#     python -m benchmarks.presses --telegram-limits
+#
+# Как и benchmarks.load - настоящие хендлеры и база во временном каталоге,
+# вместо Telegram benchmarks.fake_api.
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import aiogram.bot.api
+from benchmarks.fake_api import FakeBotAPI
+from benchmarks.load import JOURNEYS, ROOT, Load, Timing, prepare, seed
+
+EDITS = ('editMessageReplyMarkup', 'editMessageText')
+
+
+async def quantity(db, uid):
+    row = await db.fetchone('SELECT SUM(quantity) FROM cart WHERE cid = ?', (uid,))
+    return row[0] or 0
+
+
+async def storm(load, db, uid, args):
+    # Корзина с товарами, затем нажатия с интервалом, не дожидаясь изменения сообщения
+    await load.journey(uid, ['browse'])
+    await load.text(uid, JOURNEYS['cart'][0][1])
+    before = await quantity(db, uid)
+    for _ in range(args.presses):
+        await load.press(uid, ('product', 'summary'), 'increase')
+        await asyncio.sleep(args.interval / 1000)
+    return before
+
+
+async def run(app, args):
+    from loader import dp, storage, cart_presses
+
+    api = FakeBotAPI(flood_rate=1 if args.telegram_limits else None)
+    await api.start()
+    aiogram.bot.api.API_URL = api.api_url()
+
+    timing = Timing()
+    dp.middleware.setup(timing)
+    await app.on_startup(dp)
+    logging.getLogger().setLevel(logging.WARNING)
+    await seed(app.db)
+    polling = asyncio.ensure_future(dp.start_polling(timeout=1))
+
+    async def deliver(update):
+        api.push_update(update)
+
+    load = Load(api, timing, deliver, 0)
+
+    presses = args.users * args.presses
+    print(f'{args.users} users x {args.presses} presses every {args.interval:g} ms, '
+          f'{"Telegram limits" if args.telegram_limits else "no rate limits"}\n')
+    print(f'{"window, s":<11}{"presses":>9}{"writes":>8}{"edits":>7}{"429":>6}'
+          f'{"settle, s":>11}  lost')
+
+    for number, window in enumerate(map(float, args.windows.split(','))):
+        cart_presses.window = window
+        users = [100000 * (number + 1) + uid for uid in range(args.users)]
+        applied, flooded = cart_presses.applied, api.flooded
+        edits = sum(api.calls[method] for method in EDITS)
+
+        befores = await asyncio.gather(*(storm(load, app.db, uid, args) for uid in users))
+        start = time.perf_counter()
+        await cart_presses.close()
+        settle = time.perf_counter() - start
+
+        lost = 0
+        for uid, before in zip(users, befores):
+            lost += before + args.presses - await quantity(app.db, uid)
+        edits = sum(api.calls[method] for method in EDITS) - edits
+        print(f'{window:<11g}{presses:>9}{cart_presses.applied - applied:>8}{edits:>7}'
+              f'{api.flooded - flooded:>6}{settle:>11.2f}  {lost}')
+
+    dp.stop_polling()
+    await polling
+    await app.on_shutdown(dp)
+    await storage.close()
+    await dp.bot.close()
+    await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--presses', type=int, default=20, help='нажатий ➕ на пользователя')
+    parser.add_argument('--interval', type=float, default=50, help='пауза между нажатиями, мс')
+    parser.add_argument('--windows', default='0,0.5', help='значения CART_PRESS_WINDOW, с')
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='лимиты отправки из data/config.py и 429 от сервера')
+    args = parser.parse_args()
+    # prepare() ждет параметры benchmarks.load
+    args.catalog_mode = 'carousel'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = prepare(tmp, args)
+        app.dp.loop.run_until_complete(run(app, args))
+        os.chdir(ROOT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# Стоимость измерения запросов: DatabaseManager без QueryLog, с QueryLog
+# без медленных запросов и план первого медленного запроса.
+#
+#     python -m benchmarks.querylog --repeat 100000
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from utils.db import DatabaseManager, QueryLog
+from utils.db.migrations import migrate
+
+SQL = 'SELECT * FROM products WHERE idx=?'
+
+
+def measure(db, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        db.fetchone(SQL, (f'p{i % 1000}',))
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=100000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = DatabaseManager(path)
+        migrate(db)
+        with db.transaction():
+            db.cur.executemany('INSERT INTO products (idx, title, body, price, tag) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               [(f'p{i}', 'title', 'body', 100, 'tag') for i in range(1000)])
+
+        results = {}
+        for name, querylog in ('disabled', None), ('enabled', QueryLog(slow=1)):
+            db.querylog = querylog
+            measure(db, 1000)
+            results[name] = measure(db, args.repeat)
+
+        print(f'{"querylog":<12}{"us/query":>10}')
+        for name, us in results.items():
+            print(f'{name:<12}{us:>10.2f}')
+        print(f'overhead: {results["enabled"] - results["disabled"]:.2f} us/query\n')
+
+        # Порог 0: первый же запрос без индекса попадает в лог вместе с планом
+        db.querylog = QueryLog(slow=0)
+        db.fetchall('SELECT * FROM products WHERE title=?', ('title',))
+        db.conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Сравнение стоимости запросов корзины, каталога и заказов до и после
+# миграции add_keys_and_indexes (первичные ключи и индексы).
+#
+#     python -m benchmarks.schema --carts 100000
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from utils.db import DatabaseManager
+from utils.db.migrations import MIGRATIONS, add_keys_and_indexes, migrate
+
+CATEGORIES = 50
+PRODUCTS = 2000
+LINES_PER_CART = 3
+
+QUERIES = [
+    ('cart by cid',
+     'SELECT * FROM cart WHERE cid=?',
+     lambda r, carts: (r.randrange(carts),)),
+    ('products of category',
+     '''SELECT * FROM products product
+     WHERE product.tag = (SELECT title FROM categories WHERE idx=?)''',
+     lambda r, carts: (f'c{r.randrange(CATEGORIES)}',)),
+    ('product by idx',
+     'SELECT * FROM products WHERE idx=?',
+     lambda r, carts: (f'p{r.randrange(PRODUCTS)}',)),
+    ('cart line delete',
+     'DELETE FROM cart WHERE cid = ? AND idx = ?',
+     lambda r, carts: (r.randrange(carts), f'p{r.randrange(PRODUCTS)}')),
+    ('orders by cid',
+     'SELECT * FROM orders WHERE cid=?',
+     lambda r, carts: (r.randrange(carts),)),
+]
+
+
+def fill(db, carts):
+    r = random.Random(1)
+    with db.transaction():
+        db.cur.executemany('INSERT INTO categories VALUES (?, ?)',
+                           [(f'c{i}', f'category {i}') for i in range(CATEGORIES)])
+        db.cur.executemany(
+            'INSERT INTO products VALUES (?, ?, ?, NULL, ?, ?)',
+            [(f'p{i}', f'product {i}', 'body', 100, f'category {i % CATEGORIES}')
+             for i in range(PRODUCTS)])
+        db.cur.executemany(
+            'INSERT INTO cart VALUES (?, ?, ?)',
+            [(cid, f'p{idx}', 1) for cid in range(carts)
+             for idx in r.sample(range(PRODUCTS), LINES_PER_CART)])
+        db.cur.executemany(
+            'INSERT INTO orders VALUES (?, ?, ?, ?)',
+            [(r.randrange(carts), 'name', 'address', 'p1=1 p2=2')
+             for _ in range(carts)])
+
+
+def measure(db, carts, repeat):
+    r = random.Random(2)
+    results = {}
+
+    for name, sql, params in QUERIES:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            db.fetchall(sql, params(r, carts))
+        db.conn.commit()
+        results[name] = (time.perf_counter() - start) / repeat * 1000
+
+    return results
+
+
+def plans(db):
+    return {name: ' / '.join(row[-1] for row in db.fetchall(
+        'EXPLAIN QUERY PLAN ' + sql, params(random.Random(), 1)))
+        for name, sql, params in QUERIES}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--carts', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        migrate(db, target=1)
+        fill(db, args.carts)
+        before, before_plans = measure(db, args.carts, args.repeat), plans(db)
+
+        start = time.perf_counter()
+        migrate(db, target=MIGRATIONS.index(add_keys_and_indexes) + 1)
+        migration_time = time.perf_counter() - start
+        after, after_plans = measure(db, args.carts, args.repeat), plans(db)
+        db.conn.close()
+
+    print(f'{args.carts} carts, {args.carts * LINES_PER_CART} cart lines, '
+          f'{PRODUCTS} products, {args.carts} orders')
+    print(f'migration took {migration_time:.2f}s\n')
+    print(f'{"query":<22}{"before, ms":>12}{"after, ms":>12}{"speedup":>10}')
+    for name, *_ in QUERIES:
+        print(f'{name:<22}{before[name]:>12.3f}{after[name]:>12.3f}'
+              f'{before[name] / after[name]:>9.0f}x')
+
+    print()
+    for name, *_ in QUERIES:
+        print(f'{name}:\n  before: {before_plans[name]}\n  after:  {after_plans[name]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Время поиска товаров (utils/search.py) на большом каталоге без кэша
+# запросов: редкие и частые слова, префиксы, набираемые в inline-режиме,
+# несколько слов. Названия и описания собраны из словаря с частотами
+# по закону Ципфа, так что самые частые слова есть почти в каждом товаре.
+# Медиана каждого запроса должна укладываться в BUDGET миллисекунд.
+#
+#     python -m benchmarks.search --products 100000
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import tempfile
+import time
+
+from utils.db import AsyncDatabaseManager, DatabaseManager
+from utils.search import ProductSearch, match_query
+
+LETTERS = 'абвгдежзиклмнопрстуфхцчшэюя'
+VOCABULARY = 20000
+REPEAT = 20
+BUDGET = 50
+
+
+def fill(path, products):
+    r = random.Random(1)
+    vocab = [''.join(r.choice(LETTERS) for _ in range(r.randint(3, 9)))
+             for _ in range(VOCABULARY)]
+    weights = list(itertools.accumulate(1 / (i + 1) for i in range(VOCABULARY)))
+
+    db = DatabaseManager(path)
+    db.create_tables()
+    with db.transaction():
+        db.querymany('INSERT INTO products (idx, title, body, price, tag) VALUES (?, ?, ?, ?, ?)',
+                     ((f'p{i}', ' '.join(r.choices(vocab, cum_weights=weights, k=3)),
+                       ' '.join(r.choices(vocab, cum_weights=weights, k=25)), 100, 'tag')
+                      for i in range(products)))
+    db.conn.close()
+    return vocab
+
+
+def queries(vocab):
+    return [
+        ('most common word', vocab[0]),
+        ('its 2-letter prefix', vocab[0][:2]),
+        ('its 3-letter prefix', vocab[0][:3]),
+        ('rare word', vocab[-1]),
+        ('mid-frequency word', vocab[500]),
+        # На 100 000 товаров - чуть меньше RANKED совпадений, самая долгая сортировка
+        ('word in ~10% of rows', vocab[25]),
+        ('two common words', f'{vocab[0]} {vocab[1]}'),
+        ('common + prefix', f'{vocab[0]} {vocab[1][:3]}'),
+        ('rare + prefix', f'{vocab[-1]} {vocab[1][:2]}'),
+        ('no matches', 'щщщ'),
+    ]
+
+
+async def measure(path, vocab):
+    db = AsyncDatabaseManager(path)
+    search = ProductSearch(db, cache_size=0)
+    counter = DatabaseManager(path)
+
+    print(f'{"":<22}{"matches":>10}{"p50, ms":>10}{"max, ms":>10}')
+    slow = []
+    for name, text in queries(vocab):
+        times = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            await search.find(text)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        matches, = counter.fetchone('SELECT COUNT(*) FROM products_fts WHERE products_fts MATCH ?',
+                                    (match_query(text),))
+        median = times[len(times) // 2] * 1000
+        print(f'{name:<22}{matches:>10}{median:>10.2f}{times[-1] * 1000:>10.2f}')
+        if median > BUDGET:
+            slow.append(name)
+
+    counter.conn.close()
+    await db.close()
+    assert not slow, f'over {BUDGET} ms: {", ".join(slow)}'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'search.db')
+        start = time.perf_counter()
+        vocab = fill(path, args.products)
+        print(f'{args.products} products indexed in {time.perf_counter() - start:.1f}s\n')
+        asyncio.run(measure(path, vocab))
+
+
+if __name__ == '__main__':
+    main()
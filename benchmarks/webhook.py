@@ -0,0 +1,120 @@
+# Пропускная способность вебхука без Telegram: синтетические апдейты
+# отправляются POST-запросами на локальный сервер. Сравниваются очередь
+# utils.webhook и стандартный обработчик aiogram, который отвечает
+# Telegram только после обработки апдейта.
+#
+#     python -m benchmarks.webhook --updates 5000 --handler-ms 20
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.webhook import get_new_configured_app
+from aiohttp import ClientSession, web
+
+from utils.webhook import make_app
+
+PATH = '/webhook'
+
+
+def synthetic_update(update_id, user):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user, 'type': 'private'},
+            'from': {'id': user, 'is_bot': False, 'first_name': 'user'},
+            'text': '/menu',
+        },
+    }
+
+
+async def run(mode, args):
+    bot = Bot('123456:BENCHMARK')
+    dp = Dispatcher(bot)
+    handled = 0
+
+    @dp.message_handler()
+    async def handler(message):
+        # Работа хендлера: запросы к базе и Telegram
+        nonlocal handled
+        await asyncio.sleep(args.handler_ms / 1000)
+        handled += 1
+
+    if mode == 'queue':
+        app = make_app(dp, PATH, workers=args.workers, queue_size=args.queue_size)
+    else:
+        app = get_new_configured_app(dp, PATH)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f'http://127.0.0.1:{runner.addresses[0][1]}{PATH}'
+
+    r = random.Random(1)
+    updates = [synthetic_update(i, r.randrange(args.users)) for i in range(args.updates)]
+    latencies, rejected = [], 0
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def post(session, update):
+        nonlocal rejected
+        async with sem:
+            # Как Telegram: отказ - повторная доставка через Retry-After
+            while True:
+                start = time.perf_counter()
+                async with session.post(url, json=update) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+                if response.status == 200:
+                    return
+                rejected += 1
+                await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+
+    start = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(post(session, update) for update in updates))
+    accepted = time.perf_counter() - start
+    # Остановка сервера дожидается обработки всех принятых апдейтов
+    await runner.cleanup()
+    elapsed = time.perf_counter() - start
+    await bot.close()
+
+    latencies.sort()
+    return {
+        'accepted, s': accepted,
+        'processed, s': elapsed,
+        'updates/s': args.updates / elapsed,
+        'resp p50, ms': statistics.median(latencies) * 1000,
+        'resp p99, ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'rejected': rejected,
+        'handled': handled,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='одновременных соединений, у Telegram max_connections до 100')
+    parser.add_argument('--handler-ms', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=64)
+    parser.add_argument('--queue-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    results = {mode: await run(mode, args) for mode in ('aiogram', 'queue')}
+
+    print(f'{args.updates} updates from {args.users} users, {args.concurrency} connections, '
+          f'handler {args.handler_ms} ms, {args.workers} workers, queue {args.queue_size}\n')
+    print(f'{"":<14}' + ''.join(f'{mode:>12}' for mode in results))
+    for name in results['queue']:
+        print(f'{name:<14}' + ''.join(f'{result[name]:>12.1f}' for result in results.values()))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+# Масштабирование режима WORKER_PROCESSES (utils/workers.py) по ядрам:
+# сценарии benchmarks.load при 1, 2, ... N процессах-воркерах.
+# Пользователи, замена Bot API (benchmarks.fake_api) и Front работают
+# в процессе бенчмарка, хендлеры и sqlite - в воркерах, так что для
+# честного замера нужно N + 1 свободное ядро.
+#
+#     python -m benchmarks.workers --users 1000 --processes 1,2,4
+#
+# Каждый прогон - со своей базой во временном каталоге.
+
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import aiogram.bot.api
+from benchmarks.fake_api import FakeBotAPI
+from benchmarks.load import ROOT, Load, Timing, percentile, seed
+
+
+def prepare_worker(api_url):
+    # Выполняется в каждом воркере до импорта бота
+    aiogram.bot.api.API_URL = api_url
+    # Логи каждого заказа заглушили бы отчет, basicConfig бота уже ничего не изменит
+    logging.basicConfig(level=logging.WARNING)
+
+
+async def run(tmp, processes, args):
+    from utils.db import AsyncDatabaseManager
+    from utils.workers import Front
+
+    # Воркеры открывают data/database.db относительно текущего каталога
+    os.makedirs(os.path.join(tmp, f'run{processes}', 'data'))
+    os.chdir(os.path.join(tmp, f'run{processes}'))
+    db = AsyncDatabaseManager('data/database.db')
+    await db.create_tables()
+    await seed(db)
+    await db.close()
+
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    await api.start()
+    timing = Timing()
+
+    def done(update_id):
+        waiter = timing.waiters.pop(update_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    front = Front(None, processes, 'app', initializer=prepare_worker,
+                  initargs=(api.api_url(),), on_done=done)
+    await front.start()
+
+    load = Load(api, timing, front.put, args.think_ms / 1000)
+    journeys = args.journeys.split(',')
+    start = time.perf_counter()
+    await asyncio.gather(*(load.journey(100000 + uid, journeys) for uid in range(args.users)))
+    elapsed = time.perf_counter() - start
+
+    await front.stop(30)
+    await api.stop()
+    os.chdir(ROOT)
+    return len(load.roundtrips), elapsed, load.roundtrips, load.steps
+
+
+async def main(args):
+    sys.path.insert(0, ROOT)
+    from data import config
+    config.BOT_TOKEN = '123456:LOADTEST'
+    config.CATALOG_MODE = 'carousel'
+    config.METRICS_PORT = None
+    config.SEND_GLOBAL_RATE = config.SEND_CHAT_RATE = 10 ** 6
+    config.SEND_CHAT_BURST = 10 ** 6
+
+    print(f'{args.users} users, journeys {args.journeys}, {os.cpu_count()} CPUs\n')
+    print(f'{"processes":<12}{"updates/s":>10}{"speedup":>9}'
+          f'{"p50, ms":>10}{"p95, ms":>10}{"p99, ms":>10}  steps')
+    base = None
+    with tempfile.TemporaryDirectory() as tmp:
+        # Load.press находит кнопки по видам callback_data, а они
+        # регистрируются при импорте клавиатур (вместе с loader и его базой)
+        os.makedirs(os.path.join(tmp, 'data'))
+        os.chdir(tmp)
+        importlib.import_module('keyboards')
+
+        for processes in map(int, args.processes.split(',')):
+            updates, elapsed, roundtrips, steps = await run(tmp, processes, args)
+            rate = updates / elapsed
+            base = base or rate
+            print(f'{processes:<12}{rate:>10.0f}{rate / base:>9.2f}'
+                  + ''.join(f'{percentile(roundtrips, p):>10.1f}' for p in (0.5, 0.95, 0.99))
+                  + f'  {dict(steps)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--journeys', default='browse,cart,checkout,sos')
+    parser.add_argument('--processes', default='1,2,4')
+    parser.add_argument('--think-ms', type=float, default=0,
+                        help='средняя пауза пользователя между действиями')
+    parser.add_argument('--api-latency', type=float, default=0,
+                        help='задержка ответа Bot API, мс')
+    asyncio.run(main(parser.parse_args()))
@@ -1,5 +1,80 @@
 BOT_TOKEN = ''
 
 # например, ADMINS = [000000000, 1234567890]
+# Они становятся админами при каждом запуске, остальные роли хранятся в базе
 ADMINS = []
 
+
+# Group commit: записи в базу копятся DB_BATCH_WINDOW секунд (или до DB_BATCH_SIZE штук)
+# и фиксируются одной транзакцией. None - каждая запись фиксируется сразу.
+DB_BATCH_WINDOW = 0.005
+DB_BATCH_SIZE = 100
+
+# Запросы к базе дольше DB_SLOW_QUERY секунд пишутся в лог вместе с планом запроса,
+# по остальным собирается статистика (/stats). None - не измерять запросы вовсе.
+DB_SLOW_QUERY = 0.05
+
+# Режим показа товаров категории:
+# 'carousel' - одно сообщение с товаром и кнопками ◀️/▶️,
+# 'list' - отдельное сообщение на каждый товар,
+# 'album' - альбомы по 10 фото и под каждым одна клавиатура для добавления в корзину.
+CATALOG_MODE = 'carousel'
+
+# Фото товаров больше PRODUCT_PHOTO_SIZE пикселей по большей стороне отправляются
+# уменьшенной копией, оригинал тоже хранится (нужен Pillow: pip install Pillow).
+# None - отправлять как прислали.
+PRODUCT_PHOTO_SIZE = 800
+
+# Корзина, в которой позиций больше этого числа, показывается одним сообщением-сводкой
+CART_SUMMARY_THRESHOLD = 5
+# Нажатия ➕/➖ у товара в корзине складываются и применяются одной записью в базу
+# и одним изменением сообщения, когда стихнут на CART_PRESS_WINDOW секунд
+# (но не позже CART_PRESS_MAX_WAIT секунд от первого нажатия)
+CART_PRESS_WINDOW = 0.5
+CART_PRESS_MAX_WAIT = 2.0
+
+# Лимиты Telegram на исходящие сообщения (в секунду): всего и в один чат.
+# SEND_CHAT_BURST - сколько сообщений подряд можно отправить в чат без паузы.
+SEND_GLOBAL_RATE = 30
+SEND_CHAT_RATE = 1
+SEND_CHAT_BURST = 3
+
+# Хранилище FSM: изменения состояний пишутся в базу пачкой раз в FSM_FLUSH_INTERVAL секунд,
+# сессии без обращений дольше FSM_TTL секунд выгружаются из памяти.
+FSM_FLUSH_INTERVAL = 1.0
+FSM_TTL = 3600
+
+# Способ получения апдейтов: 'polling' или 'webhook'.
+# Для вебхука Telegram шлет апдейты на WEBHOOK_HOST + WEBHOOK_PATH (путь лучше сделать
+# неугадываемым), а бот слушает WEBAPP_HOST:WEBAPP_PORT за https-прокси.
+UPDATES_MODE = 'polling'
+WEBHOOK_HOST = ''
+WEBHOOK_PATH = '/webhook'
+WEBAPP_HOST = '0.0.0.0'
+WEBAPP_PORT = 8080
+# Сколько апдейтов обрабатывается параллельно и сколько может ждать в очереди
+# (при WORKER_PROCESSES - в каждом процессе).
+# При остановке принятые апдейты дорабатываются не дольше WEBHOOK_DRAIN_TIMEOUT секунд.
+WEBHOOK_WORKERS = 64
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_DRAIN_TIMEOUT = 30
+
+# Число процессов-воркеров (utils/workers.py). 0 - бот работает в одном процессе.
+# Иначе основной процесс только получает апдейты (UPDATES_MODE) и раздает их
+# воркерам по chat.id: чаты обслуживаются параллельно на разных ядрах.
+# Метрики воркера номер i - на порту METRICS_PORT + i, /stats показывает
+# числа того воркера, который обслуживает чат админа.
+WORKER_PROCESSES = 0
+
+# Метрики хендлеров в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics.
+# None - не запускать сервер метрик (команда /stats для админов работает всегда).
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100
+
+# Поиск товаров (/search и inline-режим, его нужно включить у @BotFather: /setinline).
+# SEARCH_LIMIT - сколько лучших результатов запроса показывается,
+# SEARCH_CACHE_SIZE - сколько последних запросов бот помнит сам,
+# SEARCH_CACHE_TIME - сколько секунд Telegram кэширует ответ на inline-запрос.
+SEARCH_LIMIT = 100
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TIME = 300
@@ -1,9 +1,10 @@
 from aiogram.types import Message
 from aiogram.dispatcher.filters import BoundFilter
-from data.config import ADMINS
+from loader import roles
+from utils.roles import ADMIN, role_of
 
 
 class IsAdmin(BoundFilter):
 
     async def check(self, message: Message):
-        return message.from_user.id in ADMINS
+        return role_of(roles, message.from_user.id) == ADMIN
@@ -1,5 +1,7 @@
 from .add import dp
+from .export import dp
 from .orders import dp
 from .questions import dp
+from .stats import dp
 
 
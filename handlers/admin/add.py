@@ -1,18 +1,16 @@
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ReplyKeyboardMarkup, ReplyKeyboardRemove, ContentType
 from aiogram.types.chat import ChatActions
-from aiogram.utils.callback_data import CallbackData
 from aiogram.dispatcher import FSMContext
 from hashlib import md5
 
-from loader import dp, db, bot
+from loader import dp, db, bot, catalog_cache, sender, callbacks, search
 from filters import IsAdmin
 from handlers.user.menu import settings
 from states import CategoryState, ProductState
 from keyboards.default.markups import *
-
-
-category_cb = CallbackData('category', 'id', 'action')
-product_cb = CallbackData('product', 'id', 'action')
+from utils.photos import answer_photo, blob_file, download_photo
+from keyboards.inline.categories import category_cb
+from keyboards.inline.products_from_catalog import product_cb
 
 add_product = '➕ Добавить товар'
 delete_category = '🗑️ Удалить категорию'
@@ -21,23 +19,30 @@ delete_category = '🗑️ Удалить категорию'
 @dp.message_handler(IsAdmin(), text=settings)
 async def process_settings(message: Message):
 
+    markup = await catalog_cache.get('admin_categories_markup',
+                                     settings_markup)
+
+    await message.answer('Настройка категорий:', reply_markup=markup)
+
+
+async def settings_markup():
     markup = InlineKeyboardMarkup()
 
-    for idx, title in db.fetchall('SELECT * FROM categories'):
+    for category_id, title in await catalog_cache.categories():
 
         markup.add(
-            InlineKeyboardButton(title, callback_data=category_cb.new(id=idx, action='view'))
+            InlineKeyboardButton(title, callback_data=category_cb.new(id=category_id, action='view'))
         )
 
     markup.add(
-        InlineKeyboardButton('+ Добавить категорию', callback_data='add_category')
+        InlineKeyboardButton('+ Добавить категорию', callback_data=category_cb.new(id=0, action='add'))
     )
 
-    await message.answer('Настройка категорий:', reply_markup=markup)
+    return markup
 
 
-@dp.callback_query_handler(IsAdmin(), text='add_category')
-async def add_category_callback_handler(query: CallbackQuery):
+@callbacks.handler(category_cb, 'add', IsAdmin())
+async def add_category_callback_handler(query: CallbackQuery, callback_data: dict):
     await query.message.delete()
     await query.message.answer('Название категории?')
     await CategoryState.title.set()
@@ -48,41 +53,41 @@ async def set_category_title_handler(message: Message, state: FSMContext):
 
     category = message.text
     idx = md5(category.encode('utf-8')).hexdigest()
-    db.query('INSERT INTO categories VALUES (?, ?)', (idx, category))
+    await db.query('INSERT OR IGNORE INTO categories (idx, title) VALUES (?, ?)', (idx, category))
+    catalog_cache.invalidate_categories()
 
     await state.finish()
     await process_settings(message)
 
 
-@dp.callback_query_handler(IsAdmin(), category_cb.filter(action='view'))
+@callbacks.handler(category_cb, 'view', IsAdmin())
 async def category_callback_handler(query: CallbackQuery, callback_data: dict,
                                     state: FSMContext):
-    category_idx = callback_data['id']
+    category_id = callback_data['id']
 
-    products = db.fetchall('''SELECT * FROM products product
-    WHERE product.tag = (SELECT title FROM categories WHERE idx=?)''',
-                           (category_idx,))
+    products = await catalog_cache.products(category_id)
 
     await query.message.delete()
     await query.answer('Все добавленные товары в эту категорию.')
-    await state.update_data(category_index=category_idx)
-    await show_products(query.message, products, category_idx)
+    await state.update_data(category_id=category_id)
+    await show_products(query.message, products, category_id)
 
 
-async def show_products(m, products, category_idx):
+async def show_products(m, products, category_id):
     await bot.send_chat_action(m.chat.id, ChatActions.TYPING)
 
-    for idx, title, body, image, price, tag in products:
-        text = f'<b>{title}</b>\n\n{body}\n\nЦена: {price} рублей.'
+    with sender.bulk():
+        for product_id, idx, title, body, price, image_hash in products:
+            text = f'<b>{title}</b>\n\n{body}\n\nЦена: {price} рублей.'
 
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton(
-            '🗑️ Удалить',
-            callback_data=product_cb.new(id=idx, action='delete')))
+            markup = InlineKeyboardMarkup()
+            markup.add(InlineKeyboardButton(
+                '🗑️ Удалить',
+                callback_data=product_cb.new(id=product_id, action='delete')))
 
-        await m.answer_photo(photo=image,
-                             caption=text,
-                             reply_markup=markup)
+            await answer_photo(m, idx, image_hash,
+                               caption=text,
+                               reply_markup=markup)
 
     markup = ReplyKeyboardMarkup()
     markup.add(add_product)
@@ -95,14 +100,19 @@ async def show_products(m, products, category_idx):
 @dp.message_handler(IsAdmin(), text=delete_category)
 async def delete_category_handler(message: Message, state: FSMContext):
     async with state.proxy() as data:
-        if 'category_index' in data.keys():
-            idx = data['category_index']
+        if 'category_id' in data.keys():
+            category_id = data['category_id']
 
-            db.query(
-                'DELETE FROM products WHERE tag IN (SELECT '
-                'title FROM categories WHERE idx=?)',
-                (idx,))
-            db.query('DELETE FROM categories WHERE idx=?', (idx,))
+            async with db.transaction() as tx:
+                await tx.query(
+                    'DELETE FROM products WHERE tag IN (SELECT '
+                    'title FROM categories WHERE id=?)',
+                    (category_id,))
+                await tx.query('DELETE FROM categories WHERE id=?', (category_id,))
+
+            catalog_cache.invalidate_categories()
+            catalog_cache.invalidate_products(category_id)
+            search.clear()
 
             await message.answer('Готово!', reply_markup=ReplyKeyboardRemove())
             await process_settings(message)
@@ -175,12 +185,16 @@ async def process_body(message: Message, state: FSMContext):
 @dp.message_handler(IsAdmin(), content_types=ContentType.PHOTO, state=ProductState.image)
 async def process_image_photo(message: Message, state: FSMContext):
     fileID = message.photo[-1].file_id  # В Telegram есть стандартная опция прикрепления сообщению фото.
-    file_info = await bot.get_file(fileID)  # Получаем идентификатор этого фото.
-    downloaded_file = (await bot.download_file(file_info.file_path)).read()  # Получаем объект фото по идентификатору.
+    # Фото скачивается сразу в хранилище, а в состоянии остается только его ключ
+    image_hash = await download_photo(fileID)
 
-    # Выполняем загрузку фото в атрибут-состояние класса ProductState.
     async with state.proxy() as data:
-        data['image'] = downloaded_file
+        data['image'] = image_hash
+
+    # Такое же фото уже есть у другого товара - файл не дублируется, но админу стоит знать
+    same = await db.fetchone('SELECT title FROM products WHERE photo_hash=?', (image_hash,))
+    if same is not None:
+        await message.answer(f'Это фото уже используется у товара <b>{same[0]}</b>.')
 
     # Переходим к следующему состоянию и выводим соответствующее сообщение.
     await ProductState.next()
@@ -202,7 +216,7 @@ async def process_price(message: Message, state: FSMContext):
 
         markup = check_markup()
 
-        await message.answer_photo(photo=data['image'],
+        await message.answer_photo(photo=blob_file(data['image']),
                                    caption=text,
                                    reply_markup=markup)
 
@@ -214,21 +228,29 @@ async def process_confirm(message: Message, state: FSMContext):
         # Здесь данные, которыми мы наполняли словарь контекста. Теперь мы сможем сделать запись в базу данных.
         title = data['title']
         body = data['body']
-        image = data['image']
+        image_hash = data['image']
         price = data['price']
 
         # Получаем название категории по ее идентификатору и записываем в переменную tag.
-        tag = db.fetchone(
-            'SELECT title FROM categories WHERE idx=?',
-            (data['category_index'],))[0]
+        tag = (await db.fetchone(
+            'SELECT title FROM categories WHERE id=?',
+            (data['category_id'],)))[0]
         # Формируем и хэшируем строку с параметрами товара, что не хранить их в явном виде.
         # Формируем id товара для этого мы берем название, описание, цену и категорию и хэшируем(шифруем) их
         idx = md5(' '.join([title, body, price, tag]
                            ).encode('utf-8')).hexdigest()
 
         # Выполняем вставку в базу данных.
-        db.query('INSERT INTO products VALUES (?, ?, ?, ?, ?, ?)',
-                 (idx, title, body, image, int(price), tag))
+        # Фото уже лежит в хранилище, в таблице остается только его хэш.
+        # Такой же товар (тот же idx) получает новое фото, сохраняя id:
+        # REPLACE удалил бы строку без триггеров DELETE и оставил бы
+        # ее в поисковом индексе.
+        await db.query('''INSERT INTO products
+        (idx, title, body, price, tag, photo_hash) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (idx) DO UPDATE SET photo_hash = excluded.photo_hash''',
+                       (idx, title, body, int(price), tag, image_hash))
+        catalog_cache.invalidate_products(data['category_id'])
+        search.clear()
 
     # Выключаем состояние и выводим соответствующую надпись.
     await state.finish()
@@ -237,10 +259,17 @@ async def process_confirm(message: Message, state: FSMContext):
 
 
 # Обработчик удаления. Срабатывает когда на карточке товара(show_products) нажимают кнопку "Удалить"
-@dp.callback_query_handler(IsAdmin(), product_cb.filter(action='delete'))
+@callbacks.handler(product_cb, 'delete', IsAdmin())
 async def delete_product_callback_handler(query: CallbackQuery, callback_data: dict):
-    product_idx = callback_data['id']  # Из словаря callback_data в show_products мы получаем id товара
-    db.query('DELETE FROM products WHERE idx=?', (product_idx,))  # Удаляем товар из базы данных по id
+    product_id = callback_data['id']  # Из словаря callback_data в show_products мы получаем id товара
+    # Запоминаем категорию товара, чтобы сбросить кэш только ее списка товаров
+    category = await db.fetchone('''SELECT categories.id FROM products
+    JOIN categories ON categories.title = products.tag WHERE products.id=?''',
+                                 (product_id,))
+    await db.query('DELETE FROM products WHERE id=?', (product_id,))  # Удаляем товар из базы данных по id
+    if category is not None:
+        catalog_cache.invalidate_products(category[0])
+    search.clear()
     await query.answer('Удалено!')  # Отправляем сообщение
     await query.message.delete()  # Убираем карточку товара
 
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+from aiogram.types import Message, InputFile
+from aiogram.types.chat import ChatActions
+
+from loader import dp, db, bot
+from filters import IsAdmin
+from utils.export import FORMATS, export_orders
+from utils.orders import first_order_since
+
+# Больше любого id заказа
+TOP = 2 ** 63 - 1
+
+usage = ('Использование: /export_orders [csv|jsonl] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]\n'
+         'Например: /export_orders jsonl 2024-01-01 2024-01-31')
+
+
+# Выгрузка заказов сжатым файлом. Файл пишется в потоке пула базы
+# по одному заказу, затем отправляется документом и удаляется.
+@dp.message_handler(IsAdmin(), commands='export_orders')
+async def process_export_orders(message: Message):
+    args = message.get_args().split()
+    fmt = args.pop(0) if args and args[0] in FORMATS else 'csv'
+    try:
+        since, until = parse_period(args)
+    except ValueError:
+        await message.answer(usage)
+        return
+
+    start = 0 if since is None else await first_order_since(db, since)
+    end = TOP if until is None else await first_order_since(db, until)
+    start = TOP if start is None else start
+    end = TOP if end is None else end
+
+    await bot.send_chat_action(message.chat.id, ChatActions.UPLOAD_DOCUMENT)
+
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}.gz')
+    os.close(fd)
+    try:
+        count = await db.run(export_orders, path, fmt, start, end)
+        if count == 0:
+            await message.answer('Заказов за этот период нет.')
+            return
+
+        name = 'orders' + ''.join('_' + arg for arg in args) + f'.{fmt}.gz'
+        await message.answer_document(InputFile(path, filename=name),
+                                      caption=f'Заказов: {count}')
+    finally:
+        os.remove(path)
+
+
+# Даты начала и конца периода (включительно) в unix-время начала дня,
+# для конца - начала следующего дня. None - без ограничения.
+def parse_period(args):
+    if len(args) > 2:
+        raise ValueError(args)
+
+    days = [date.fromisoformat(arg) for arg in args]
+    since = time.mktime(days[0].timetuple()) if days else None
+    until = time.mktime((days[1] + timedelta(days=1)).timetuple()) if len(days) > 1 else None
+    return since, until
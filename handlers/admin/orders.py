@@ -1,28 +1,109 @@
-from aiogram.types import Message
-from loader import dp, db
+import time
+
+from aiogram.types import Message, CallbackQuery
+from aiogram.utils.exceptions import MessageNotModified
+from loader import dp, db, callbacks
 from handlers.user.menu import orders
 from filters import IsAdmin
+from keyboards.inline.orders import ALL, orders_cb, orders_markup
+from utils.orders import MESSAGE_LIMIT, ORDERS_PER_MESSAGE, fetch_items, order_text, \
+    first_order_since
+
+# Курсор первой страницы: больше любого id
+TOP = 2 ** 63 - 1
 
 
 # обработчик – для отображения списка заказов
 @dp.message_handler(IsAdmin(), text=orders)
 async def process_orders(message: Message):
+    text, markup = await orders_page(ALL, 0, TOP, 'next')
+    await message.answer(text, reply_markup=markup)
 
-    list_orders = db.fetchall('SELECT * FROM orders')
 
-    if len(list_orders) == 0:
-        await message.answer('У вас нет заказов.')
+# Листание и смена фильтров: редактируется то же сообщение
+@callbacks.handler(orders_cb, orders_cb.actions, IsAdmin())
+async def orders_callback_handler(query: CallbackQuery, callback_data: dict):
+    action = callback_data['action']
+    cursor = TOP if action == 'filter' else callback_data['cursor']
+    text, markup = await orders_page(callback_data['status'], callback_data['days'],
+                                     cursor, 'prev' if action == 'prev' else 'next')
+
+    await query.answer()
+    try:
+        await query.message.edit_text(text, reply_markup=markup)
+    except MessageNotModified:
+        pass
+
+
+# Нижняя граница id для фильтра по дате
+async def period_start(days):
+    if days == 0:
+        return 0
+    if days == 1:
+        since = time.mktime(time.localtime()[:3] + (0, 0, 0, 0, 0, -1))
     else:
-        await order_answer(message, list_orders)
+        since = time.time() - days * 86400
+    first = await first_order_since(db, since)
+    return TOP if first is None else first
 
 
-# обработчик – для отображения содержимого заказа
-async def order_answer(message, list_orders):
+# Страница заказов (keyset-пагинация по id): next - заказы старее cursor,
+# prev - новее. Запрос идет по первичному ключу или индексу orders_status
+# и читает не больше страницы, сколько бы заказов ни было в таблице.
+async def fetch_orders(status, start, cursor, action):
+    sign, order = ('<', 'DESC') if action == 'next' else ('>', 'ASC')
+    where = f'id {sign} ? AND id >= ?'
+    values = [cursor, start]
+    if status != ALL:
+        where += ' AND status = ?'
+        values.append(status)
+
+    rows = await db.fetchall(f'''SELECT id, cid, usr_name, usr_address, status, total,
+    created_at FROM orders WHERE {where} ORDER BY id {order} LIMIT ?''',
+                             (*values, ORDERS_PER_MESSAGE + 1))
+    more = len(rows) > ORDERS_PER_MESSAGE
+    rows = rows[:ORDERS_PER_MESSAGE]
+    return (rows, more) if action == 'next' else (rows[::-1], more)
+
 
-    res = ''
+async def orders_page(status, days, cursor, action):
+    start = await period_start(days)
+    list_orders, more = await fetch_orders(status, start, cursor, action)
 
-    for order in list_orders:
-        res += f'Заказ <b>№{order[3]}</b>\n\n'
+    if action == 'prev' and not more:
+        # Дошли до самых новых - это первая страница
+        cursor, action = TOP, 'next'
+        list_orders, more = await fetch_orders(status, start, cursor, action)
+
+    if len(list_orders) == 0:
+        return 'Заказов нет.', orders_markup(status, days, None, None)
+
+    newer = cursor != TOP if action == 'next' else True
+    older = more if action == 'next' else True
+
+    # Заказы, не поместившиеся в одно сообщение, переходят на следующую страницу
+    blocks = await order_answer(list_orders)
+    while len(''.join(blocks)) > MESSAGE_LIMIT and len(blocks) > 1:
+        if action == 'next':
+            blocks.pop()
+            list_orders.pop()
+            older = True
+        else:
+            blocks.pop(0)
+            list_orders.pop(0)
+            newer = True
+
+    return ''.join(blocks)[:MESSAGE_LIMIT], orders_markup(
+        status, days,
+        list_orders[0][0] if newer else None,
+        list_orders[-1][0] if older else None)
+
+
+# обработчик – для отображения содержимого заказа
+async def order_answer(list_orders):
 
-    await message.answer(res)
+    items = await fetch_items(db, [order[0] for order in list_orders])
 
+    return [order_text(order_id, status, total, created_at, items[order_id])
+            + f'\n{name}, {address}\n\n'
+            for order_id, cid, name, address, status, total, created_at in list_orders]
@@ -1,6 +1,5 @@
 from handlers.user.menu import questions
 from aiogram.dispatcher import FSMContext
-from aiogram.utils.callback_data import CallbackData
 from keyboards.default.markups import all_right_message, cancel_message, \
     submit_markup
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, \
@@ -8,12 +7,13 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, \
 from aiogram.types.chat import ChatActions
 
 from states import AnswerState
-from loader import dp, db, bot
+from loader import dp, db, bot, sender, callbacks
 from filters import IsAdmin
+from utils.callbacks import Callback
 
 # Формируем шаблон с возвращаемыми данными.
 # В нем обязательно должен быть идентификатор пользователя, поскольку нам нужно знать, кому слать ответ
-question_cb = CallbackData('question', 'cid', 'action')
+question_cb = Callback('question', 'q', ('answer',), 'cid')
 
 
 @dp.message_handler(IsAdmin(), text=questions)
@@ -21,7 +21,7 @@ async def process_questions(message: Message):
     # Имитируем набор сообщения человеком
     await bot.send_chat_action(message.chat.id, ChatActions.TYPING)
     # Получаем список вопросов из базы данных
-    questions = db.fetchall('SELECT * FROM questions')
+    questions = await db.fetchall('SELECT * FROM questions')
 
     # Если их нет, выводим соответствующее сообщение
     if len(questions) == 0:
@@ -31,19 +31,22 @@ async def process_questions(message: Message):
     # Если вопросы имеются, для каждого формируем кнопку
     else:
 
-        for cid, question in questions:
-            markup = InlineKeyboardMarkup()
-            # И добавляем в разметку.
-            # К каждой кнопке привязываем обработчик. При его нажатии будет передаваться идентификатор пользователя
-            markup.add(InlineKeyboardButton(
-                'Ответить',
-                callback_data=question_cb.new(cid=cid, action='answer')))
+        # Список вопросов отправляется в очереди массовых рассылок,
+        # чтобы не задерживать ответы другим пользователям
+        with sender.bulk():
+            for cid, question in questions:
+                markup = InlineKeyboardMarkup()
+                # И добавляем в разметку.
+                # К каждой кнопке привязываем обработчик. При его нажатии будет передаваться идентификатор пользователя
+                markup.add(InlineKeyboardButton(
+                    'Ответить',
+                    callback_data=question_cb.new(cid=cid, action='answer')))
 
-            await message.answer(question, reply_markup=markup)
+                await message.answer(question, reply_markup=markup)
 
 
 # Обработчик, обеспечивающий переход к вводу ответа
-@dp.callback_query_handler(IsAdmin(), question_cb.filter(action='answer'))
+@callbacks.handler(question_cb, 'answer', IsAdmin())
 async def process_answer(query: CallbackQuery, callback_data: dict,
                          state: FSMContext):
     # Пополняем словарь контекста идентификатором пользователя.
@@ -88,10 +91,10 @@ async def process_send_answer(message: Message, state: FSMContext):
         cid = data['cid']
 
         # Получаем вопрос пользователя
-        question = db.fetchone(
-            'SELECT question FROM questions WHERE cid=?', (cid,))[0]
+        question = (await db.fetchone(
+            'SELECT question FROM questions WHERE cid=?', (cid,)))[0]
         # Удаляем вопрос пользователя
-        db.query('DELETE FROM questions WHERE cid=?', (cid,))
+        await db.query('DELETE FROM questions WHERE cid=?', (cid,))
         # Формируем текст вопроса и ответа
         text = f'Вопрос: <b>{question}</b>\n\nОтвет: <b>{answer}</b>'
 
@@ -0,0 +1,27 @@
+from aiogram.types import Message
+from aiogram.utils.markdown import quote_html
+
+from loader import dp, metrics, querylog
+from filters import IsAdmin
+
+
+# Задержки хендлеров, ошибки, ожидание базы и Telegram, состояние кэша и очереди отправки
+@dp.message_handler(IsAdmin(), commands='stats')
+async def process_stats(message: Message):
+    await message.answer(metrics.report())
+
+    if querylog is not None:
+        await message.answer(queries_report())
+
+
+# Самые дорогие запросы к базе и планы тех, что попадали в медленные
+def queries_report():
+    lines = []
+    for sql, count, total, worst, slow, plan in querylog.top(5):
+        lines.append(f'{count} раз, {total * 1000:.0f} мс всего, '
+                     f'макс. {worst * 1000:.1f} мс, медленных {slow}\n{sql[:300]}')
+        if plan:
+            lines.append('план: ' + plan.replace('\n', '; '))
+        lines.append('')
+
+    return '<pre>' + quote_html('\n'.join(lines) or 'Запросов еще не было.') + '</pre>'
@@ -2,4 +2,5 @@ from .menu import dp, admin_menu, user_menu
 from .catalog import dp
 from .cart import dp
 from .delivery_status import dp
-from .sos import dp
\ No newline at end of file
+from .sos import dp
+from .search import dp
\ No newline at end of file
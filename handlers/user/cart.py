@@ -3,21 +3,37 @@ from aiogram.types import Message, ReplyKeyboardMarkup, CallbackQuery, ReplyKeyb
 from aiogram.dispatcher import FSMContext
 from aiogram.types.chat import ChatActions
 import logging
+import time
+from functools import partial
 
-from loader import db, dp, bot
+from loader import db, dp, bot, callbacks, cart_presses
 from .menu import cart
-from keyboards.inline.products_from_cart import product_markup
+from keyboards.inline.products_from_cart import product_markup, summary_markup, summary_cb, \
+    SUMMARY_ROWS
 from keyboards.inline.products_from_catalog import product_cb
 from keyboards.default.markups import *
 from states import CheckoutState
+from data.config import CART_SUMMARY_THRESHOLD
+from utils.photos import answer_photo
+from utils.orders import NEW, MESSAGE_LIMIT
+from utils.cart import cart_quantity, change_quantity
 
 
 @dp.message_handler(IsUser(), text=cart)
 async def process_cart(message: Message, state: FSMContext):
 
-    # Получаем список позиций в корзине по идентификатору пользователя
-    cart_data = db.fetchall(
-        'SELECT * FROM cart WHERE cid=?', (message.chat.id,))
+    # Получаем позиции корзины вместе с товарами одним запросом.
+    # Если товара уже нет в каталоге, его колонки будут NULL.
+    cart_data = await db.fetchall('''SELECT cart.idx, quantity,
+    title, body, price, photo_hash, id FROM cart
+    LEFT JOIN products ON products.idx = cart.idx WHERE cid=?''',
+                                  (message.chat.id,))
+
+    # Товаров уже нет в каталоге - удаляем их из корзины одним запросом
+    if any(title is None for _, _, title, *_ in cart_data):
+        await db.query('''DELETE FROM cart WHERE cid=?
+        AND idx NOT IN (SELECT idx FROM products)''', (message.chat.id,))
+        cart_data = [row for row in cart_data if row[2] is not None]
 
     # Если корзина пуста, выводим соответствующее сообщение.
     if len(cart_data) == 0:
@@ -25,112 +41,152 @@ async def process_cart(message: Message, state: FSMContext):
         await message.answer('Ваша корзина пуста.')
 
     else:
-        # Включаем имитацию печати человеком
-        await bot.send_chat_action(message.chat.id, ChatActions.TYPING)
-        # Наполняем словарь с контекстом.
-        async with state.proxy() as data:
-            data['products'] = {}
-
-        # Общая стоимость заказа изначально равняется нулю
-        order_cost = 0
-
-        # Обходим содержимое корзины.
-        # Нам нужны идентификатор товара и его количество
-        for _, idx, count_in_cart in cart_data:
-
-            # Получаем объект товара по его идентификатору.
-            product = db.fetchone('SELECT * FROM products WHERE idx=?', (idx,))
+        # Словарь контекста заполняем целиком и записываем один раз.
+        # Ключом будет id товара (он же приходит в данных кнопок),
+        # а значением – список с параметрами товара.
+        products = {product_id: [title, price, count_in_cart]
+                    for _, count_in_cart, title, _, price, _, product_id in cart_data}
+        await state.update_data(products=products)
 
-            # Возможно товара уже в каталоге нет, значит нужно его удалить и из корзины
-            if product == None:
+        # Большую корзину показываем одним сообщением со списком товаров
+        if len(cart_data) > CART_SUMMARY_THRESHOLD:
 
-                db.query('DELETE FROM cart WHERE idx=?', (idx,))
+            await message.answer(cart_summary(products),
+                                 reply_markup=summary_markup(products))
 
-            else:
-                # Раскроем содержимое объекта-товара в параметры название, описание, фото, цена.
-                # Увеличиваем стоимость заказа.
-                _, title, body, image, price, _ = product
-                order_cost += price
+        else:
+            # Включаем имитацию печати человеком
+            await bot.send_chat_action(message.chat.id, ChatActions.TYPING)
 
-                # Дополняем словарь параметрами очередного товара.
-                # Ключом будет идентификатор товара, а значением – список с параметрами товара.
-                async with state.proxy() as data:
-                    data['products'][idx] = [title, price, count_in_cart]
+            for idx, count_in_cart, title, body, price, image_hash, product_id in cart_data:
 
                 # Берем наш обработчик для формирования разметки карточки товара в корзине
-                markup = product_markup(idx, count_in_cart)
+                markup = product_markup(product_id, count_in_cart)
                 text = f'<b>{title}</b>\n\n{body}\n\nЦена: {price}₽.'
 
                 # Выводим ответ
-                await message.answer_photo(photo=image,
-                                           caption=text,
-                                           reply_markup=markup)
-
-        # Перейти к формированию заказа можно будет только в том, случае если стоимость товаров в корзине не равна нулю
-        if order_cost != 0:
-            markup = ReplyKeyboardMarkup(resize_keyboard=True, selective=True)
-            markup.add('📦 Оформить заказ')
-
-            await message.answer('Перейти к оформлению?',
-                                 reply_markup=markup)
-
-
-# Обработчик будет запускаться при изменении количества товаров
-@dp.callback_query_handler(IsUser(), product_cb.filter(action='count'))
-@dp.callback_query_handler(IsUser(), product_cb.filter(action='increase'))
-@dp.callback_query_handler(IsUser(), product_cb.filter(action='decrease'))
-async def product_callback_handler(query: CallbackQuery, callback_data: dict,
-                                   state: FSMContext):
-    # Из словаря контекста получаем идентификатор товара и тип действия.
-    idx = callback_data['id']
-    action = callback_data['action']
-
-    # 1) Если товаров в корзине нет, то запустится функция process_cart() и будет выведено сообщение о пустой корзине.
-    # В противном случае мы увидим количество товара.
-    if 'count' == action:
+                await answer_photo(message, idx, image_hash,
+                                   caption=text,
+                                   reply_markup=markup)
 
-        async with state.proxy() as data:
+        markup = ReplyKeyboardMarkup(resize_keyboard=True, selective=True)
+        markup.add('📦 Оформить заказ')
 
-            if 'products' not in data.keys():
+        await message.answer('Перейти к оформлению?',
+                             reply_markup=markup)
 
-                await process_cart(query.message, state)
 
-            else:
+# Позиции корзины в формате копии в контексте: {id товара: [название, цена, количество]}
+async def cart_products(cid):
+    rows = await db.fetchall('''SELECT id, title, price, quantity FROM cart
+    JOIN products ON products.idx = cart.idx WHERE cid=?''', (cid,))
+    return {product_id: [title, price, count_in_cart]
+            for product_id, title, price, count_in_cart in rows}
 
-                await query.answer('Количество - ' + data['products'][idx][2])
 
-    else:
-
-        async with state.proxy() as data:
-
-            if 'products' not in data.keys():
-
-                await process_cart(query.message, state)
+# Текст сводки корзины: позиции, их стоимость и общая сумма.
+# Показываются те же позиции, что и в кнопках summary_markup, и не больше,
+# чем влезет в сообщение; об остальных - одна строка, в сумме учтены все.
+def cart_summary(products):
+    lines = []
+    total_price = 0
 
-            # 2) Если же товары в корзине присутствуют, мы или увеличим, или уменьшим количество конкретного товара
-            else:
+    for title, price, count_in_cart in products.values():
+        tp = count_in_cart * price
+        lines.append(f'<b>{title}</b> * {count_in_cart}шт. = {tp}₽\n')
+        total_price += tp
 
-                data['products'][idx][2] += 1 if 'increase' == action else -1
+    total = f'\nОбщая сумма: {total_price}₽.'
+    shown = lines[:SUMMARY_ROWS]
+    while True:
+        rest = len(lines) - len(shown)
+        answer = ''.join(shown) + (f'… и еще позиций: {rest}\n' if rest else '') + total
+        if len(answer) <= MESSAGE_LIMIT or not shown:
+            return answer
+        shown.pop()
 
-                # 3) У нас будет новое количество
-                count_in_cart = data['products'][idx][2]
 
-                # 4) Если количество равно нулю, товар из корзины просто можно убрать
-                if count_in_cart == 0:
+# Обработчик будет запускаться при изменении количества товаров
+@callbacks.handler(product_cb, ['count', 'increase', 'decrease'], IsUser())
+@callbacks.handler(summary_cb, ['count', 'increase', 'decrease'], IsUser())
+async def product_callback_handler(query: CallbackQuery, callback_data: dict,
+                                   state: FSMContext):
+    # Из словаря контекста получаем id товара и тип действия.
+    product_id = callback_data['id']
+    action = callback_data['action']
+    cid = query.message.chat.id
 
-                    db.query('''DELETE FROM cart
-                    WHERE cid = ? AND idx = ?''', (query.message.chat.id, idx))
+    # 1) Количество берем из базы: корзину могли изменить с другого устройства.
+    # Если товара в корзине нет, то запустится функция process_cart().
+    if 'count' == action:
 
-                    await query.message.delete()
-                # 5) Иначе мы обновим количество товара в базе данных и эти изменения отразим в карточке товара.
-                else:
-                    db.query('''UPDATE cart 
-                    SET quantity = ? 
-                    WHERE cid = ? AND idx = ?''',
-                             (count_in_cart, query.message.chat.id, idx))
+        count_in_cart = await cart_quantity(db, cid, product_id)
 
-                    await query.message.edit_reply_markup(
-                        product_markup(idx, count_in_cart))
+        if count_in_cart is None:
+            await process_cart(query.message, state)
+        else:
+            await query.answer('Количество - ' + str(count_in_cart))
+
+        return
+
+    # 2) Нажатие сразу подтверждаем, а количество меняем не на каждое:
+    # быстрые нажатия складываются в CartPresses и применяются одной записью
+    await query.answer()
+    cart_presses.press((cid, product_id), 1 if 'increase' == action else -1,
+                       partial(apply_cart_presses, query, callback_data, state))
+
+
+async def apply_cart_presses(query, callback_data, state, delta):
+    product_id = callback_data['id']
+
+    # 3) Увеличиваем или уменьшаем количество в базе одним запросом,
+    # он же возвращает новое количество. Дойдя до нуля, товар уходит из корзины.
+    count_in_cart = await change_quantity(db, query.message.chat.id, product_id, delta)
+
+    if count_in_cart is None:
+        # Пока нажатия ждали, пользователь мог перейти к оформлению заказа:
+        # тогда корзину не выводим поверх вопросов оформления. Нажатие уже
+        # подтверждено query.answer() в шаге 2, повторно отвечать нельзя.
+        if await state.get_state() not in CheckoutState.all_states_names:
+            await process_cart(query.message, state)
+        return
+
+    # 4) Копию корзины в контексте (она нужна для сводки) только обновляем
+    # значением из базы. Нажатия применяются с задержкой, когда пользователь
+    # мог уже перейти к оформлению заказа, поэтому меняется только ключ
+    # products и без state.proxy(), который на выходе записал бы весь
+    # прочитанный ранее контекст поверх новых данных.
+    data = await state.get_data()
+    products = data.get('products', {})
+
+    if count_in_cart == 0:
+        products.pop(product_id, None)
+    elif product_id in products:
+        products[product_id][2] = count_in_cart
+
+    if 'products' in data and (count_in_cart == 0 or product_id in products):
+        await state.update_data(products=products)
+    elif callback_data['@'] == summary_cb.name:
+        # Копии нет (перезапуск бота или сессия FSM выгружена по FSM_TTL)
+        # или в ней нет этого товара - сводку собираем заново из базы
+        products = await cart_products(query.message.chat.id)
+        await state.update_data(products=products)
+
+    # 5) И отразим изменения в сводке корзины
+    if callback_data['@'] == summary_cb.name:
+
+        if len(products) == 0:
+            await query.message.edit_text('Ваша корзина пуста.')
+        else:
+            await query.message.edit_text(
+                cart_summary(products),
+                reply_markup=summary_markup(products))
+    # или в карточке товара
+    elif count_in_cart == 0:
+        await query.message.delete()
+    else:
+        await query.message.edit_reply_markup(
+            product_markup(product_id, count_in_cart))
 
 
 # Обработчик перехода к оформлению заказа.
@@ -148,17 +204,25 @@ async def checkout(message, state):
     answer = ''
     total_price = 0
 
-    # Опираясь на объект-состояние получаем содержимое словаря-контекста
-    async with state.proxy() as data:
-        # Из словаря контекста получаем параметры: название, цену товара, количество товара в корзине
-        for title, price, count_in_cart in data['products'].values():
-
-            # Вычисляем стоимость товара в корзине.
-            tp = count_in_cart * price
-            # Формируем ответ пользователю
-            answer += f'<b>{title}</b> * {count_in_cart}шт. = {tp}₽\n'
-            # Увеличиваем общую стоимость заказа
-            total_price += tp
+    # Состав берем из базы, как и при оформлении заказа, а не из копии
+    # в контексте: корзину могли изменить с другого устройства
+    items = await db.fetchall('''SELECT title, price, quantity FROM cart
+    JOIN products ON products.idx = cart.idx WHERE cid=?''', (message.chat.id,))
+
+    if len(items) == 0:
+        await state.finish()
+        await message.answer('Ваша корзина пуста.', reply_markup=ReplyKeyboardRemove())
+        return
+
+    # Получаем параметры: название, цену товара, количество товара в корзине
+    for title, price, count_in_cart in items:
+
+        # Вычисляем стоимость товара в корзине.
+        tp = count_in_cart * price
+        # Формируем ответ пользователю
+        answer += f'<b>{title}</b> * {count_in_cart}шт. = {tp}₽\n'
+        # Увеличиваем общую стоимость заказа
+        total_price += tp
     # Отправляем ответ пользователю
     await message.answer(f'{answer}\nОбщая сумма заказа: {total_price}₽.',
                          reply_markup=check_markup())
@@ -278,17 +342,23 @@ async def process_confirm(message: Message, state: FSMContext):
     async with state.proxy() as data:
         # Получаем идентификатор пользователя
         cid = message.chat.id
-        # Делаем запрос к таблице с корзиной товаров, формируем массив товаров,
-        # где каждый товар представлен строкой формата:
-        # 'a9cef291062dba543eb97fe5887928f0=1' --> Справа идентификатор товара, а слева – его количество
-        products = [idx + '=' + str(quantity)
-                    for idx, quantity in db.fetchall('''SELECT idx, quantity FROM cart
-        WHERE cid=?''', (cid,))]
-        # Добавляем в таблицу с заказами новую запись
-        db.query('INSERT INTO orders VALUES (?, ?, ?, ?)',
-                 (cid, data['name'], data['address'], ' '.join(products)))
-        # Удаляем запись из корзины
-        db.query('DELETE FROM cart WHERE cid=?', (cid,))
+        # Все запросы выполняются одной транзакцией: заказ не может
+        # появиться без очистки корзины и наоборот.
+        async with db.transaction() as tx:
+            # Позиции корзины с названием и ценой на момент покупки
+            items = await tx.fetchall('''SELECT cart.idx, title, price, quantity FROM cart
+            JOIN products ON products.idx = cart.idx WHERE cid=?''', (cid,))
+            total = sum(price * quantity for _, _, price, quantity in items)
+            # Добавляем в таблицу с заказами новую запись
+            await tx.query('INSERT INTO orders (cid, usr_name, usr_address, status, total, created_at) '
+                           'VALUES (?, ?, ?, ?, ?, ?)',
+                           (cid, data['name'], data['address'], NEW, total, int(time.time())))
+            order_id = (await tx.fetchone('SELECT last_insert_rowid()'))[0]
+            # и ее состав
+            await tx.querymany('INSERT INTO order_items VALUES (?, ?, ?, ?, ?)',
+                               [(order_id, *item) for item in items])
+            # Удаляем запись из корзины
+            await tx.query('DELETE FROM cart WHERE cid=?', (cid,))
         # Отправляем ответ пользователю
         await message.answer(
             'Ок! Ваш заказ уже в пути 🚀\nИмя: <b>' + data[
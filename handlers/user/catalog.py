@@ -3,31 +3,48 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.types.chat import ChatActions
 
 from keyboards.inline.categories import categories_markup, category_cb
-from keyboards.inline.products_from_catalog import product_markup
-from keyboards.inline.products_from_catalog import product_cb
+from keyboards.inline.products_from_catalog import product_markup, carousel_markup, album_markup
+from keyboards.inline.products_from_catalog import product_cb, page_cb
 from .menu import catalog
-from loader import dp, db, bot
+from loader import dp, db, bot, catalog_cache, sender, callbacks
+from data.config import CATALOG_MODE
+from utils.photos import answer_photo, edit_photo, answer_album
+from utils.cart import add_to_cart
+
+# Ответы на кнопки добавления: add_to_cart возвращает None,
+# если товар удалили из каталога после показа
+ADDED = 'Товар добавлен в корзину!'
+UNAVAILABLE = 'Этого товара больше нет в каталоге.'
 
 
 # Обработчик вывода списка товаров категории
 @dp.message_handler(IsUser(), text=catalog)
 async def process_catalog(message: Message):
     await message.answer('Выберите раздел, чтобы вывести список товаров:',
-                         reply_markup=categories_markup())
+                         reply_markup=await categories_markup())
 
 
 # Обработчик перехода к выводу всех товаров категории
-@dp.callback_query_handler(IsUser(), category_cb.filter(action='view'))
+@callbacks.handler(category_cb, 'view', IsUser())
 async def category_callback_handler(query: CallbackQuery, callback_data: dict):
 
-    # Мы делаем запрос к базе данных и получаем список товаров категории по ее идентификатору.
-    products = db.fetchall('''SELECT * FROM products product
-    WHERE product.tag = (SELECT title FROM categories WHERE idx=?) 
-    AND product.idx NOT IN (SELECT idx FROM cart WHERE cid = ?)''',
-                           (callback_data['id'], query.message.chat.id))
+    if CATALOG_MODE == 'carousel':
+        await query.answer('Все доступные товары.')
+        await show_carousel(query.message, callback_data['id'])
+        return
+
+    # Товары категории берем из кэша каталога, а из базы читаем только
+    # содержимое корзины пользователя, чтобы не показывать уже добавленные товары.
+    in_cart = {idx for idx, in await db.fetchall(
+        'SELECT idx FROM cart WHERE cid=?', (query.message.chat.id,))}
+    products = [product for product in await catalog_cache.products(callback_data['id'])
+                if product[1] not in in_cart]
 
     await query.answer('Все доступные товары.')
-    await show_products(query.message, products)
+    if CATALOG_MODE == 'album':
+        await show_albums(query.message, products)
+    else:
+        await show_products(query.message, products)
 
 
 # Функция отображения списка товаров
@@ -42,24 +59,145 @@ async def show_products(m, products):
         # Включаем имитацию печати человеком
         await bot.send_chat_action(m.chat.id, ChatActions.TYPING)
 
-        # Для каждого товара получаем идентификатор категории, название товара, описание, фото, цену
-        for idx, title, body, image, price, _ in products:
+        with sender.bulk():
+            # Для каждого товара получаем идентификатор категории, название товара, описание, фото, цену
+            for product_id, idx, title, body, price, image_hash in products:
+
+                # Формируем разметку кнопки добавления товара в корзину
+                markup = product_markup(product_id, price)
+                text = f'<b>{title}</b>\n\n{body}'
+                # Выводим карточку товара с фото, названием и кнопкой добавления
+                await answer_photo(m, idx, image_hash,
+                                   caption=text,
+                                   reply_markup=markup)
+
+
+# Telegram принимает в одном альбоме не больше 10 фото
+ALBUM_SIZE = 10
+
+
+# Отображение товаров альбомами: до 10 фото в одном запросе sendMediaGroup
+# и одна клавиатура с кнопками добавления под каждым альбомом.
+async def show_albums(m, products):
+
+    if len(products) == 0:
+
+        await m.answer('Здесь ничего нет 😢')
+        return
+
+    await bot.send_chat_action(m.chat.id, ChatActions.UPLOAD_PHOTO)
+
+    with sender.bulk():
+        for start in range(0, len(products), ALBUM_SIZE):
+            group = products[start:start + ALBUM_SIZE]
+
+            # В альбоме должно быть хотя бы два фото, одиночный товар - обычной карточкой
+            if len(group) == 1:
+                await show_products(m, group)
+                continue
+
+            await answer_album(m, [(idx, image_hash, f'<b>{title}</b>\n\n{body}')
+                                   for _, idx, title, body, _, image_hash in group])
+            await m.answer('Добавить в корзину:',
+                           reply_markup=album_markup([(product_id, title, price)
+                                                      for product_id, _, title, _, price, _ in group]))
+
+
+# Получение соседнего товара для карусели (keyset-пагинация по id).
+# Запрос идет по индексу products_tag, поэтому его стоимость не зависит
+# от номера страницы. Дойдя до края, карусель начинает сначала (с конца).
+async def fetch_page(category_id, cid, cursor, action):
+    sign, order = ('>', 'ASC') if action == 'next' else ('<', 'DESC')
+
+    for position in (cursor, -1 if action == 'next' else 2 ** 63 - 1):
+        product = await db.fetchone(f'''SELECT id, idx, title, body, price, photo_hash
+        FROM products WHERE tag = (SELECT title FROM categories WHERE id=?)
+        AND id {sign} ? AND idx NOT IN (SELECT idx FROM cart WHERE cid=?)
+        ORDER BY id {order} LIMIT 1''', (category_id, position, cid))
+
+        if product is not None:
+            return product
 
-            # Формируем разметку кнопки добавления товара в корзину
-            markup = product_markup(idx, price)
-            text = f'<b>{title}</b>\n\n{body}'
-            # Выводим карточку товара с фото, названием и кнопкой добавления
-            await m.answer_photo(photo=image,
-                                 caption=text,
-                                 reply_markup=markup)
+
+# Первая страница карусели - новое сообщение
+async def show_carousel(m, category_id):
+    product = await fetch_page(category_id, m.chat.id, -1, 'next')
+
+    if product is None:
+        await m.answer('Здесь ничего нет 😢')
+        return
+
+    cursor, idx, title, body, price, image_hash = product
+    await answer_photo(m, idx, image_hash,
+                       caption=f'<b>{title}</b>\n\n{body}',
+                       reply_markup=carousel_markup(category_id, cursor, price))
+
+
+# Перелистывание карусели: то же сообщение редактируется, новых сообщений нет
+@callbacks.handler(page_cb, ['prev', 'next'], IsUser())
+async def page_callback_handler(query: CallbackQuery, callback_data: dict):
+    await turn_page(query, callback_data['category'],
+                    callback_data['cursor'], callback_data['action'])
+
+
+# notice - текст ответа на нажатие кнопки вместо стандартного
+async def turn_page(query, category_id, cursor, action, notice=None):
+    product = await fetch_page(category_id, query.message.chat.id, cursor, action)
+
+    if product is None:
+        await query.answer(notice or 'Здесь ничего нет 😢')
+        await query.message.delete()
+        return
+
+    if product[0] == cursor:
+        await query.answer(notice or 'Других товаров нет.')
+        return
+
+    await query.answer(notice)
+    new_cursor, idx, title, body, price, image_hash = product
+    await edit_photo(query.message, idx, image_hash,
+                     caption=f'<b>{title}</b>\n\n{body}',
+                     reply_markup=carousel_markup(category_id, new_cursor, price))
+
+
+# Добавление товара из карусели: товар уходит в корзину,
+# а карусель переключается на следующий товар.
+@callbacks.handler(page_cb, 'add', IsUser())
+async def page_add_callback_handler(query: CallbackQuery, callback_data: dict):
+    cursor = callback_data['cursor']
+    added = await add_to_cart(db, query.message.chat.id, cursor)
+
+    await turn_page(query, callback_data['category'], cursor, 'next',
+                    notice=ADDED if added is not None else UNAVAILABLE)
+
+
+# Добавление товара из клавиатуры под альбомом: нажатая кнопка исчезает,
+# остальные остаются
+@callbacks.handler(product_cb, 'pick', IsUser())
+async def pick_product_callback_handler(query: CallbackQuery,
+                                        callback_data: dict):
+    if await add_to_cart(db, query.message.chat.id, callback_data['id']) is None:
+        await query.answer(UNAVAILABLE)
+        return
+
+    await query.answer(ADDED)
+
+    markup = query.message.reply_markup
+    markup.inline_keyboard = [row for row in markup.inline_keyboard
+                              if row[0].callback_data != query.data]
+    if markup.inline_keyboard:
+        await query.message.edit_reply_markup(markup)
+    else:
+        await query.message.delete()
 
 
 # Обработчик добавления товара в корзину
-@dp.callback_query_handler(IsUser(), product_cb.filter(action='add'))
+@callbacks.handler(product_cb, 'add', IsUser())
 async def add_product_callback_handler(query: CallbackQuery,
                                        callback_data: dict):
-    db.query('INSERT INTO cart VALUES (?, ?, 1)',
-             (query.message.chat.id, callback_data['id']))
+    if await add_to_cart(db, query.message.chat.id, callback_data['id']) is None:
+        await query.answer(UNAVAILABLE)
+        return
 
-    await query.answer('Товар добавлен в корзину!')
+    await query.answer(ADDED)
     await query.message.delete()
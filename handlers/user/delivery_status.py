@@ -2,12 +2,15 @@ from aiogram.types import Message
 from loader import dp, db
 from .menu import delivery_status
 from filters import IsUser
+from utils.orders import ORDERS_PER_MESSAGE, fetch_items, order_text, split_message
 
 # Обработчик отображения активных заказов
 @dp.message_handler(IsUser(), text=delivery_status)
 async def process_delivery_status(message: Message):
-    orders = db.fetchall('SELECT * FROM orders WHERE cid=?',
-                         (message.chat.id,))
+    # Последние заказы пользователя по индексу (cid, id)
+    orders = await db.fetchall('''SELECT id, status, total, created_at
+    FROM orders WHERE cid=? ORDER BY id DESC LIMIT ?''',
+                               (message.chat.id, ORDERS_PER_MESSAGE))
 
     if len(orders) == 0:
         await message.answer('У вас нет активных заказов.')
@@ -17,17 +20,8 @@ async def process_delivery_status(message: Message):
 
 # обработчик отображения статуса заказа
 async def delivery_status_answer(message, orders):
-    res = ''
+    items = await fetch_items(db, [order[0] for order in orders])
 
-    for order in orders:
-        res += f'Заказ <b>№{order[3]}</b>'
-        answer = [
-            ' лежит на складе.',
-            ' уже в пути!',
-            ' прибыл и ждет вас на почте!'
-        ]
-
-        res += answer[0]
-        res += '\n\n'
-
-    await message.answer(res)
+    # Заказы, не поместившиеся в одно сообщение, уходят следующими
+    for text in split_message(order_text(*order, items[order[0]]) for order in orders):
+        await message.answer(text)
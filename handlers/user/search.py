@@ -0,0 +1,69 @@
+from aiogram.types import Message, InlineQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineQueryResultCachedPhoto, InlineQueryResultArticle, InputTextMessageContent
+
+from filters import IsUser
+from loader import dp, search
+from data.config import SEARCH_CACHE_TIME
+from utils.photos import file_ids
+from .catalog import show_products
+
+# Сколько карточек выводит /search, остальное - в inline-режиме
+SEARCH_SHOW = 5
+# Результатов в одном ответе на inline-запрос (Telegram принимает до 50)
+INLINE_PAGE = 20
+# Telegram ограничивает подпись к фото 1024 символами
+CAPTION_SIZE = 1024
+
+
+def product_caption(title, body, price):
+    head = f'<b>{title}</b> - {price}₽\n\n'
+    if len(head) + len(body) > CAPTION_SIZE:
+        body = body[:CAPTION_SIZE - len(head) - 1] + '…'
+    return head + body
+
+
+# Поиск товаров командой: /search запрос
+@dp.message_handler(IsUser(), commands='search')
+async def process_search(message: Message):
+    text = message.get_args()
+    if not text:
+        await message.answer('Напишите, что искать: /search название товара')
+        return
+
+    products = await search.find(text)
+    await show_products(message, products[:SEARCH_SHOW])
+
+    if len(products) > SEARCH_SHOW:
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton('🔍 Все результаты',
+                                        switch_inline_query_current_chat=text))
+        await message.answer(f'Показаны первые {SEARCH_SHOW} товаров.',
+                             reply_markup=markup)
+
+
+# Inline-режим: @бот запрос в любом чате. Результаты листаются страницами
+# по INLINE_PAGE через offset, сами страницы берутся из кэша search.
+# Фото, которые Telegram уже знает (есть file_id), отдаются карточками
+# с фото, остальные товары - текстом.
+@dp.inline_handler()
+async def process_inline_search(query: InlineQuery):
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    products = await search.find(query.query)
+    page = products[offset:offset + INLINE_PAGE]
+
+    results = []
+    for product_id, idx, title, body, price, image_hash in page:
+        caption = product_caption(title, body, price)
+        file_id = await file_ids.get(idx, image_hash)
+
+        if file_id is not None:
+            results.append(InlineQueryResultCachedPhoto(
+                id=str(product_id), photo_file_id=file_id,
+                title=title, caption=caption, parse_mode='HTML'))
+        else:
+            results.append(InlineQueryResultArticle(
+                id=str(product_id), title=title, description=f'{price}₽',
+                input_message_content=InputTextMessageContent(caption, parse_mode='HTML')))
+
+    next_offset = str(offset + INLINE_PAGE) if offset + INLINE_PAGE < len(products) else ''
+    await query.answer(results, cache_time=SEARCH_CACHE_TIME, next_offset=next_offset)
@@ -53,11 +53,11 @@ async def process_submit(message: Message, state: FSMContext):
     cid = message.chat.id
 
     # Проверяем, что у пользователя нет активных вопросов.
-    if db.fetchone('SELECT * FROM questions WHERE cid=?', (cid,)) is None:
+    if await db.fetchone('SELECT * FROM questions WHERE cid=?', (cid,)) is None:
         # Опираясь на дополненный ранее словарь контекста получаем заданный вопрос и добавляем его в базу данных
         async with state.proxy() as data:
-            db.query('INSERT INTO questions VALUES (?, ?)',
-                     (cid, data['question']))
+            await db.query('INSERT INTO questions VALUES (?, ?)',
+                           (cid, data['question']))
         # Отмечаем факт отправки запроса пользователем
         await message.answer('Отправлено!', reply_markup=ReplyKeyboardRemove())
     # Если у пользователя уже есть активные вопросы, сообщаем о превышении лимита заданных вопросов
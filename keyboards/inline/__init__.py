@@ -1,3 +1,4 @@
 from . import categories
 from . import products_from_catalog
 from . import products_from_cart
+from . import orders
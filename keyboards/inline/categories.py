@@ -1,24 +1,29 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.utils.callback_data import CallbackData
-from loader import db
+from utils.callbacks import Callback
+from loader import catalog_cache
 
 # создаем класс-шаблон с данными, отправляемыми в запросе обратного вызова.
-category_cb = CallbackData('category', 'id', 'action')
+category_cb = Callback('category', 'c', ('view', 'add'), 'id')
 
 
-# Функция формирования разметки
-def categories_markup():
+# Функция формирования разметки.
+# Готовая разметка хранится в кэше каталога до изменения списка категорий.
+async def categories_markup():
+    return await catalog_cache.get('categories_markup', build_categories_markup)
+
+
+async def build_categories_markup():
     global category_cb
 
     # Создаем разметку клавиатуры.
     markup = InlineKeyboardMarkup()
 
-    # Получаем список категорий из базы данных и для каждой создаем кнопку.
+    # Получаем список категорий и для каждой создаем кнопку.
     # При нажатии на кнопку будет создаваться новый объект класса с отправляемыми в запросе обратного вызова.
     # В эти данные будет попадать идентификатор категории.
-    for idx, title in db.fetchall('SELECT * FROM categories'):
+    for category_id, title in await catalog_cache.categories():
         markup.add(InlineKeyboardButton(title,
-                                        callback_data=category_cb.new(id=idx,
+                                        callback_data=category_cb.new(id=category_id,
                                                                       action='view'))) # Привяжем к каждой кнопке обработчик вывода списка товаров категории.
 
     return markup
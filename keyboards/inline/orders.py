@@ -0,0 +1,44 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from utils.callbacks import Callback
+from utils.orders import NEW, SHIPPED, DELIVERED
+
+# Данные кнопок списка заказов: фильтр по статусу (ALL или номер статуса),
+# период в днях (0 - за все время), id заказа на краю страницы (курсор) и действие
+orders_cb = Callback('orders', 'o', ('filter', 'prev', 'next'), 'status', 'days', 'cursor')
+
+ALL = -1
+
+STATUS_FILTERS = [(ALL, 'Все'), (NEW, 'На складе'),
+                  (SHIPPED, 'В пути'), (DELIVERED, 'Доставлены')]
+PERIOD_FILTERS = [(0, 'Все время'), (1, 'Сегодня'),
+                  (7, '7 дней'), (30, '30 дней')]
+
+
+# Разметка страницы заказов: фильтры (текущий отмечен точкой) и листание.
+# first и last - id заказов в начале и конце страницы, None - листать некуда.
+def orders_markup(status, days, first, last):
+    global orders_cb
+
+    markup = InlineKeyboardMarkup()
+
+    markup.row(*(InlineKeyboardButton(
+        ('• ' if value == status else '') + title,
+        callback_data=orders_cb.new(status=value, days=days, cursor=0, action='filter'))
+        for value, title in STATUS_FILTERS))
+    markup.row(*(InlineKeyboardButton(
+        ('• ' if value == days else '') + title,
+        callback_data=orders_cb.new(status=status, days=value, cursor=0, action='filter'))
+        for value, title in PERIOD_FILTERS))
+
+    pages = []
+    if first is not None:
+        pages.append(InlineKeyboardButton('◀️ Новее', callback_data=orders_cb.new(
+            status=status, days=days, cursor=first, action='prev')))
+    if last is not None:
+        pages.append(InlineKeyboardButton('Старее ▶️', callback_data=orders_cb.new(
+            status=status, days=days, cursor=last, action='next')))
+    if pages:
+        markup.row(*pages)
+
+    return markup
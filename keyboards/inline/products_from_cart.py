@@ -1,30 +1,47 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.utils.callback_data import CallbackData
-
-# Создаем класс-шаблон с данными, отправляемыми в запросе обратного вызова
-product_cb = CallbackData('product', 'id', 'action')
+from utils.callbacks import Callback
+from .products_from_catalog import product_cb
 
 
 # Функция вывода разметки
-def product_markup(idx, count):
-    global product_cb
-
+def product_markup(product_id, count):
     # Создаем объект клавиатуры.
     markup = InlineKeyboardMarkup()
 
     # Кнопка уменьшения количества товара в заказе. Привязываем к кнопке соответствующий обработчик (action='decrease')
-    back_btn = InlineKeyboardButton('⬅️', callback_data=product_cb.new(id=idx,
+    back_btn = InlineKeyboardButton('⬅️', callback_data=product_cb.new(id=product_id,
                                                                        action='decrease'))
 
     # Отображения количества товара.
     count_btn = InlineKeyboardButton(count,
-                                     callback_data=product_cb.new(id=idx,
+                                     callback_data=product_cb.new(id=product_id,
                                                                   action='count'))
 
     # Кнопка увеличения количества товара в заказе.
-    next_btn = InlineKeyboardButton('➡️', callback_data=product_cb.new(id=idx,
+    next_btn = InlineKeyboardButton('➡️', callback_data=product_cb.new(id=product_id,
                                                                        action='increase'))
     # Добавляем кнопки в клавиатуру
     markup.row(back_btn, count_btn, next_btn)
 
     return markup
+
+
+# Данные кнопок сводки корзины (одно сообщение со всеми позициями)
+summary_cb = Callback('summary', 's', ('count', 'increase', 'decrease'), 'id')
+# Сколько позиций помещается в сводку: по три кнопки на позицию,
+# а под сообщением Telegram показывает не больше 100 кнопок
+SUMMARY_ROWS = 30
+
+
+# Разметка сводки: по строке на каждую из первых SUMMARY_ROWS позиций корзины
+def summary_markup(products):
+    markup = InlineKeyboardMarkup()
+
+    for product_id, (title, price, count) in list(products.items())[:SUMMARY_ROWS]:
+        markup.row(
+            InlineKeyboardButton('⬅️', callback_data=summary_cb.new(id=product_id, action='decrease')),
+            InlineKeyboardButton(f'{title} - {count}',
+                                 callback_data=summary_cb.new(id=product_id, action='count')),
+            InlineKeyboardButton('➡️', callback_data=summary_cb.new(id=product_id, action='increase')))
+
+    return markup
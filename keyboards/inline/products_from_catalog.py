@@ -1,21 +1,57 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.utils.callback_data import CallbackData
+from utils.callbacks import Callback
 from loader import db
 
-product_cb = CallbackData('product', 'id', 'action')
+# Данные кнопок товара: действие и id товара (не md5 idx - так данные короче)
+product_cb = Callback('product', 'p', ('add', 'pick', 'delete', 'count', 'increase', 'decrease'),
+                      'id')
+# Данные кнопок карусели: id категории, id показанного товара (курсор) и действие
+page_cb = Callback('page', 'g', ('prev', 'next', 'add'), 'category', 'cursor')
 
 
 # Кнопка визуализации карточки товара
-def product_markup(idx='', price=0):
+def product_markup(product_id, price=0):
     global product_cb
 
     markup = InlineKeyboardMarkup()
 
     markup.add(InlineKeyboardButton(f'Добавить в корзину - {price}₽',
-                                    callback_data=product_cb.new(id=idx,
+                                    callback_data=product_cb.new(id=product_id,
                                                                  action='add')))
 
     return markup
     # Для каждого товара будет создана кнопка с указанием цены товара.
     # По этой кнопке мы сможем добавить товар в корзину.
     # К кнопке привязываем обработчик добавления (action='add').
+
+
+# Клавиатура под альбомом: по кнопке добавления на каждый товар альбома
+def album_markup(products):
+    global product_cb
+
+    markup = InlineKeyboardMarkup()
+
+    for product_id, title, price in products:
+        markup.add(InlineKeyboardButton(f'{title} - {price}₽',
+                                        callback_data=product_cb.new(id=product_id,
+                                                                     action='pick')))
+
+    return markup
+
+
+# Разметка карусели: кнопка добавления текущего товара и переключение товаров
+def carousel_markup(category_id, cursor, price):
+    global page_cb
+
+    markup = InlineKeyboardMarkup()
+
+    markup.add(InlineKeyboardButton(
+        f'Добавить в корзину - {price}₽',
+        callback_data=page_cb.new(category=category_id, cursor=cursor, action='add')))
+    markup.row(
+        InlineKeyboardButton('◀️', callback_data=page_cb.new(
+            category=category_id, cursor=cursor, action='prev')),
+        InlineKeyboardButton('▶️', callback_data=page_cb.new(
+            category=category_id, cursor=cursor, action='next')))
+
+    return markup
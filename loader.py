@@ -1,11 +1,54 @@
-from aiogram import Bot, Dispatcher, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from utils.db.storage import DatabaseManager
+from aiogram import Dispatcher, types
+from utils.db import AsyncDatabaseManager, QueryLog
+from utils.callbacks import CallbackRouter
+from utils.cart import CartPresses
+from utils.catalog_cache import CatalogCache
+from utils.fsm_storage import SQLiteStorage
+from utils.metrics import Metrics, MetricsMiddleware
+from utils.roles import Roles, RolesMiddleware
+from utils.search import ProductSearch
+from utils.sender import Sender, ThrottledBot
+from utils.workers import Peers
 
 from data import config
 
-bot = Bot(token=config.BOT_TOKEN, parse_mode=types.ParseMode.HTML)
-storage = MemoryStorage()
+sender = Sender(global_rate=config.SEND_GLOBAL_RATE,
+                chat_rate=config.SEND_CHAT_RATE,
+                chat_burst=config.SEND_CHAT_BURST)
+bot = ThrottledBot(token=config.BOT_TOKEN, parse_mode=types.ParseMode.HTML,
+                   sender=sender)
+querylog = QueryLog(slow=config.DB_SLOW_QUERY) if config.DB_SLOW_QUERY is not None else None
+db = AsyncDatabaseManager('data/database.db',
+                          batch_window=config.DB_BATCH_WINDOW,
+                          batch_size=config.DB_BATCH_SIZE,
+                          querylog=querylog)
+storage = SQLiteStorage(db, flush_interval=config.FSM_FLUSH_INTERVAL,
+                        ttl=config.FSM_TTL)
 dp = Dispatcher(bot, storage=storage)
-db = DatabaseManager('data/database.db')
+# Все обработчики кнопок регистрируются в callbacks, а не в dp
+callbacks = CallbackRouter()
+callbacks.setup(dp)
+catalog_cache = CatalogCache(db)
+search = ProductSearch(db, limit=config.SEARCH_LIMIT, cache_size=config.SEARCH_CACHE_SIZE)
+roles = Roles(db)
+dp.middleware.setup(RolesMiddleware(roles))
 
+# В режиме WORKER_PROCESSES сбросы кэшей и смена ролей доходят до всех процессов.
+# file_id фото (utils/photos.py) не рассылаются: устаревший file_id
+# только приводит к повторной загрузке фото.
+peers = Peers()
+catalog_cache.invalidate = peers.share('catalog_cache', catalog_cache.invalidate)
+search.clear = peers.share('search', search.clear)
+roles.remember = peers.share('roles', roles.remember)
+
+metrics = Metrics()
+cart_presses = CartPresses(window=config.CART_PRESS_WINDOW,
+                           max_wait=config.CART_PRESS_MAX_WAIT, metrics=metrics)
+metrics.add_source('catalog_cache', catalog_cache.stats)
+metrics.add_source('search', search.stats)
+metrics.add_source('sender', sender.stats)
+metrics.add_source('roles', roles.stats)
+metrics.add_source('cart_presses', cart_presses.stats)
+if querylog is not None:
+    metrics.add_source('db', querylog.stats)
+dp.middleware.setup(MetricsMiddleware(metrics))
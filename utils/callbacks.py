@@ -0,0 +1,138 @@
+import inspect
+import string
+
+# Компактный формат callback_data: префикс вида (1 символ), код действия
+# (1 символ) и целые поля в base36 через точку. Например, добавление
+# товара 1234 в корзину - 'p0ya' вместо 'product:<md5 товара>:add'.
+# До 64 байт, которые разрешает Telegram, остается большой запас.
+
+DIGITS = string.digits + string.ascii_lowercase
+SEPARATOR = '.'
+
+
+def encode(value):
+    if value < 0:
+        return '-' + encode(-value)
+    digits = ''
+    while True:
+        value, digit = divmod(value, 36)
+        digits = DIGITS[digit] + digits
+        if value == 0:
+            return digits
+
+
+class Callback:
+
+    # Вид кнопок: name - для callback_data['@'] и отчетов, prefix - его код
+    # в данных, actions - допустимые действия (кодом служит позиция в списке),
+    # fields - имена целых полей.
+
+    kinds = {}
+
+    def __init__(self, name, prefix, actions, *fields):
+        if len(prefix) != 1 or prefix in Callback.kinds:
+            raise ValueError(f'Callback prefix {prefix!r} must be one unused character')
+        if len(actions) > len(DIGITS):
+            raise ValueError('Too many actions')
+
+        self.name = name
+        self.prefix = prefix
+        self.actions = tuple(actions)
+        self.fields = fields
+        self.codes = {action: DIGITS[i] for i, action in enumerate(self.actions)}
+        Callback.kinds[prefix] = self
+
+    def new(self, action, **values):
+        return self.prefix + self.codes[action] + SEPARATOR.join(
+            encode(int(values[field])) for field in self.fields)
+
+    def key(self, action):
+        # Ключ таблицы маршрутов - первые два символа данных
+        return self.prefix + self.codes[action]
+
+    def parse(self, data):
+        # Словарь в духе aiogram CallbackData: '@', 'action' и поля.
+        # ValueError - данные не этого вида или повреждены.
+        if len(data) < 2 or data[0] != self.prefix:
+            raise ValueError(data)
+        values = data[2:].split(SEPARATOR) if self.fields else []
+        if len(values) != len(self.fields):
+            raise ValueError(data)
+
+        result = {'@': self.name, 'action': self.actions[DIGITS.index(data[1])]}
+        for field, value in zip(self.fields, values):
+            result[field] = int(value, 36)
+        return result
+
+
+def parse(data):
+    # Разбор данных любого зарегистрированного вида
+    kind = Callback.kinds.get(data[:1])
+    if kind is None:
+        raise ValueError(data)
+    return kind.parse(data)
+
+
+class CallbackRouter:
+
+    # Вместо отдельного callback_query_handler с фильтром CallbackData.filter
+    # на каждую кнопку (aiogram проверяет их по очереди, пока один не подойдет)
+    # у диспетчера один обработчик, а нужный выбирается по словарю:
+    # префикс + код действия -> обработчики. На одном ключе бывает несколько
+    # обработчиков с разными фильтрами (админ и пользователь), из них
+    # вызывается первый, чьи фильтры прошли.
+    #
+    #     @callbacks.handler(product_cb, 'add', IsUser())
+    #     async def handler(query, callback_data, state): ...
+    #
+    # Обработчик получает state, только если он есть в его аргументах.
+
+    def __init__(self):
+        self._routes = {}
+        self._wants_state = {}
+
+    def register(self, handler, callback, actions, *filters):
+        if isinstance(actions, str):
+            actions = [actions]
+        self._wants_state[handler] = 'state' in inspect.signature(handler).parameters
+        for action in actions:
+            self._routes.setdefault(callback.key(action), []).append(
+                (handler, callback, filters))
+
+    def handler(self, callback, actions, *filters):
+        def decorator(handler):
+            self.register(handler, callback, actions, *filters)
+            return handler
+
+        return decorator
+
+    def setup(self, dispatcher):
+        # Как и прежние обработчики кнопок, срабатывает только вне состояний FSM.
+        # Кнопки, для которых обработчика нет (старый формат данных, чужая роль),
+        # получают ответ, чтобы у пользователя не крутились часики.
+        dispatcher.register_callback_query_handler(self.dispatch, self.match)
+        dispatcher.register_callback_query_handler(self.expired)
+
+    async def match(self, query):
+        # Фильтр диспетчера: находит обработчик и разбирает данные.
+        # Результат попадает в data апдейта (callback_handler видят и middleware).
+        data = query.data or ''
+        for handler, callback, filters in self._routes.get(data[:2], ()):
+            for bound_filter in filters:
+                if not await bound_filter.check(query):
+                    break
+            else:
+                try:
+                    callback_data = callback.parse(data)
+                except ValueError:
+                    return False
+                return {'callback_handler': handler, 'callback_data': callback_data}
+        return False
+
+    async def dispatch(self, query, callback_handler, callback_data, state):
+        if self._wants_state[callback_handler]:
+            return await callback_handler(query, callback_data, state)
+        return await callback_handler(query, callback_data)
+
+    async def expired(self, query):
+        await query.answer('Кнопка больше не действует, откройте меню заново.')
@@ -0,0 +1,145 @@
+# Изменения корзины. Каждое - один атомарный запрос, который сразу
+# возвращает новое количество: два быстрых нажатия или два устройства
+# одного пользователя не затирают изменения друг друга, как при чтении
+# количества и записи его нового значения отдельными запросами.
+# Позиции с нулевым количеством удаляет триггер cart_drop_empty.
+
+import asyncio
+import logging
+import time
+
+from utils.metrics import current_call, handler_name
+
+log = logging.getLogger(__name__)
+
+
+async def add_to_cart(db, cid, product_id, quantity=1):
+    # Добавляет товар или увеличивает количество уже добавленного.
+    # None - товара уже нет в каталоге.
+    row = await db.query_returning('''INSERT INTO cart (cid, idx, quantity)
+    SELECT ?, idx, ? FROM products WHERE id = ?
+    ON CONFLICT (cid, idx) DO UPDATE SET quantity = quantity + excluded.quantity
+    RETURNING quantity''', (cid, quantity, product_id))
+    return None if row is None else row[0]
+
+
+async def change_quantity(db, cid, product_id, delta):
+    # Меняет количество товара, который уже лежит в корзине.
+    # 0 - позиция удалена, None - ее в корзине не было.
+    row = await db.query_returning('''UPDATE cart SET quantity = quantity + ?
+    WHERE cid = ? AND idx = (SELECT idx FROM products WHERE id = ?)
+    RETURNING quantity''', (delta, cid, product_id))
+    return None if row is None else max(row[0], 0)
+
+
+async def cart_quantity(db, cid, product_id):
+    row = await db.fetchone('''SELECT quantity FROM cart
+    WHERE cid = ? AND idx = (SELECT idx FROM products WHERE id = ?)''', (cid, product_id))
+    return None if row is None else row[0]
+
+
+class _Presses:
+
+    def __init__(self, now):
+        self.delta = 0
+        self.count = 0
+        self.apply = None
+        self.first = self.last = now
+
+
+class CartPresses:
+
+    # Быстрые нажатия ➕/➖ у одного товара в одном чате складываются:
+    # apply(delta) вызывается один раз с их суммой, когда нажатия стихнут на
+    # window секунд (но не позже max_wait секунд от первого) - одна запись
+    # в базу и одно изменение сообщения вместо десятка, которые Telegram
+    # все равно ограничил бы по частоте.
+    # Нажатия во время apply копятся на следующий раз, поэтому изменения
+    # одного сообщения не обгоняют друг друга.
+    # Вызов apply идет в отдельной задаче: апдейты чата обрабатываются по
+    # порядку, и хендлер, ждущий паузы, задержал бы сами нажатия.
+    # В режиме WORKER_PROCESSES чат обслуживает один процесс, так что
+    # буфер в памяти процесса видит все его нажатия.
+    # Задача наследует контекст хендлера первого нажатия, который к моменту
+    # apply уже завершен, поэтому каждый apply учитывается в metrics
+    # отдельным вызовом под своим именем (время базы и Telegram - тоже).
+
+    def __init__(self, window=0.5, max_wait=2.0, metrics=None):
+        self.window = window
+        self.max_wait = max_wait
+        self.metrics = metrics
+        # (cid, product_id) -> _Presses
+        self._pending = {}
+        self._tasks = set()
+
+        # Метрики
+        self.presses = 0
+        self.applied = 0
+
+    def press(self, key, delta, apply):
+        # apply последнего нажатия: у него самое свежее сообщение и контекст
+        now = asyncio.get_running_loop().time()
+        self.presses += 1
+        pending = self._pending.get(key)
+        start = pending is None
+        if start:
+            pending = self._pending[key] = _Presses(now)
+        elif pending.count == 0:
+            pending.first = now
+        pending.delta += delta
+        pending.count += 1
+        pending.apply = apply
+        pending.last = now
+
+        if start:
+            task = asyncio.ensure_future(self._run(key, pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, pending):
+        loop = asyncio.get_running_loop()
+        while True:
+            while True:
+                wait = min(pending.last + self.window,
+                           pending.first + self.max_wait) - loop.time()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            delta = pending.delta
+            pending.delta = pending.count = 0
+            # ➕ и ➖ могли взаимно погаситься - тогда менять нечего
+            if delta:
+                self.applied += 1
+                await self._apply(key, pending.apply, delta)
+
+            if pending.count == 0:
+                del self._pending[key]
+                return
+
+    async def _apply(self, key, apply, delta):
+        call = None if self.metrics is None else self.metrics.begin(handler_name(apply))
+        current_call.set(call)
+        start = time.perf_counter()
+        try:
+            await apply(delta)
+        except Exception:
+            log.exception('Failed to apply cart presses %s', key)
+            if call is not None:
+                self.metrics.error(call)
+        finally:
+            if call is not None:
+                self.metrics.end(call, time.perf_counter() - start)
+
+    async def close(self):
+        # Дожидается применения уже сделанных нажатий
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            'presses': self.presses,
+            'applied': self.applied,
+            'pending': len(self._pending),
+            'coalesced': 1 - self.applied / self.presses if self.presses else 0.0,
+        }
@@ -0,0 +1,63 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class CatalogCache:
+
+    # Общий для процесса read-through кэш каталога: списки категорий,
+    # товары категорий и готовые InlineKeyboardMarkup.
+    # Каталог меняется только из админских обработчиков (handlers/admin/add.py),
+    # и они сбрасывают ровно те ключи, которые затронули.
+
+    def __init__(self, db):
+        self.db = db
+        self._data = {}
+        # Номер версии ключа растет при каждом сбросе. Если ключ сбросили,
+        # пока значение загружалось из базы, устаревшее значение не сохраняется.
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, load):
+        if key in self._data:
+            self.hits += 1
+            return self._data[key]
+
+        self.misses += 1
+        version = self._versions.get(key, 0)
+        value = await load()
+        if self._versions.get(key, 0) == version:
+            self._data[key] = value
+        return value
+
+    async def categories(self):
+        return await self.get('categories', lambda: self.db.fetchall(
+            'SELECT id, title FROM categories ORDER BY id'))
+
+    async def products(self, category_id):
+        return await self.get(('products', category_id), lambda: self.db.fetchall(
+            '''SELECT id, idx, title, body, price, photo_hash FROM products
+            WHERE tag = (SELECT title FROM categories WHERE id=?)
+            ORDER BY id''', (category_id,)))
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def invalidate_categories(self):
+        self.invalidate('categories', 'categories_markup',
+                        'admin_categories_markup')
+
+    def invalidate_products(self, category_id):
+        self.invalidate(('products', category_id))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'keys': len(self._data),
+        }
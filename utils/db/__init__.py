@@ -1 +1,4 @@
-from .storage import DatabaseManager
\ No newline at end of file
+from .blobs import BlobStore
+from .querylog import QueryLog
+from .storage import DatabaseManager
+from .pool import AsyncDatabaseManager
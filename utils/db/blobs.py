@@ -0,0 +1,89 @@
+import io
+import os
+from hashlib import sha256
+from tempfile import NamedTemporaryFile
+
+
+class BlobStore:
+
+    # Хранилище файлов (фото товаров) с адресацией по содержимому.
+    # Ключ файла - sha256 его содержимого, файл лежит в root/ab/abcdef...
+    # Одинаковые фото хранятся на диске один раз.
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, data, key=None):
+        # key - для файлов, производных от другого (уменьшенная копия фото):
+        # их ключ строится из ключа исходного файла
+        key = key or sha256(data).hexdigest()
+        if not self.exists(key):
+            self._write(key, data)
+        return key
+
+    def _write(self, key, data):
+        # Пишем во временный файл и переименовываем: читатели никогда
+        # не увидят недописанный файл.
+        directory = os.path.dirname(self.path(key))
+        os.makedirs(directory, exist_ok=True)
+        with NamedTemporaryFile(dir=directory, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, self.path(key))
+
+    def writer(self):
+        # Файл для записи по частям, например bot.download_file(destination=...).
+        # Хэш считается по ходу записи, в памяти не хранится весь файл.
+        return BlobWriter(self)
+
+
+class BlobWriter(io.RawIOBase):
+
+    # Пишет во временный файл в root/tmp и одновременно считает sha256.
+    # Только последовательная запись: перемотка разошлась бы с хэшем.
+    # commit() переносит файл в хранилище под его ключом (если такого файла
+    # еще нет) и возвращает ключ. Файл, закрытый без commit(), удаляется.
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        directory = os.path.join(store.root, 'tmp')
+        os.makedirs(directory, exist_ok=True)
+        self._file = NamedTemporaryFile(dir=directory, delete=False)
+        self.name = self._file.name
+        self._hash = sha256()
+        self.size = 0
+        self.key = None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def commit(self):
+        self._file.close()
+        self.key = self._hash.hexdigest()
+        if self.store.exists(self.key):
+            os.remove(self.name)
+        else:
+            os.makedirs(os.path.dirname(self.store.path(self.key)), exist_ok=True)
+            os.replace(self.name, self.store.path(self.key))
+        return self.key
+
+    def close(self):
+        if not self.closed and self.key is None:
+            self._file.close()
+            os.remove(self.name)
+        super().close()
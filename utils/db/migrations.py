@@ -0,0 +1,291 @@
+# Версионные миграции схемы базы данных.
+# Номер текущей версии хранится в PRAGMA user_version: миграция с номером N
+# переводит схему из версии N - 1 в N. Новые миграции добавляются только в конец списка.
+
+from hashlib import sha256
+
+
+def create_initial_tables(db):
+    # Исходная схема. IF NOT EXISTS - чтобы существующие базы без версии
+    # (user_version = 0) проходили эту миграцию без изменений.
+    db.query(
+        'CREATE TABLE IF NOT EXISTS products (idx text, title text, '
+        'body text, photo blob, price int, tag text)')
+    db.query(
+        'CREATE TABLE IF NOT EXISTS orders (cid int, usr_name text, '
+        'usr_address text, products text)')
+    db.query(
+        'CREATE TABLE IF NOT EXISTS cart (cid int, idx text, '
+        'quantity int)')
+    db.query(
+        'CREATE TABLE IF NOT EXISTS categories (idx text, title text)')
+    db.query(
+        'CREATE TABLE IF NOT EXISTS questions (cid int, question text)')
+
+
+def add_keys_and_indexes(db):
+    # Первичные ключи и индексы. SQLite не умеет добавлять PRIMARY KEY
+    # к существующей таблице, поэтому таблицы пересоздаются с копированием данных.
+    db.query(
+        'CREATE TABLE products_new (idx text PRIMARY KEY, title text, '
+        'body text, photo blob, price int, tag text)')
+    db.query('INSERT OR IGNORE INTO products_new SELECT * FROM products')
+    db.query('DROP TABLE products')
+    db.query('ALTER TABLE products_new RENAME TO products')
+    db.query('CREATE INDEX products_tag ON products (tag)')
+
+    db.query(
+        'CREATE TABLE categories_new (idx text PRIMARY KEY, title text)')
+    db.query('INSERT OR IGNORE INTO categories_new SELECT * FROM categories')
+    db.query('DROP TABLE categories')
+    db.query('ALTER TABLE categories_new RENAME TO categories')
+
+    # Корзина хранится кластеризованной по (cid, idx): все позиции
+    # пользователя лежат рядом, дубликаты позиций схлопываются.
+    db.query(
+        'CREATE TABLE cart_new (cid int, idx text, quantity int, '
+        'PRIMARY KEY (cid, idx)) WITHOUT ROWID')
+    db.query(
+        'INSERT INTO cart_new SELECT cid, idx, SUM(quantity) FROM cart '
+        'GROUP BY cid, idx')
+    db.query('DROP TABLE cart')
+    db.query('ALTER TABLE cart_new RENAME TO cart')
+
+    db.query(
+        'CREATE TABLE orders_new (id INTEGER PRIMARY KEY, cid int, '
+        'usr_name text, usr_address text, products text)')
+    db.query(
+        'INSERT INTO orders_new (cid, usr_name, usr_address, products) '
+        'SELECT * FROM orders')
+    db.query('DROP TABLE orders')
+    db.query('ALTER TABLE orders_new RENAME TO orders')
+    db.query('CREATE INDEX orders_cid ON orders (cid)')
+
+    # У пользователя может быть только один активный вопрос
+    db.query(
+        'CREATE TABLE questions_new (cid int PRIMARY KEY, question text)')
+    db.query('INSERT OR IGNORE INTO questions_new SELECT * FROM questions')
+    db.query('DROP TABLE questions')
+    db.query('ALTER TABLE questions_new RENAME TO questions')
+
+
+def add_photo_file_ids(db):
+    # Кэш file_id, которые Telegram вернул после первой загрузки фото товара.
+    # Ключ - товар и хэш содержимого фото, поэтому замена фото сама
+    # делает старую запись неактуальной.
+    db.query('ALTER TABLE products ADD COLUMN photo_hash text')
+    for (idx,) in db.fetchall('SELECT idx FROM products'):
+        photo = db.fetchone('SELECT photo FROM products WHERE idx=?', (idx,))[0]
+        if photo is not None:
+            db.query('UPDATE products SET photo_hash=? WHERE idx=?',
+                     (sha256(photo).hexdigest(), idx))
+
+    db.query(
+        'CREATE TABLE photo_file_ids (idx text, photo_hash text, file_id text, '
+        'PRIMARY KEY (idx, photo_hash)) WITHOUT ROWID')
+    create_photo_file_ids_triggers(db)
+
+
+def create_photo_file_ids_triggers(db):
+    # Инвалидация кэша file_id при удалении и замене товара
+    db.query(
+        'CREATE TRIGGER photo_file_ids_delete AFTER DELETE ON products BEGIN '
+        'DELETE FROM photo_file_ids WHERE idx = old.idx; END')
+    db.query(
+        'CREATE TRIGGER photo_file_ids_insert AFTER INSERT ON products BEGIN '
+        'DELETE FROM photo_file_ids WHERE idx = new.idx '
+        'AND photo_hash IS NOT new.photo_hash; END')
+    db.query(
+        'CREATE TRIGGER photo_file_ids_update AFTER UPDATE OF photo_hash '
+        'ON products BEGIN '
+        'DELETE FROM photo_file_ids WHERE idx = new.idx '
+        'AND photo_hash IS NOT new.photo_hash; END')
+
+
+def move_photos_to_blob_store(db):
+    # Фото переезжают из products.photo в хранилище db.blobs.
+    # Ключ в хранилище - тот же sha256, что и photo_hash, поэтому
+    # кэш file_id остается действительным.
+    for (idx,) in db.fetchall('SELECT idx FROM products WHERE photo IS NOT NULL'):
+        photo = db.fetchone('SELECT photo FROM products WHERE idx=?', (idx,))[0]
+        db.query('UPDATE products SET photo_hash=? WHERE idx=?',
+                 (db.blobs.put(photo), idx))
+
+    # Таблица пересоздается без колонки photo (вместе с индексом и триггерами)
+    db.query(
+        'CREATE TABLE products_new (idx text PRIMARY KEY, title text, '
+        'body text, price int, tag text, photo_hash text)')
+    db.query(
+        'INSERT INTO products_new '
+        'SELECT idx, title, body, price, tag, photo_hash FROM products')
+    db.query('DROP TABLE products')
+    db.query('ALTER TABLE products_new RENAME TO products')
+    db.query('CREATE INDEX products_tag ON products (tag)')
+    create_photo_file_ids_triggers(db)
+
+
+def add_fsm_storage(db):
+    # Состояния и данные FSM (utils/fsm_storage.py), переживают перезапуск бота.
+    # data и bucket - словари, сериализованные pickle.
+    db.query(
+        'CREATE TABLE fsm (chat text, user text, state text, data blob, '
+        'bucket blob, PRIMARY KEY (chat, user)) WITHOUT ROWID')
+
+
+def normalize_orders(db):
+    # Состав заказа переезжает из строки orders.products ('idx=2 idx=1')
+    # в таблицу order_items. Название и цена товара запоминаются на момент
+    # покупки, сумма заказа - в orders.total.
+    # status: 0 - на складе, 1 - в пути, 2 - доставлен (utils/orders.py).
+    # created_at - unix-время, у старых заказов неизвестно (NULL).
+    db.query(
+        'CREATE TABLE orders_new (id INTEGER PRIMARY KEY, cid int, '
+        'usr_name text, usr_address text, status int NOT NULL DEFAULT 0, '
+        'total int NOT NULL DEFAULT 0, created_at int)')
+    db.query(
+        'CREATE TABLE order_items (order_id int NOT NULL '
+        'REFERENCES orders (id) ON DELETE CASCADE, idx text, title text, '
+        'price int, quantity int, PRIMARY KEY (order_id, idx)) WITHOUT ROWID')
+
+    items = []
+    for order_id, products in db.fetchall('SELECT id, products FROM orders'):
+        quantities = {}
+        for item in (products or '').split():
+            idx, _, quantity = item.partition('=')
+            quantities[idx] = quantities.get(idx, 0) + int(quantity or 1)
+        for idx, quantity in quantities.items():
+            # Цены на момент старых покупок не сохранились - берем текущие
+            product = db.fetchone('SELECT title, price FROM products WHERE idx=?', (idx,))
+            title, price = product if product is not None else (None, 0)
+            items.append((order_id, idx, title, price, quantity))
+
+    db.query(
+        'INSERT INTO orders_new (id, cid, usr_name, usr_address) '
+        'SELECT id, cid, usr_name, usr_address FROM orders')
+    db.query('DROP TABLE orders')
+    db.query('ALTER TABLE orders_new RENAME TO orders')
+    db.querymany('INSERT INTO order_items VALUES (?, ?, ?, ?, ?)', items)
+    db.query(
+        'UPDATE orders SET total = (SELECT COALESCE(SUM(price * quantity), 0) '
+        'FROM order_items WHERE order_id = orders.id)')
+
+    # Заказы пользователя от новых к старым читаются по индексу
+    db.query('CREATE INDEX orders_cid ON orders (cid, id)')
+
+
+def add_order_filter_indexes(db):
+    # Админский список заказов: фильтр по статусу листается по (status, id),
+    # а дата начала периода ищется по created_at
+    db.query('CREATE INDEX orders_status ON orders (status, id)')
+    db.query('CREATE INDEX orders_created ON orders (created_at)')
+
+
+def add_roles(db):
+    # Роли пользователей, отличные от обычного покупателя (utils/roles.py)
+    db.query('CREATE TABLE roles (uid INTEGER PRIMARY KEY, role text NOT NULL)')
+
+
+def add_surrogate_ids(db):
+    # Целые id товаров и категорий для callback_data (utils/callbacks.py):
+    # md5-строки idx остаются ключами корзины, заказов и кэша file_id.
+    # id равен прежнему rowid, поэтому курсоры карусели и порядок
+    # категорий не меняются, а INTEGER PRIMARY KEY не пересчитывается при VACUUM.
+    db.query(
+        'CREATE TABLE products_new (id INTEGER PRIMARY KEY, idx text NOT NULL UNIQUE, '
+        'title text, body text, price int, tag text, photo_hash text)')
+    db.query(
+        'INSERT INTO products_new '
+        'SELECT rowid, idx, title, body, price, tag, photo_hash FROM products')
+    db.query('DROP TABLE products')
+    db.query('ALTER TABLE products_new RENAME TO products')
+    db.query('CREATE INDEX products_tag ON products (tag)')
+    create_photo_file_ids_triggers(db)
+
+    db.query(
+        'CREATE TABLE categories_new (id INTEGER PRIMARY KEY, '
+        'idx text NOT NULL UNIQUE, title text)')
+    db.query('INSERT INTO categories_new SELECT rowid, idx, title FROM categories')
+    db.query('DROP TABLE categories')
+    db.query('ALTER TABLE categories_new RENAME TO categories')
+
+
+def add_product_search(db):
+    # Полнотекстовый поиск товаров (utils/search.py). Индекс FTS5 хранит
+    # только слова названия и описания, сами строки берутся из products
+    # (external content), а синхронизируют его триггеры.
+    # Префиксные индексы на 2-4 буквы: набираемое в inline-режиме слово
+    # ищется одним списком, а не объединением всех слов с этим началом.
+    db.query(
+        "CREATE VIRTUAL TABLE products_fts USING fts5(title, body, "
+        "content='products', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')")
+    db.query("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+    create_products_fts_triggers(db)
+
+
+def create_products_fts_triggers(db):
+    # При пересоздании products их нужно создавать заново
+    db.query(
+        'CREATE TRIGGER products_fts_insert AFTER INSERT ON products BEGIN '
+        'INSERT INTO products_fts (rowid, title, body) '
+        'VALUES (new.id, new.title, new.body); END')
+    db.query(
+        'CREATE TRIGGER products_fts_delete AFTER DELETE ON products BEGIN '
+        "INSERT INTO products_fts (products_fts, rowid, title, body) "
+        "VALUES ('delete', old.id, old.title, old.body); END")
+    db.query(
+        'CREATE TRIGGER products_fts_update AFTER UPDATE OF title, body ON products BEGIN '
+        "INSERT INTO products_fts (products_fts, rowid, title, body) "
+        "VALUES ('delete', old.id, old.title, old.body); "
+        'INSERT INTO products_fts (rowid, title, body) '
+        'VALUES (new.id, new.title, new.body); END')
+
+
+def add_cart_cleanup(db):
+    # Количество в корзине меняется одним запросом quantity = quantity + ?
+    # (utils/cart.py), а позицию, где оно дошло до нуля, удаляет триггер
+    db.query('DELETE FROM cart WHERE quantity <= 0')
+    db.query(
+        'CREATE TRIGGER cart_drop_empty AFTER UPDATE OF quantity ON cart '
+        'WHEN new.quantity <= 0 BEGIN '
+        'DELETE FROM cart WHERE cid = new.cid AND idx = new.idx; END')
+
+
+MIGRATIONS = [
+    create_initial_tables,
+    add_keys_and_indexes,
+    add_photo_file_ids,
+    move_photos_to_blob_store,
+    add_fsm_storage,
+    normalize_orders,
+    add_order_filter_indexes,
+    add_roles,
+    add_surrogate_ids,
+    add_product_search,
+    add_cart_cleanup,
+]
+
+
+# Миграции, после которых в файле базы остается много свободных страниц
+# (удаленные BLOB-ы): база сжимается VACUUM, иначе файл не уменьшится
+VACUUM_AFTER = {move_photos_to_blob_store}
+
+
+def migrate(db, target=None):
+    # Применяет недостающие миграции к базе, каждую в своей транзакции.
+    # target - до какой версии обновлять (по умолчанию до последней).
+    target = len(MIGRATIONS) if target is None else target
+    version = db.fetchone('PRAGMA user_version')[0]
+
+    vacuum = False
+    for number in range(version + 1, target + 1):
+        with db.transaction():
+            MIGRATIONS[number - 1](db)
+            db.query(f'PRAGMA user_version = {number}')
+        vacuum = vacuum or MIGRATIONS[number - 1] in VACUUM_AFTER
+
+    # VACUUM нельзя выполнить внутри транзакции - один раз после всех миграций
+    if vacuum:
+        db.query('VACUUM')
+
+    return max(version, target)
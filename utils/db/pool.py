@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from sqlite3 import OperationalError
+
+from utils.metrics import waiting
+from .storage import DatabaseManager
+
+log = logging.getLogger(__name__)
+
+
+class Transaction:
+
+    # Запросы внутри async with db.transaction() as tx: выполняются
+    # на одном закрепленном соединении и фиксируются одним commit.
+
+    def __init__(self, manager, conn):
+        self.manager = manager
+        self.conn = conn
+
+    async def _run(self, method, *args):
+        loop = asyncio.get_running_loop()
+        with waiting('db'):
+            return await loop.run_in_executor(self.manager._executor, method,
+                                              self.conn, *args)
+
+    async def query(self, arg, values=None):
+        await self._run(DatabaseManager.query, arg, values)
+
+    async def query_returning(self, arg, values=None):
+        return await self._run(DatabaseManager.query_returning, arg, values)
+
+    async def querymany(self, arg, values):
+        await self._run(DatabaseManager.querymany, arg, values)
+
+    async def fetchone(self, arg, values=None):
+        return await self._run(DatabaseManager.fetchone, arg, values)
+
+    async def fetchall(self, arg, values=None):
+        return await self._run(DatabaseManager.fetchall, arg, values)
+
+
+class AsyncDatabaseManager:
+
+    # Неблокирующая версия DatabaseManager с теми же методами query/fetchone/fetchall.
+    # Каждый запрос выполняется в отдельном потоке на одном из соединений
+    # ограниченного пула, поэтому цикл событий aiogram не ждет sqlite.
+    #
+    # Если batch_window не None, запись через query идет по пути group commit:
+    # запросы от параллельных обработчиков копятся batch_window секунд
+    # (или до batch_size штук) и фиксируются одной транзакцией.
+    # await db.query(...) возвращается только после commit этой транзакции.
+
+    def __init__(self, path, size=4, timeout=5.0, retries=3,
+                 batch_window=None, batch_size=100, querylog=None):
+        self.path = path
+        self.retries = retries
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=size,
+                                            thread_name_prefix='db')
+        self._connections = [
+            DatabaseManager(path, timeout=timeout, check_same_thread=False,
+                            querylog=querylog)
+            for _ in range(size)]
+        self._pool = asyncio.Queue()
+        for conn in self._connections:
+            self._pool.put_nowait(conn)
+        self.blobs = self._connections[0].blobs
+
+        # Отдельное соединение и поток для пакетной записи
+        self._writes = asyncio.Queue()
+        self._writer = None
+        if batch_window is not None:
+            self._writer_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='db-writer')
+            self._writer_conn = DatabaseManager(path, timeout=timeout,
+                                                check_same_thread=False,
+                                                querylog=querylog)
+
+    async def _run(self, method, *args):
+        with waiting('db'):
+            # Берем свободное соединение (или ждем, пока оно освободится)
+            conn = await self._pool.get()
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, self._call,
+                                                  conn, method, args)
+            finally:
+                self._pool.put_nowait(conn)
+
+    def _call(self, conn, method, args):
+        # Выполняется в потоке пула. Если база занята дольше busy timeout,
+        # повторяем запрос несколько раз с растущей паузой.
+        for attempt in range(self.retries + 1):
+            try:
+                return method(conn, *args)
+            except OperationalError as e:
+                conn.conn.rollback()
+                if 'locked' not in str(e) or attempt == self.retries:
+                    raise
+                log.warning('Database is locked, retry %s: %s', attempt + 1, e)
+                time.sleep(0.05 * 2 ** attempt)
+            except Exception:
+                conn.conn.rollback()
+                raise
+
+    async def create_tables(self):
+        await self._run(DatabaseManager.create_tables)
+
+    async def query(self, arg, values=None):
+        if self.batch_window is None:
+            await self._run(DatabaseManager.query, arg, values)
+            return
+        await self._write(arg, values)
+
+    async def query_returning(self, arg, values=None):
+        # Запись с RETURNING: первая строка результата или None.
+        # Тоже идет пакетом и возвращается после commit.
+        if self.batch_window is None:
+            return await self._run(DatabaseManager.query_returning, arg, values)
+        return await self._write(arg, values)
+
+    async def _write(self, arg, values):
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._write_loop())
+
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait((arg, values, future))
+        with waiting('db'):
+            return await future
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._writes.get()]
+            # Даем другим обработчикам время добавить свои записи в пачку
+            if self.batch_window and self._writes.qsize() < self.batch_size:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.batch_size and not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+
+            statements = [(arg, values) for arg, values, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._writer_executor, self._call, self._writer_conn,
+                    DatabaseManager.query_batch, (statements,))
+            except Exception as e:
+                results = [(e, None)] * len(batch)
+
+            for (_, _, future), (error, row) in zip(batch, results):
+                self._writes.task_done()
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(row)
+                else:
+                    future.set_exception(error)
+
+    async def querymany(self, arg, values):
+        # Одна команда для многих наборов параметров - уже одна транзакция,
+        # поэтому мимо пакетной записи
+        await self._run(DatabaseManager.querymany, arg, values)
+
+    @asynccontextmanager
+    async def transaction(self):
+        # async with db.transaction() as tx: несколько запросов - один commit
+        # Запросы внутри блока учитываются в Transaction._run
+        with waiting('db'):
+            conn = await self._pool.get()
+        loop = asyncio.get_running_loop()
+        try:
+            with waiting('db'):
+                await loop.run_in_executor(self._executor, self._call, conn,
+                                           DatabaseManager.begin, ())
+            try:
+                yield Transaction(self, conn)
+            except BaseException:
+                await loop.run_in_executor(self._executor, conn.end, False)
+                raise
+            with waiting('db'):
+                await loop.run_in_executor(self._executor, conn.end, True)
+        finally:
+            self._pool.put_nowait(conn)
+
+    async def fetchone(self, arg, values=None):
+        return await self._run(DatabaseManager.fetchone, arg, values)
+
+    async def fetchall(self, arg, values=None):
+        return await self._run(DatabaseManager.fetchall, arg, values)
+
+    async def run(self, func, *args):
+        # func(conn, *args) в потоке пула на одном соединении - для работы,
+        # которая не сводится к одному запросу, например потоковой выгрузки
+        # через DatabaseManager.iterate
+        return await self._run(func, *args)
+
+    async def put_blob(self, data, key=None):
+        # Запись файла в хранилище тоже не должна блокировать цикл событий
+        loop = asyncio.get_running_loop()
+        with waiting('db'):
+            return await loop.run_in_executor(self._executor, self.blobs.put, data, key)
+
+    async def close(self):
+        # Дожидаемся, пока накопленные записи будут зафиксированы
+        if self._writer is not None:
+            await self._writes.join()
+            self._writer.cancel()
+            self._writer = None
+
+        self._executor.shutdown(wait=True)
+        for conn in self._connections:
+            conn.conn.close()
+        self._connections = []
+
+        if self.batch_window is not None:
+            self._writer_executor.shutdown(wait=True)
+            self._writer_conn.conn.close()
@@ -0,0 +1,95 @@
+import logging
+import re
+import threading
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def normalize(sql):
+    # Один и тот же запрос с разными литералами и переносами строк -
+    # одна строка статистики
+    sql = _LITERALS.sub('?', sql)
+    sql = _SPACES.sub(' ', sql).strip()
+    return _IN_LISTS.sub('IN (?, ...)', sql)
+
+
+def shape(values):
+    # В лог попадают только типы параметров, без значений пользователей
+    if values is None:
+        return '()'
+    if isinstance(values, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}'
+                               for key, value in values.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in values) + ')'
+
+
+class QueryLog:
+
+    # Статистика запросов DatabaseManager по нормализованному тексту SQL:
+    # количество, суммарное и максимальное время.
+    # Запросы дольше slow секунд пишутся в лог с типами параметров,
+    # а для первого медленного запроса каждого вида один раз снимается
+    # EXPLAIN QUERY PLAN - полный просмотр таблицы (SCAN) сразу виден в логе.
+    # Общий на все соединения пула, поэтому под блокировкой.
+
+    def __init__(self, slow=0.05):
+        self.slow = slow
+        self.plans = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, db, sql, values, elapsed):
+        key = normalize(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            if elapsed < self.slow:
+                return
+            stats[3] += 1
+            explain = key not in self.plans
+            if explain:
+                self.plans[key] = None
+
+        log.warning('Slow query %.1f ms %s: %s', elapsed * 1000, shape(values), key)
+        if explain:
+            self.plans[key] = plan = self._explain(db, sql, values)
+            if plan:
+                log.warning('Query plan for %s:\n%s', key, plan)
+
+    def _explain(self, db, sql, values):
+        if not sql.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE',
+                                                'REPLACE', 'WITH')):
+            return None
+        try:
+            rows = db.conn.execute('EXPLAIN QUERY PLAN ' + sql,
+                                   () if values is None else values).fetchall()
+        except Exception as e:
+            return f'EXPLAIN failed: {e}'
+        return '\n'.join(row[-1] for row in rows)
+
+    def top(self, limit=10):
+        # Самые дорогие запросы по суммарному времени
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: -item[1][1])[:limit]
+        return [(key, count, total, worst, slow, self.plans.get(key))
+                for key, (count, total, worst, slow) in items]
+
+    def stats(self):
+        with self._lock:
+            values = list(self._stats.values())
+        return {
+            'statements': sum(count for count, *_ in values),
+            'seconds': sum(total for _, total, *_ in values),
+            'slow': sum(slow for *_, slow in values),
+            'kinds': len(values),
+        }
@@ -1,50 +1,162 @@
+import os
+from contextlib import contextmanager
 from sqlite3 import connect
+from time import perf_counter
+
+from .blobs import BlobStore
+from .migrations import migrate
 
 
 class DatabaseManager:
 
-    def __init__(self, path):
-        self.conn = connect(path)
+    def __init__(self, path, timeout=5.0, check_same_thread=True, querylog=None):
+        self.path = path
+        # QueryLog для статистики и лога медленных запросов, None - без измерений
+        self.querylog = querylog
+        # Фото товаров хранятся не в базе, а в каталоге blobs рядом с ней
+        self.blobs = BlobStore(os.path.join(os.path.dirname(path), 'blobs'))
+        # timeout - сколько секунд sqlite ждет снятия чужой блокировки (busy timeout)
+        self.conn = connect(path, timeout=timeout,
+                            check_same_thread=check_same_thread)
+        # WAL позволяет читать базу параллельно с записью.
+        # synchronous = full: после commit данные гарантированно на диске.
+        self.conn.execute('pragma journal_mode = wal')
+        self.conn.execute('pragma synchronous = full')
         self.conn.execute('pragma foreign_keys = on')
         self.conn.commit()
         self.cur = self.conn.cursor()
+        # Глубина вложенности transaction(). Пока она больше нуля, query не делает commit.
+        self.depth = 0
 
     def create_tables(self):
-        self.query(
-            'CREATE TABLE IF NOT EXISTS products (idx text, title text, '
-            'body text, photo blob, price int, tag text)')
-        self.query(
-            'CREATE TABLE IF NOT EXISTS orders (cid int, usr_name text, '
-            'usr_address text, products text)')
-        self.query(
-            'CREATE TABLE IF NOT EXISTS cart (cid int, idx text, '
-            'quantity int)')
-        self.query(
-            'CREATE TABLE IF NOT EXISTS categories (idx text, title text)')
-        # self.query('CREATE TABLE IF NOT EXISTS wallet (cid int, balance real)')
-        self.query(
-            'CREATE TABLE IF NOT EXISTS questions (cid int, question text)')
+        # Создает таблицы и обновляет схему существующей базы до последней версии
+        migrate(self)
 
-    def query(self, arg, values=None):
+    def _execute(self, arg, values=None, fetch=None):
+        # Все запросы проходят здесь. Время считается вместе с чтением
+        # результата: sqlite выполняет основную работу при fetch.
+        if self.querylog is None:
+            if values is None:
+                self.cur.execute(arg)
+            else:
+                self.cur.execute(arg, values)
+            return fetch() if fetch is not None else None
+
+        start = perf_counter()
         if values is None:
             self.cur.execute(arg)
         else:
             self.cur.execute(arg, values)
+        result = fetch() if fetch is not None else None
+        self.querylog.record(self, arg, values, perf_counter() - start)
+        return result
+
+    def _commit(self):
+        if self.querylog is None:
+            self.conn.commit()
+            return
+
+        start = perf_counter()
         self.conn.commit()
+        self.querylog.record(self, 'COMMIT', None, perf_counter() - start)
+
+    def query(self, arg, values=None):
+        self._execute(arg, values)
+        if self.depth == 0:
+            self._commit()
+
+    def query_returning(self, arg, values=None):
+        # Запись с RETURNING: первая строка результата (None - ни одной), commit как у query.
+        # Результат читается целиком до commit.
+        rows = self._execute(arg, values, self.cur.fetchall)
+        if self.depth == 0:
+            self._commit()
+        return rows[0] if rows else None
+
+    def querymany(self, arg, values):
+        values = list(values)
+        start = perf_counter()
+        self.cur.executemany(arg, values)
+        if self.querylog is not None:
+            # Для типов параметров и EXPLAIN достаточно первого набора
+            self.querylog.record(self, arg, values[0] if values else None,
+                                 perf_counter() - start)
+        if self.depth == 0:
+            self._commit()
+
+    def begin(self):
+        # IMMEDIATE сразу берет блокировку на запись, чтобы транзакция
+        # не упала посередине из-за конкурентного писателя.
+        if self.depth == 0:
+            self.cur.execute('BEGIN IMMEDIATE')
+        self.depth += 1
+
+    def end(self, commit=True):
+        self.depth -= 1
+        if self.depth == 0:
+            try:
+                if commit:
+                    self._commit()
+            finally:
+                # Если commit не удался, транзакцию все равно нужно закрыть
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+
+    @contextmanager
+    def transaction(self):
+        # with db.transaction(): несколько запросов - один commit.
+        # Вложенные блоки присоединяются к внешней транзакции.
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.end(commit=False)
+            raise
+        self.end()
+
+    def query_batch(self, statements):
+        # Выполняет пачку записей одной транзакцией (group commit).
+        # Каждый запрос обернут в SAVEPOINT, поэтому ошибка одного запроса
+        # не отменяет остальные. Возвращает список пар (ошибка, строка):
+        # ошибка None - успех, строка - первая строка RETURNING или None.
+        results = []
+        with self.transaction():
+            for arg, values in statements:
+                self.cur.execute('SAVEPOINT batch_item')
+                try:
+                    rows = self._execute(arg, values, self.cur.fetchall)
+                    results.append((None, rows[0] if rows else None))
+                except Exception as e:
+                    self.cur.execute('ROLLBACK TO batch_item')
+                    results.append((e, None))
+                self.cur.execute('RELEASE batch_item')
+        return results
 
     def fetchone(self, arg, values=None):
-        if values is None:
-            self.cur.execute(arg)
-        else:
-            self.cur.execute(arg, values)
-        return self.cur.fetchone()
+        return self._execute(arg, values, self.cur.fetchone)
 
     def fetchall(self, arg, values=None):
-        if values is None:
-            self.cur.execute(arg)
-        else:
-            self.cur.execute(arg, values)
-        return self.cur.fetchall()
+        return self._execute(arg, values, self.cur.fetchall)
+
+    def iterate(self, arg, values=None, size=500):
+        # Большая выборка по size строк за раз: в памяти не больше одной пачки.
+        # Отдельный курсор, чтобы запросы во время итерации его не сбросили.
+        # В лог идет время execute и fetchmany, без обработки строк потребителем.
+        start = perf_counter()
+        cur = self.conn.execute(arg, () if values is None else values)
+        elapsed = perf_counter() - start
+        try:
+            while True:
+                start = perf_counter()
+                rows = cur.fetchmany(size)
+                elapsed += perf_counter() - start
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+            if self.querylog is not None:
+                self.querylog.record(self, arg, values, elapsed)
 
     def __del__(self):
         self.conn.close()
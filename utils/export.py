@@ -0,0 +1,63 @@
+import csv
+import gzip
+import json
+from itertools import groupby
+
+ORDER_COLUMNS = ('id', 'cid', 'usr_name', 'usr_address', 'status', 'total', 'created_at')
+ITEM_COLUMNS = ('idx', 'title', 'price', 'quantity')
+
+FORMATS = ('csv', 'jsonl')
+
+# Уровень сжатия как у утилиты gzip: 9 (по умолчанию в модуле gzip) заметно
+# медленнее при почти том же размере
+COMPRESS_LEVEL = 6
+
+
+# Заказы с id в [start, end) вместе с составом, по одному.
+# Выполняется в потоке пула базы (conn - DatabaseManager): строки читаются
+# пачками через iterate, в памяти только текущий заказ.
+def iter_orders(conn, start, end):
+    rows = conn.iterate('''SELECT orders.id, cid, usr_name, usr_address, status, total,
+    created_at, idx, title, price, quantity FROM orders
+    LEFT JOIN order_items ON order_items.order_id = orders.id
+    WHERE orders.id >= ? AND orders.id < ? ORDER BY orders.id, idx''', (start, end))
+
+    for order, group in groupby(rows, key=lambda row: row[:len(ORDER_COLUMNS)]):
+        # У заказа без позиций LEFT JOIN дает одну строку с NULL
+        items = [row[len(ORDER_COLUMNS):] for row in group if row[-4] is not None]
+        yield order, items
+
+
+# CSV - строка на позицию заказа, JSONL - объект на заказ с массивом items
+def write_csv(file, orders):
+    writer = csv.writer(file)
+    writer.writerow(ORDER_COLUMNS + ITEM_COLUMNS)
+    for order, items in orders:
+        for item in items or [(None,) * len(ITEM_COLUMNS)]:
+            writer.writerow(order + item)
+
+
+def write_jsonl(file, orders):
+    for order, items in orders:
+        record = dict(zip(ORDER_COLUMNS, order))
+        record['items'] = [dict(zip(ITEM_COLUMNS, item)) for item in items]
+        file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+# Выгрузка в сжатый файл path. Возвращает число заказов.
+# Запускается через db.run(export_orders, ...), чтобы не блокировать цикл событий.
+def export_orders(conn, path, fmt, start, end):
+    count = 0
+
+    def counted(orders):
+        nonlocal count
+        for order in orders:
+            count += 1
+            yield order
+
+    writer = write_csv if fmt == 'csv' else write_jsonl
+    with gzip.open(path, 'wt', compresslevel=COMPRESS_LEVEL,
+                   encoding='utf-8', newline='') as file:
+        writer(file, counted(iter_orders(conn, start, end)))
+
+    return count
@@ -0,0 +1,167 @@
+import asyncio
+import copy
+import logging
+import pickle
+import time
+
+from aiogram.dispatcher.storage import BaseStorage
+
+log = logging.getLogger(__name__)
+
+
+class Record:
+
+    __slots__ = ('state', 'data', 'bucket', 'touched')
+
+    def __init__(self, state=None, data=None, bucket=None):
+        self.state = state
+        self.data = data or {}
+        self.bucket = bucket or {}
+        self.touched = time.monotonic()
+
+
+class SQLiteStorage(BaseStorage):
+
+    # Хранилище FSM в таблице fsm нашей базы данных.
+    # Рабочая копия состояний лежит в памяти: чтение и запись идут в словарь,
+    # а в базу изменения уходят пачкой раз в flush_interval секунд
+    # (несколько изменений одного пользователя за это время - одна запись).
+    # Сессии, к которым не обращались ttl секунд, выгружаются из памяти
+    # и при следующем обращении читаются из базы.
+
+    def __init__(self, db, flush_interval=1.0, ttl=3600):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._records = {}
+        self._loads = {}
+        self._dirty = set()
+        self._flusher = None
+
+    async def _record(self, chat, user):
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        key = chat, user
+
+        record = self._records.get(key)
+        if record is None:
+            # Параллельные обращения к одной сессии ждут одну загрузку
+            load = self._loads.get(key)
+            if load is None:
+                load = self._loads[key] = asyncio.ensure_future(self._load(key))
+                load.add_done_callback(lambda _: self._loads.pop(key, None))
+            record = await asyncio.shield(load)
+
+        record.touched = time.monotonic()
+        return key, record
+
+    async def _load(self, key):
+        row = await self.db.fetchone(
+            'SELECT state, data, bucket FROM fsm WHERE chat=? AND user=?', key)
+        if row is None:
+            record = Record()
+        else:
+            state, data, bucket = row
+            record = Record(state, pickle.loads(data), pickle.loads(bucket))
+        return self._records.setdefault(key, record)
+
+    def _changed(self, key):
+        self._dirty.add(key)
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('FSM flush failed')
+            self._evict()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+
+        # Снимок делается сразу, без await: изменения во время записи
+        # снова пометят сессию и попадут в следующую пачку.
+        keys, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in keys:
+            record = self._records[key]
+            if record.state is None and not record.data and not record.bucket:
+                deletes.append(key)
+            else:
+                upserts.append((*key, record.state,
+                                pickle.dumps(record.data), pickle.dumps(record.bucket)))
+
+        try:
+            async with self.db.transaction() as tx:
+                if upserts:
+                    await tx.querymany(
+                        'INSERT OR REPLACE INTO fsm VALUES (?, ?, ?, ?, ?)', upserts)
+                if deletes:
+                    await tx.querymany(
+                        'DELETE FROM fsm WHERE chat=? AND user=?', deletes)
+        except Exception:
+            self._dirty |= keys
+            raise
+
+    def _evict(self):
+        expired = time.monotonic() - self.ttl
+        for key in [key for key, record in self._records.items()
+                    if record.touched < expired and key not in self._dirty]:
+            del self._records[key]
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        _, record = await self._record(chat, user)
+        return record.state or default
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        _, record = await self._record(chat, user)
+        return copy.deepcopy(record.data)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key, record = await self._record(chat, user)
+        record.data.update(data or {}, **kwargs)
+        self._changed(key)
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        key, record = await self._record(chat, user)
+        record.state = state
+        self._changed(key)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        key, record = await self._record(chat, user)
+        record.data = copy.deepcopy(data or {})
+        self._changed(key)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        await self.set_state(chat=chat, user=user, state=None)
+        if with_data:
+            await self.set_data(chat=chat, user=user, data={})
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        _, record = await self._record(chat, user)
+        return copy.deepcopy(record.bucket)
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        key, record = await self._record(chat, user)
+        record.bucket = copy.deepcopy(bucket or {})
+        self._changed(key)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        key, record = await self._record(chat, user)
+        record.bucket.update(bucket or {}, **kwargs)
+        self._changed(key)
@@ -0,0 +1,245 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from html import escape
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+
+# Границы корзин гистограммы задержек, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+WAIT_TARGETS = ('db', 'telegram')
+
+
+class Call:
+
+    # Один вызов хендлера: имя и сколько он ждал базу и Telegram
+    __slots__ = ('handler', 'db', 'telegram')
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.db = 0.0
+        self.telegram = 0.0
+
+
+current_call = ContextVar('metrics_call', default=None)
+
+
+def handler_name(func):
+    # Имя с модулем: одноименные хендлеры есть и у пользователя, и у админа
+    func = getattr(func, 'func', func)  # functools.partial
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+@contextmanager
+def waiting(target):
+    # with waiting('db'): ... - время блока добавляется к текущему хендлеру.
+    # Вне хендлера (запуск, фоновые задачи) ничего не измеряется.
+    call = current_call.get()
+    if call is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(call, target, getattr(call, target) + time.perf_counter() - start)
+
+
+class Histogram:
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Верхняя граница корзины, в которую попадает q-я доля наблюдений
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class HandlerMetrics:
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.in_flight = 0
+        self.db = 0.0
+        self.telegram = 0.0
+
+
+class Metrics:
+
+    # Метрики хендлеров: гистограмма задержек, ошибки, сколько выполняется
+    # прямо сейчас, суммарное ожидание базы и Telegram.
+    # Отдаются в формате Prometheus (serve) и текстом для админской команды /stats.
+    # Источники - функции stats() других компонентов (кэш каталога, Sender),
+    # их числа попадают в оба вывода.
+
+    def __init__(self):
+        self.handlers = defaultdict(HandlerMetrics)
+        self.updates = 0
+        self.unhandled = 0
+        self.started = time.monotonic()
+        self._sources = {}
+        self._runner = None
+
+    def add_source(self, name, stats):
+        self._sources[name] = stats
+
+    def begin(self, handler):
+        self.handlers[handler].in_flight += 1
+        return Call(handler)
+
+    def end(self, call, elapsed):
+        handler = self.handlers[call.handler]
+        handler.in_flight -= 1
+        handler.latency.observe(elapsed)
+        handler.db += call.db
+        handler.telegram += call.telegram
+
+    def error(self, call):
+        self.handlers[call.handler].errors += 1
+
+    def prometheus(self):
+        lines = [
+            '# TYPE bot_updates_total counter',
+            f'bot_updates_total {self.updates}',
+            '# TYPE bot_updates_unhandled_total counter',
+            f'bot_updates_unhandled_total {self.unhandled}',
+            '# TYPE bot_handler_seconds histogram',
+        ]
+        for name, handler in sorted(self.handlers.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), handler.latency.counts):
+                cumulative += count
+                lines.append(f'bot_handler_seconds_bucket{{handler="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'bot_handler_seconds_sum{{handler="{name}"}} {handler.latency.sum}')
+            lines.append(f'bot_handler_seconds_count{{handler="{name}"}} {handler.latency.count}')
+
+        lines.append('# TYPE bot_handler_errors_total counter')
+        lines += [f'bot_handler_errors_total{{handler="{name}"}} {handler.errors}'
+                  for name, handler in sorted(self.handlers.items())]
+        lines.append('# TYPE bot_handler_in_flight gauge')
+        lines += [f'bot_handler_in_flight{{handler="{name}"}} {handler.in_flight}'
+                  for name, handler in sorted(self.handlers.items())]
+        lines.append('# TYPE bot_handler_wait_seconds_total counter')
+        lines += [f'bot_handler_wait_seconds_total{{handler="{name}",target="{target}"}} '
+                  f'{getattr(handler, target)}'
+                  for name, handler in sorted(self.handlers.items())
+                  for target in WAIT_TARGETS]
+
+        for source, stats in self._sources.items():
+            for key, value in stats().items():
+                lines.append(f'# TYPE bot_{source}_{key} gauge')
+                lines.append(f'bot_{source}_{key} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        uptime = time.monotonic() - self.started
+        lines = [f'Апдейтов: {self.updates} ({self.updates / uptime:.2f}/с), '
+                 f'без хендлера: {self.unhandled}', '',
+                 f'{"хендлер":<32}{"n":>6}{"ср.мс":>8}{"p95":>7}{"ош":>4}'
+                 f'{"база":>7}{"tg":>7}']
+
+        by_time = sorted(self.handlers.items(), key=lambda item: -item[1].latency.sum)
+        for name, handler in by_time:
+            n = handler.latency.count or 1
+            # Длинные имена обрезаются слева: отличаются они концом
+            name = name.removeprefix('handlers.')
+            if len(name) > 31:
+                name = '…' + name[-30:]
+            # Текст уходит с HTML-разметкой, а в qualname бывают <lambda> и <locals>
+            lines.append(escape(f'{name:<32}') + f'{handler.latency.count:>6}'
+                         f'{handler.latency.sum / n * 1000:>8.0f}'
+                         f'{handler.latency.quantile(0.95) * 1000:>7.0f}'
+                         f'{handler.errors:>4}'
+                         f'{handler.db / n * 1000:>7.0f}{handler.telegram / n * 1000:>7.0f}')
+
+        for source, stats in self._sources.items():
+            lines.append('')
+            lines.append(escape(source + ': ' + ', '.join(
+                f'{key}={value:.3g}' if isinstance(value, float) else f'{key}={value}'
+                for key, value in stats().items())))
+
+        return '<pre>' + '\n'.join(lines) + '</pre>'
+
+    async def serve(self, host, port):
+        async def handle(request):
+            return web.Response(text=self.prometheus(),
+                                content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class MetricsMiddleware(BaseMiddleware):
+
+    # Подключается к dp: засекает время от выбора хендлера фильтрами
+    # до его завершения, а имя хендлера берет из current_handler aiogram.
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def setup(self, manager):
+        super().setup(manager)
+        # Исключения из хендлеров доходят только до обработчиков ошибок
+        manager.dispatcher.register_errors_handler(self.on_error)
+
+    async def on_pre_process_update(self, update, data):
+        self.metrics.updates += 1
+
+    async def on_post_process_update(self, update, results, data):
+        if current_call.get() is None:
+            self.metrics.unhandled += 1
+
+    async def on_process_event(self, event, data):
+        if 'metrics_started' in data:
+            return
+        # У кнопок обработчик выбирает CallbackRouter, и его имя - в data
+        handler = data.get('callback_handler') or current_handler.get()
+        call = self.metrics.begin(handler_name(handler))
+        current_call.set(call)
+        data['metrics_started'] = time.perf_counter()
+
+    async def on_post_process_event(self, event, results, data):
+        started = data.get('metrics_started')
+        if started is not None:
+            self.metrics.end(current_call.get(), time.perf_counter() - started)
+
+    on_process_message = on_process_callback_query = on_process_inline_query = on_process_event
+    on_post_process_message = on_post_process_callback_query = \
+        on_post_process_inline_query = on_post_process_event
+
+    async def on_error(self, update, exception):
+        call = current_call.get()
+        if call is not None:
+            self.metrics.error(call)
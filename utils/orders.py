@@ -0,0 +1,68 @@
+import time
+
+# Статусы заказа (orders.status)
+NEW = 0
+SHIPPED = 1
+DELIVERED = 2
+
+STATUS_TEXT = {
+    NEW: 'лежит на складе',
+    SHIPPED: 'уже в пути!',
+    DELIVERED: 'прибыл и ждет вас на почте!',
+}
+
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Сколько заказов показывается в одном сообщении
+ORDERS_PER_MESSAGE = 10
+# и позиций каждого заказа: сообщение Telegram ограничено 4096 символами
+ITEMS_PER_ORDER = 10
+
+
+# Заказы вместе с составом: состав читается одним запросом по первичному ключу order_items
+async def fetch_items(db, order_ids):
+    items = {order_id: [] for order_id in order_ids}
+    if order_ids:
+        rows = await db.fetchall(
+            f'''SELECT order_id, title, price, quantity FROM order_items
+            WHERE order_id IN ({", ".join("?" * len(order_ids))})''', order_ids)
+        for order_id, title, price, quantity in rows:
+            items[order_id].append((title, price, quantity))
+    return items
+
+
+# id первого заказа, сделанного не раньше timestamp, None - таких нет.
+# id растут вместе с created_at, поэтому период превращается в диапазон
+# первичного ключа одним поиском по индексу orders_created.
+async def first_order_since(db, timestamp):
+    row = await db.fetchone('''SELECT id FROM orders WHERE created_at >= ?
+    ORDER BY created_at LIMIT 1''', (int(timestamp),))
+    return None if row is None else row[0]
+
+
+def order_text(order_id, status, total, created_at, items):
+    date = time.strftime(' от %d.%m.%Y', time.localtime(created_at)) if created_at else ''
+    lines = [f'Заказ <b>№{order_id}</b>{date} - {STATUS_TEXT.get(status, status)}']
+    lines += [f'{title or "товар удален"} * {quantity}шт. = {price * quantity}₽'
+              for title, price, quantity in items[:ITEMS_PER_ORDER]]
+    if len(items) > ITEMS_PER_ORDER:
+        lines.append(f'... и еще позиций: {len(items) - ITEMS_PER_ORDER}')
+    lines.append(f'Сумма: {total}₽')
+    return '\n'.join(lines)
+
+
+# Раскладывает тексты по сообщениям не длиннее MESSAGE_LIMIT, не разрывая
+# текст одного заказа (если он сам не длиннее лимита)
+def split_message(texts, separator='\n\n'):
+    messages = []
+    current = ''
+    for text in texts:
+        if current and len(current) + len(separator) + len(text) <= MESSAGE_LIMIT:
+            current += separator + text
+            continue
+        if current:
+            messages.append(current)
+        current = text[:MESSAGE_LIMIT]
+    if current:
+        messages.append(current)
+    return messages
@@ -0,0 +1,171 @@
+import asyncio
+from io import BytesIO
+
+from aiogram.types import InputFile, InputMediaPhoto, MediaGroup, ParseMode
+from aiogram.utils.exceptions import BadRequest, MessageNotModified
+
+from loader import db, bot
+from data.config import PRODUCT_PHOTO_SIZE
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен: без него фото хранится как есть
+    Image = None
+
+
+class FileIds:
+
+    # file_id фото товаров, которые Telegram вернул после первой загрузки.
+    # Хранятся в таблице photo_file_ids, а в памяти процесса лежит их копия:
+    # (idx товара, photo_hash) -> file_id. Копия загружается один раз при первом обращении.
+
+    def __init__(self):
+        self._ids = None
+
+    async def get(self, idx, image_hash):
+        if self._ids is None:
+            rows = await db.fetchall(
+                'SELECT idx, photo_hash, file_id FROM photo_file_ids')
+            self._ids = {(idx, image_hash): file_id
+                         for idx, image_hash, file_id in rows}
+        return self._ids.get((idx, image_hash))
+
+    async def remember(self, idx, image_hash, file_id):
+        # Запоминаем file_id, только если товар с этим фото все еще существует
+        await db.query('''INSERT OR REPLACE INTO photo_file_ids
+        SELECT ?, ?, ? WHERE EXISTS
+        (SELECT 1 FROM products WHERE idx=? AND photo_hash=?)''',
+                       (idx, image_hash, file_id, idx, image_hash))
+        if self._ids is not None:
+            self._ids[(idx, image_hash)] = file_id
+
+    async def forget(self, idx, image_hash):
+        await db.query('DELETE FROM photo_file_ids WHERE idx=? AND photo_hash=?',
+                       (idx, image_hash))
+        if self._ids is not None:
+            self._ids.pop((idx, image_hash), None)
+
+
+file_ids = FileIds()
+
+
+# Отправка фото товара с кэшем file_id.
+# Если Telegram уже знает это фото, отправляется только file_id.
+# Иначе фото передается потоком прямо из файла хранилища db.blobs,
+# не загружаясь в память целиком, а полученный file_id запоминается.
+async def answer_photo(m, idx, image_hash, **kwargs):
+    file_id = await file_ids.get(idx, image_hash)
+
+    if file_id is not None:
+        try:
+            return await m.answer_photo(photo=file_id, **kwargs)
+        except BadRequest:
+            await file_ids.forget(idx, image_hash)
+
+    message = await m.answer_photo(photo=blob_file(image_hash), **kwargs)
+    await file_ids.remember(idx, image_hash, message.photo[-1].file_id)
+
+    return message
+
+
+# То же для карусели: заменяет фото и подпись уже отправленного сообщения
+async def edit_photo(m, idx, image_hash, caption, reply_markup):
+    file_id = await file_ids.get(idx, image_hash)
+
+    if file_id is not None:
+        try:
+            return await m.edit_media(
+                InputMediaPhoto(file_id, caption=caption, parse_mode=ParseMode.HTML),
+                reply_markup=reply_markup)
+        except MessageNotModified:
+            return m
+        except BadRequest:
+            await file_ids.forget(idx, image_hash)
+
+    message = await m.edit_media(
+        InputMediaPhoto(blob_file(image_hash), caption=caption,
+                        parse_mode=ParseMode.HTML),
+        reply_markup=reply_markup)
+    await file_ids.remember(idx, image_hash, message.photo[-1].file_id)
+
+    return message
+
+
+# Отправка до 10 фото товаров одним альбомом (sendMediaGroup).
+# photos - список (idx, photo_hash, подпись). Известные file_id и файлы
+# неизвестных фото уходят одним запросом.
+async def answer_album(m, photos):
+    known = [await file_ids.get(idx, image_hash) for idx, image_hash, _ in photos]
+
+    try:
+        messages = await m.answer_media_group(album(photos, known))
+    except BadRequest:
+        if not any(known):
+            raise
+        # Какой-то из file_id больше не действителен: отправляем альбом заново файлами
+        for (idx, image_hash, _), file_id in zip(photos, known):
+            if file_id is not None:
+                await file_ids.forget(idx, image_hash)
+        known = [None] * len(photos)
+        messages = await m.answer_media_group(album(photos, known))
+
+    for (idx, image_hash, _), file_id, message in zip(photos, known, messages):
+        if file_id is None:
+            await file_ids.remember(idx, image_hash, message.photo[-1].file_id)
+
+    return messages
+
+
+def album(photos, known):
+    return MediaGroup([
+        InputMediaPhoto(file_id or blob_file(image_hash), caption=caption,
+                        parse_mode=ParseMode.HTML)
+        for (_, image_hash, caption), file_id in zip(photos, known)])
+
+
+def blob_file(image_hash):
+    # В Telegram уходит уменьшенная копия, если она есть, иначе оригинал
+    key = thumbnail_key(image_hash)
+    if not db.blobs.exists(key):
+        key = image_hash
+    return InputFile(db.blobs.path(key), filename=f'{key}.jpg')
+
+
+def thumbnail_key(image_hash):
+    # Ключ уменьшенной копии выводится из ключа оригинала и размера:
+    # при другом PRODUCT_PHOTO_SIZE старые копии просто не найдутся
+    return f'{image_hash}-{PRODUCT_PHOTO_SIZE}'
+
+
+# Фото товара от админа скачивается по частям сразу в хранилище db.blobs,
+# без загрузки в память целиком. Оригинал сохраняется всегда, а если
+# установлен Pillow и фото больше PRODUCT_PHOTO_SIZE, рядом кладется
+# уменьшенная копия под ключом thumbnail_key. Одинаковые фото хранятся
+# один раз. Возвращает ключ оригинала.
+async def download_photo(file_id):
+    file = await bot.get_file(file_id)
+
+    with db.blobs.writer() as original:
+        await bot.download_file(file.file_path, destination=original, seek=False)
+        image_hash = original.commit()
+
+    if Image is not None and PRODUCT_PHOTO_SIZE is not None \
+            and not db.blobs.exists(thumbnail_key(image_hash)):
+        loop = asyncio.get_running_loop()
+        thumbnail = await loop.run_in_executor(None, downscale,
+                                               db.blobs.path(image_hash),
+                                               PRODUCT_PHOTO_SIZE)
+        if thumbnail is not None:
+            await db.put_blob(thumbnail, thumbnail_key(image_hash))
+
+    return image_hash
+
+
+def downscale(path, size):
+    with Image.open(path) as image:
+        if max(image.size) <= size:
+            return None
+        image.thumbnail((size, size))
+        result = BytesIO()
+        image.convert('RGB').save(result, 'JPEG', quality=85)
+        return result.getvalue()
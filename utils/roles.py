@@ -0,0 +1,71 @@
+from contextvars import ContextVar
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from utils.webhook import update_key
+
+ADMIN = 'admin'
+USER = 'user'
+
+# Роль автора текущего апдейта, ее выставляет RolesMiddleware
+current_role = ContextVar('current_role', default=None)
+
+
+class Roles:
+
+    # Роли пользователей: таблица roles в базе и ее полная копия в памяти.
+    # В таблице хранятся только роли, отличные от USER (сейчас - админы),
+    # поэтому она маленькая и загружается целиком при запуске.
+    # Роли меняются только через set: сначала база, затем кэш (remember).
+
+    def __init__(self, db):
+        self.db = db
+        self._roles = {}
+
+    async def load(self, admins=()):
+        # admins - ADMINS из data/config.py, они становятся админами при каждом запуске
+        if admins:
+            await self.db.querymany('INSERT OR IGNORE INTO roles VALUES (?, ?)',
+                                    [(uid, ADMIN) for uid in admins])
+        self._roles = dict(await self.db.fetchall('SELECT uid, role FROM roles'))
+
+    def get(self, uid):
+        return self._roles.get(uid, USER)
+
+    async def set(self, uid, role):
+        if role == USER:
+            await self.db.query('DELETE FROM roles WHERE uid=?', (uid,))
+        else:
+            await self.db.query('INSERT OR REPLACE INTO roles VALUES (?, ?)', (uid, role))
+        self.remember(uid, role)
+
+    def remember(self, uid, role):
+        if role == USER:
+            self._roles.pop(uid, None)
+        else:
+            self._roles[uid] = role
+
+    def stats(self):
+        return {'admins': sum(role == ADMIN for role in self._roles.values())}
+
+
+# Роль вызвавшего: из контекста апдейта, а без RolesMiddleware - из кэша
+def role_of(roles, user_id):
+    role = current_role.get()
+    return roles.get(user_id) if role is None else role
+
+
+class RolesMiddleware(BaseMiddleware):
+
+    # Роль определяется один раз на апдейт, до фильтров, и кладется
+    # в current_role. Фильтры IsAdmin/IsUser всех обработчиков-кандидатов
+    # читают ее оттуда. Каждый апдейт обрабатывается в своей задаче
+    # (gather при polling, UpdateQueue при webhook), так что значения
+    # разных апдейтов не смешиваются.
+
+    def __init__(self, roles):
+        super().__init__()
+        self.roles = roles
+
+    async def on_pre_process_update(self, update, data):
+        current_role.set(self.roles.get(update_key(update)))
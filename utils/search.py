@@ -0,0 +1,90 @@
+import re
+from collections import OrderedDict
+
+_WORDS = re.compile(r'\w+')
+
+# Слова короче не ищутся по префиксу: под "а*" подходит почти весь каталог
+MIN_PREFIX = 2
+MAX_WORDS = 8
+# Сколько совпадений сортируется по bm25 (он считается для каждого).
+# Если под запрос подходит больше товаров, то каждое его слово есть больше
+# чем в RANKED товарах - это стоп-слова: они отбирают товары, но не
+# сортируют их, и результаты идут от новых товаров к старым.
+RANKED = 10000
+
+
+def match_query(text):
+    # Текст пользователя -> выражение FTS5 MATCH: все слова обязательны,
+    # последнее - по префиксу (поиск по мере набора в inline-режиме).
+    # Каждое слово в кавычках, поэтому операторы FTS5 из текста не действуют.
+    words = _WORDS.findall(text.lower())[:MAX_WORDS]
+    if not words:
+        return None
+    query = ' '.join(f'"{word}"' for word in words)
+    return query + '*' if len(words[-1]) >= MIN_PREFIX else query
+
+
+class ProductSearch:
+
+    # Поиск товаров по индексу products_fts (миграция add_product_search):
+    # limit лучших по bm25 среди всех совпадений, а для запроса только
+    # из стоп-слов (см. RANKED) - limit самых новых. Результат хранится в LRU
+    # из cache_size последних запросов: листание inline-результатов
+    # и повторные запросы не обращаются к базе.
+    # Админские обработчики, меняющие товары, вызывают clear().
+
+    def __init__(self, db, limit=100, cache_size=256):
+        self.db = db
+        self.limit = limit
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def find(self, text):
+        # Список (id, idx, title, body, price, photo_hash), лучшие первыми
+        query = match_query(text)
+        if query is None:
+            return []
+
+        if query in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(query)
+            return self._cache[query]
+
+        self.misses += 1
+        version = self._version
+        # Совпадения считаются без bm25 и не дальше RANKED + 1
+        count, = await self.db.fetchone('''SELECT COUNT(*) FROM (SELECT 1
+        FROM products_fts WHERE products_fts MATCH ? LIMIT ?)''', (query, RANKED + 1))
+        if count <= RANKED:
+            found = 'SELECT rowid, rank FROM products_fts WHERE products_fts MATCH ? ORDER BY rank LIMIT ?'
+        else:
+            found = ('SELECT rowid, -rowid AS rank FROM products_fts '
+                     'WHERE products_fts MATCH ? ORDER BY rowid DESC LIMIT ?')
+        # Сначала limit лучших из индекса, потом товары к ним по первичному ключу
+        rows = [] if count == 0 else await self.db.fetchall(
+            f'''SELECT products.id, idx, products.title, products.body, price, photo_hash
+            FROM ({found}) AS found JOIN products ON products.id = found.rowid
+            ORDER BY found.rank''', (query, self.limit))
+
+        # Каталог изменился, пока шел запрос - результат не кэшируем
+        if version == self._version:
+            self._cache[query] = rows
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return rows
+
+    def clear(self):
+        self._cache.clear()
+        self._version += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'queries': len(self._cache),
+        }
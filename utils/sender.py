@@ -0,0 +1,188 @@
+import asyncio
+import itertools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import Bot
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import RetryAfter
+
+from utils.metrics import waiting
+
+log = logging.getLogger(__name__)
+
+# Очереди исходящих сообщений: ответы пользователю идут раньше массовых рассылок
+INTERACTIVE = 0
+BULK = 1
+
+current_priority = ContextVar('send_priority', default=INTERACTIVE)
+
+
+class TokenBucket:
+
+    # Ведро токенов в форме GCRA: хранится только теоретическое время
+    # следующей отправки (tat), а reserve() сразу бронирует место в очереди
+    # и возвращает, сколько нужно подождать.
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1 / rate
+        self.burst = burst
+        self.tat = 0.0
+
+    def reserve(self, now):
+        tat = max(self.tat, now)
+        self.tat = tat + self.interval
+        return max(0.0, tat - (self.burst - 1) * self.interval - now)
+
+    def pause(self, now, seconds):
+        self.tat = max(self.tat, now + seconds)
+
+
+class Sender:
+
+    # Планировщик исходящих запросов к Telegram с учетом лимитов:
+    # не чаще chat_rate сообщений в секунду в один чат (с запасом chat_burst)
+    # и не чаще global_rate сообщений в секунду всего.
+    # Общий лимит выдается по приоритету: сначала INTERACTIVE, потом BULK.
+    # На RetryAfter запрос повторяется после паузы, которую назвал Telegram.
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, retries=3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self._global = TokenBucket(global_rate)
+        self._chats = {}
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._dispatcher = None
+
+        # Метрики
+        self.acquired = 0
+        self.sent = 0
+        self.retried = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @contextmanager
+    def bulk(self):
+        # with sender.bulk(): - все отправки внутри блока идут в очередь BULK
+        token = current_priority.set(BULK)
+        try:
+            yield
+        finally:
+            current_priority.reset(token)
+
+    def set_global_rate(self, rate):
+        self._global = TokenBucket(rate)
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Забываем чаты, которые давно ничего не получали
+            if len(self._chats) > 10000:
+                self._chats = {key: value for key, value in self._chats.items()
+                               if value.tat > now}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, future = await self._queue.get()
+            await asyncio.sleep(self._global.reserve(loop.time()))
+            if not future.done():
+                future.set_result(None)
+
+    async def _acquire(self, chat_id, priority):
+        loop = asyncio.get_running_loop()
+
+        if chat_id is not None:
+            await asyncio.sleep(self._chat_bucket(chat_id, loop.time()).reserve(loop.time()))
+
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+        future = loop.create_future()
+        self._queue.put_nowait((priority, next(self._order), future))
+        await future
+
+    async def send(self, chat_id, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        priority = current_priority.get()
+
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        start = loop.time()
+        try:
+            await self._acquire(chat_id, priority)
+        finally:
+            self.waiting -= 1
+        waited = loop.time() - start
+        self.acquired += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+        for attempt in range(self.retries + 1):
+            try:
+                result = await method(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                self.retried += 1
+                log.warning('Flood control for chat %s, retry in %s s', chat_id, e.timeout)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id, loop.time()).pause(loop.time(), e.timeout)
+                await asyncio.sleep(e.timeout)
+
+    async def close(self):
+        # Останавливает выдачу общего лимита. Вызывается при остановке бота,
+        # когда отправлять уже нечего; повторный вызов ничего не делает.
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'retried': self.retried,
+            'queue_depth': self.waiting,
+            'max_queue_depth': self.max_waiting,
+            'wait_avg': self.wait_total / self.acquired if self.acquired else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+
+class ThrottledBot(Bot):
+
+    # Bot, все отправки и изменения сообщений которого проходят через Sender.
+    # Обработчики по-прежнему вызывают message.answer, bot.send_message и т.д.
+
+    THROTTLED_PREFIXES = ('send', 'edit', 'forward', 'copy')
+
+    def __init__(self, *args, sender, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sender = sender
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        # Время запроса вместе с ожиданием очереди Sender учитывается
+        # в метриках текущего хендлера
+        with waiting('telegram'):
+            if not method.startswith(self.THROTTLED_PREFIXES) or method == 'sendChatAction':
+                return await super().request(method, data, files, **kwargs)
+
+            chat_id = (data or {}).get('chat_id')
+            return await self.sender.send(chat_id, self._request, method, data, files, **kwargs)
+
+    async def _request(self, method, data, files, **kwargs):
+        # При повторе после RetryAfter файлы нужно отправлять с начала
+        for value in (files or {}).values():
+            file = value.file if isinstance(value, InputFile) else value
+            if hasattr(file, 'seek'):
+                file.seek(0)
+        return await super().request(method, data, files, **kwargs)
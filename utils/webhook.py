@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+EVENTS = ('message', 'edited_message', 'callback_query', 'inline_query',
+          'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+          'poll_answer', 'channel_post', 'edited_channel_post')
+
+
+def update_key(update):
+    # Кому принадлежит апдейт: пользователь, а если его нет - чат
+    for name in EVENTS:
+        event = getattr(update, name)
+        if event:
+            user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+            if user:
+                return user.id
+            chat = getattr(event, 'chat', None)
+            if chat:
+                return chat.id
+    return update.update_id
+
+
+class UpdateQueue:
+
+    # Апдейты раскладываются по workers очередям по key (по умолчанию
+    # update_key): апдейты одного пользователя обрабатываются одним воркером
+    # строго по порядку (FSM не увидит второе сообщение раньше первого),
+    # разных - параллельно.
+    # Очереди ограничены size апдейтами на всех: переполненная очередь
+    # отвечает Telegram отказом, и он повторит доставку позже.
+    # on_done(update) вызывается после обработки каждого апдейта.
+
+    def __init__(self, dispatcher, workers=64, size=1000, on_done=None, key=update_key):
+        self.dispatcher = dispatcher
+        self.key = key
+        self.on_done = on_done
+        self.closed = True
+        self._queues = [asyncio.Queue(max(1, size // workers)) for _ in range(workers)]
+        self._workers = []
+        self._processed = 0
+        self._rejected = 0
+        self._max_depth = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+
+    def start(self):
+        self.closed = False
+        self._workers = [asyncio.ensure_future(self._work(queue)) for queue in self._queues]
+
+    def put(self, update):
+        if self.closed:
+            return False
+
+        queue = self._queues[self.key(update) % len(self._queues)]
+        try:
+            queue.put_nowait((update, time.monotonic()))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            return False
+
+        self._max_depth = max(self._max_depth, self.depth())
+        return True
+
+    async def put_wait(self, update):
+        # То же без отказов: ждет места в очереди
+        # (процессы-воркеры utils/workers.py, им некому отказать)
+        await self._queues[self.key(update) % len(self._queues)].put(
+            (update, time.monotonic()))
+        self._max_depth = max(self._max_depth, self.depth())
+
+    def depth(self):
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def _work(self, queue):
+        while True:
+            update, received = await queue.get()
+            lag = time.monotonic() - received
+            self._lag_total += lag
+            self._lag_max = max(self._lag_max, lag)
+            try:
+                # Каждый апдейт - в своей задаче: aiogram кэширует состояние FSM
+                # и текущие объекты в ContextVar, и в общем контексте воркера
+                # следующий апдейт увидел бы их от предыдущего
+                await asyncio.ensure_future(self.dispatcher.updates_handler.notify(update))
+            except Exception:
+                log.exception('Update %s failed', update.update_id)
+            finally:
+                self._processed += 1
+                queue.task_done()
+                if self.on_done is not None:
+                    self.on_done(update)
+
+    async def drain(self, timeout=None):
+        # Новые апдейты больше не принимаются, принятые дорабатываются
+        # (не дольше timeout секунд), после чего воркеры останавливаются.
+        self.closed = True
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            log.warning('Webhook drain timed out, %s updates dropped', self.depth())
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self):
+        return {
+            'processed': self._processed,
+            'rejected': self._rejected,
+            'queue_depth': self.depth(),
+            'max_queue_depth': self._max_depth,
+            'lag_avg': self._lag_total / self._processed if self._processed else 0.0,
+            'lag_max': self._lag_max,
+        }
+
+
+async def handle_update(request):
+    queue = request.app['updates']
+    update = types.Update(**await request.json())
+    if not queue.put(update):
+        return web.Response(status=503, headers={'Retry-After': '1'})
+    return web.Response()
+
+
+def make_app(dispatcher, path, url=None, workers=64, queue_size=1000,
+             drain_timeout=30, on_startup=None, on_shutdown=None):
+    # url - адрес, который сообщается Telegram через setWebhook;
+    # None - не трогать вебхук (локальные тесты и бенчмарки)
+    app = web.Application()
+    app['updates'] = queue = UpdateQueue(dispatcher, workers, queue_size)
+    app.router.add_post(path, handle_update)
+
+    async def startup(app):
+        # Воркеры создаются здесь и наследуют текущие бота и диспетчер
+        Bot.set_current(dispatcher.bot)
+        Dispatcher.set_current(dispatcher)
+        if on_startup is not None:
+            await on_startup(dispatcher)
+        queue.start()
+        if url is not None:
+            await dispatcher.bot.set_webhook(url)
+
+    async def shutdown(app):
+        await queue.drain(drain_timeout)
+        log.info('Webhook: %s', queue.stats())
+        if on_shutdown is not None:
+            await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        await dispatcher.bot.close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+def start_webhook(dispatcher, path, url, host, port, **kwargs):
+    # Бот и его сессия созданы в loader на текущем цикле событий,
+    # поэтому сервер запускается на нем же
+    app = make_app(dispatcher, path, url, **kwargs)
+    web.run_app(app, host=host, port=port, loop=dispatcher.loop)
@@ -0,0 +1,381 @@
+import asyncio
+import importlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot import api
+from aiogram.bot.base import sentinel
+from aiohttp import web
+
+from data import config
+from utils.webhook import EVENTS, UpdateQueue
+
+log = logging.getLogger(__name__)
+
+# Режим нескольких процессов. Основной процесс (Front) только получает
+# апдейты - через getUpdates или вебхук - и, не разбирая их в объекты aiogram,
+# раздает процессам-воркерам по chat.id через unix-сокет. Апдейты одного чата
+# всегда попадают в один воркер и обрабатываются там по порядку, разные чаты -
+# параллельно на разных ядрах. Воркер - обычный бот (хендлеры, FSM, кэши)
+# со своими соединениями к общей базе: WAL, busy timeout и повторы
+# AsyncDatabaseManager позволяют писать в нее из нескольких процессов.
+#
+# Сообщения по сокету - pickle с длиной впереди:
+#   Front -> воркер: ('update', dict), ('call', name, args)
+#   воркер -> Front: ('hello', number), ('done', update_id), ('call', name, args)
+
+_HEADER = struct.Struct('!I')
+
+
+def write_frame(writer, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    writer.write(_HEADER.pack(len(data)) + data)
+
+
+async def read_frame(reader):
+    # None - соединение закрыто
+    try:
+        header = await reader.readexactly(_HEADER.size)
+        return pickle.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        return None
+
+
+def shard_key(update):
+    # Чат апдейта по сырому JSON; у inline-запросов чата нет - тогда пользователь
+    for name in EVENTS:
+        event = update.get(name)
+        if event:
+            chat = event.get('chat') or (event.get('message') or {}).get('chat')
+            if chat:
+                return chat['id']
+            user = event.get('from') or event.get('user')
+            if user:
+                return user['id']
+    return update['update_id']
+
+
+def chat_key(update):
+    # То же для апдейта-объекта aiogram: очереди внутри воркера тоже
+    # упорядочивают апдейты по чату, а не по пользователю, как в режиме
+    # вебхука, - в группе апдейты разных участников идут по порядку
+    for name in EVENTS:
+        event = getattr(update, name)
+        if event:
+            chat = getattr(event, 'chat', None) or \
+                getattr(getattr(event, 'message', None), 'chat', None)
+            if chat:
+                return chat.id
+            user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+            if user:
+                return user.id
+    return update.update_id
+
+
+class Peers:
+
+    # Изменения, которые должны увидеть все процессы. Метод, обернутый
+    # share, выполняется локально и через Front рассылается остальным
+    # воркерам - так сброс кэша каталога, поиска или роли, сделанный
+    # админом в одном процессе, доходит до всех.
+    # В одном процессе (без воркеров) это обычный вызов.
+
+    def __init__(self):
+        self._methods = {}
+        self._writer = None
+
+    def share(self, name, method):
+        self._methods[name] = method
+
+        def shared(*args):
+            method(*args)
+            if self._writer is not None:
+                write_frame(self._writer, ('call', name, args))
+
+        return shared
+
+    def connect(self, writer):
+        self._writer = writer
+
+    def apply(self, name, args):
+        self._methods[name](*args)
+
+
+class Front:
+
+    # Основной процесс: запускает processes воркеров (spawn - каждый
+    # импортирует модуль бота app заново) и раздает им апдейты.
+    # initializer(*initargs) вызывается в воркере до импорта бота.
+    # on_done(update_id) - апдейт обработан воркером.
+
+    def __init__(self, bot, processes, app='app', initializer=None, initargs=(),
+                 on_done=None):
+        self.bot = bot
+        self.processes = processes
+        self.app = app
+        self.initializer = initializer
+        self.initargs = initargs
+        self.on_done = on_done
+        self.closed = True
+        self.lost = asyncio.Event()
+        self._workers = []
+        self._writers = [None] * processes
+        self._readers = []
+        self._sent = [0] * processes
+        self._done = [0] * processes
+
+    async def start(self, timeout=60):
+        tmp = tempfile.mkdtemp(prefix='bot-workers-')
+        address = os.path.join(tmp, 'front.sock')
+        ready = asyncio.get_running_loop().create_future()
+        connected = []
+
+        async def accept(reader, writer):
+            _, number = await read_frame(reader)
+            self._writers[number] = writer
+            self._readers.append(asyncio.ensure_future(self._read(number, reader)))
+            connected.append(number)
+            if len(connected) == self.processes and not ready.done():
+                ready.set_result(None)
+
+        server = await asyncio.start_unix_server(accept, address)
+        settings = {name: value for name, value in vars(config).items() if name.isupper()}
+        context = multiprocessing.get_context('spawn')
+        for number in range(self.processes):
+            process = context.Process(
+                target=worker_main, name=f'bot-worker-{number}',
+                args=(number, self.processes, address, self.app, settings,
+                      self.initializer, self.initargs))
+            process.start()
+            self._workers.append(process)
+
+        try:
+            await asyncio.wait_for(ready, timeout)
+        finally:
+            server.close()
+            await server.wait_closed()
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.closed = False
+        log.info('Started %s worker processes', self.processes)
+
+    async def _read(self, number, reader):
+        while True:
+            message = await read_frame(reader)
+            if message is None:
+                break
+            if message[0] == 'done':
+                self._done[number] += 1
+                if self.on_done is not None:
+                    self.on_done(message[1])
+            elif message[0] == 'call':
+                for other, writer in enumerate(self._writers):
+                    if other != number and writer is not None and not writer.is_closing():
+                        write_frame(writer, message)
+
+        if not self.closed:
+            log.error('Worker %s exited', number)
+            self.lost.set()
+
+    async def put(self, update):
+        # Ждет, пока воркер вычитает очередь сокета: медленный воркер
+        # притормаживает получение апдейтов, а не копит их в памяти
+        number = shard_key(update) % self.processes
+        writer = self._writers[number]
+        write_frame(writer, ('update', update))
+        self._sent[number] += 1
+        await writer.drain()
+
+    async def poll(self, timeout=20):
+        # Как Dispatcher.start_polling, но сырые апдейты сразу уходят воркерам
+        await self.bot.delete_webhook()
+        request_timeout = None
+        if self.bot.timeout is not sentinel and timeout is not None:
+            request_timeout = self.bot.timeout.total + timeout
+
+        offset = None
+        try:
+            while True:
+                try:
+                    payload = {'timeout': timeout} if offset is None else \
+                        {'offset': offset, 'timeout': timeout}
+                    with self.bot.request_timeout(request_timeout):
+                        updates = await self.bot.request(api.Methods.GET_UPDATES, payload)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception('Cause exception while getting updates.')
+                    await asyncio.sleep(5)
+                    continue
+
+                for update in updates:
+                    offset = update['update_id'] + 1
+                    await self.put(update)
+        finally:
+            # Подтверждаем Telegram уже разданные апдейты, иначе после
+            # перезапуска он пришлет их снова
+            if offset is not None:
+                try:
+                    await self.bot.request(api.Methods.GET_UPDATES,
+                                           {'offset': offset, 'limit': 1, 'timeout': 0})
+                except Exception:
+                    log.exception('Failed to confirm updates')
+
+    async def stop(self, timeout=None):
+        # Воркеры получают конец потока, дорабатывают принятые апдейты
+        # и закрывают соединение
+        self.closed = True
+        for writer in self._writers:
+            if writer is not None and writer.can_write_eof():
+                writer.write_eof()
+        try:
+            await asyncio.wait_for(asyncio.gather(*self._readers), timeout)
+        except asyncio.TimeoutError:
+            log.warning('Workers did not stop in %s s', timeout)
+
+        loop = asyncio.get_running_loop()
+        for process in self._workers:
+            await loop.run_in_executor(None, process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        for writer in self._writers:
+            if writer is not None:
+                writer.close()
+        log.info('Workers: %s', self.stats())
+
+    def stats(self):
+        return {
+            'processes': self.processes,
+            'sent': sum(self._sent),
+            'in_flight': sum(self._sent) - sum(self._done),
+            'max_share': max(self._sent) / sum(self._sent) if sum(self._sent) else 0.0,
+        }
+
+
+def worker_main(number, processes, address, app, settings, initializer, initargs):
+    # Точка входа процесса-воркера. Он завершается, когда Front закрывает
+    # соединение; сигналы остановки (Ctrl+C приходит всей группе процессов)
+    # обрабатывает только Front.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    vars(config).update(settings)
+    # У каждого воркера свои метрики: METRICS_PORT, METRICS_PORT + 1, ...
+    if config.METRICS_PORT is not None:
+        config.METRICS_PORT += number
+    if initializer is not None:
+        initializer(*initargs)
+
+    # Если бот запущен как python app.py, spawn уже выполнил этот файл как
+    # __mp_main__: второй импорт под именем app зарегистрировал бы его
+    # хендлеры повторно
+    main = sys.modules.get('__mp_main__')
+    spec = importlib.util.find_spec(app)
+    if main is not None and spec is not None and spec.origin is not None and \
+            os.path.abspath(getattr(main, '__file__', '')) == os.path.abspath(spec.origin):
+        sys.modules.setdefault(app, main)
+    bot_module = importlib.import_module(app)
+    loader = importlib.import_module('loader')
+    # Общий лимит Telegram - на бота, поэтому делится между процессами.
+    # Лимит на чат остается прежним: чат обслуживает один процесс.
+    loader.sender.set_global_rate(config.SEND_GLOBAL_RATE / processes)
+
+    dispatcher = bot_module.dp
+    dispatcher.loop.run_until_complete(serve_worker(
+        dispatcher, loader.peers, loader.sender, number, address,
+        bot_module.on_startup, bot_module.on_shutdown))
+
+
+async def serve_worker(dispatcher, peers, sender, number, address, on_startup, on_shutdown):
+    Bot.set_current(dispatcher.bot)
+    Dispatcher.set_current(dispatcher)
+    await on_startup(dispatcher)
+
+    reader, writer = await asyncio.open_unix_connection(address)
+    peers.connect(writer)
+    queue = UpdateQueue(dispatcher, config.WEBHOOK_WORKERS, config.WEBHOOK_QUEUE_SIZE,
+                        on_done=lambda update: write_frame(writer, ('done', update.update_id)),
+                        key=chat_key)
+    queue.start()
+    write_frame(writer, ('hello', number))
+
+    while True:
+        message = await read_frame(reader)
+        if message is None:
+            break
+        if message[0] == 'update':
+            await queue.put_wait(types.Update(**message[1]))
+        elif message[0] == 'call':
+            peers.apply(*message[1:])
+
+    await queue.drain(config.WEBHOOK_DRAIN_TIMEOUT)
+    log.info('Worker %s: %s', number, queue.stats())
+    await on_shutdown(dispatcher)
+    await sender.close()
+    await dispatcher.storage.close()
+    await dispatcher.storage.wait_closed()
+    await dispatcher.bot.close()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def handle_update(request):
+    front = request.app['front']
+    if front.closed:
+        return web.Response(status=503, headers={'Retry-After': '1'})
+    await front.put(await request.json())
+    return web.Response()
+
+
+async def run_front(front, webhook_path=None, webhook_url=None, host=None, port=None,
+                    drain_timeout=30, on_startup=None, on_shutdown=None):
+    # webhook_path None - получать апдейты через getUpdates
+    if on_startup is not None:
+        await on_startup()
+    await front.start()
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in signal.SIGINT, signal.SIGTERM:
+        loop.add_signal_handler(sig, stop.set)
+
+    if webhook_path is None:
+        receiver = asyncio.ensure_future(front.poll())
+    else:
+        app = web.Application()
+        app['front'] = front
+        app.router.add_post(webhook_path, handle_update)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        if webhook_url is not None:
+            await front.bot.set_webhook(webhook_url)
+
+    waiters = [asyncio.ensure_future(stop.wait()), asyncio.ensure_future(front.lost.wait())]
+    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    for waiter in waiters:
+        waiter.cancel()
+
+    if webhook_path is None:
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+    else:
+        await runner.cleanup()
+    await front.stop(drain_timeout)
+    if on_shutdown is not None:
+        await on_shutdown()
+    await front.bot.close()
+
+
+def start_workers(dispatcher, processes, app='app', **kwargs):
+    # Бот и его сессия созданы в loader на текущем цикле событий
+    front = Front(dispatcher.bot, processes, app)
+    dispatcher.loop.run_until_complete(run_front(front, **kwargs))